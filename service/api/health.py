@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import ORJSONResponse
+
+health_router = APIRouter()
+
+# Liveness: the process is up and serving, even while it is still starting
+@health_router.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+# Readiness: the index is open and warm and the LLM client is ready; 503 until then, with the startup profile
+@health_router.get("/readyz", include_in_schema=False)
+async def readyz(request: Request):
+    startup = request.app.state.startup
+    return ORJSONResponse(startup.report(), status_code=200 if startup.ready else 503)
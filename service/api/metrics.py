@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from core.metrics import render
+
+metrics_router = APIRouter()
+
+# Prometheus scrape endpoint: stage latencies, request counts, LLM tokens and answer cache lookups
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -1,12 +1,327 @@
-from fastapi import APIRouter, Depends
+import os, json, hashlib
+from typing import Optional
+import orjson
+from fastapi import APIRouter, Depends, Request, HTTPException, Response
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from starlette.background import BackgroundTask
 from core.openapi import openapi_validation_dependency  # Import the dependency
-from core.llm import askLLM
+from core.llm import askLLMAsync, askLLMStream, askLLMBatch
+from core.limits import OverloadedError
+from core.cache import cache_enabled, normalize_question
+from core.coalesce import coalesce_enabled
+from core.sessions import sessions_enabled
+from core.resilience import set_deadline, DeadlineExceeded, CircuitOpenError
+from core.metrics import stage
+from core.sections import section_filter
+from core.vectors import aget_chunks
+
+max_batch_size = int(os.getenv('MAX_BATCH_SIZE', '1000'))
+max_chunk_batch = int(os.getenv('MAX_CHUNK_BATCH', '100'))
+
+# full: references and their text; refs: chunk ids, scores, pages and sections only; none: the answer only
+context_modes = ("full", "refs", "none")
 
 # Create a new router for /api endpoints
 api_router = APIRouter()
 
+# Shared clients, or a 503 while the service is still starting (see /readyz)
+def get_resources(request: Request):
+    resources = getattr(request.app.state, "resources", None)
+    if resources is None:
+        raise HTTPException(status_code=503, detail="The service is starting, retry shortly", headers={"Retry-After": "2"})
+    return resources
+
+# The requested collection id, or a 404 before any slot or collection is taken
+def get_document_id(data: dict, resources) -> str:
+    document_id = data.get('document_id')
+    try:
+        return resources.registry.get(document_id).id
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown document_id: {document_id}")
+
+# The conversation a question continues, or a 404 when it expired or never existed
+def get_session(data: dict, resources):
+    session_id = data.get('session_id')
+    if session_id is None:
+        return None
+    session = resources.sessions.get(session_id) if sessions_enabled else None
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    if data.get('document_id') not in (None, session.document_id):
+        raise HTTPException(status_code=400, detail=f"Session {session_id} is about document {session.document_id}")
+    return session
+
+# Optional per-request deadline for the LLM call, in milliseconds
+def apply_deadline(data: dict):
+    deadline_ms = data.get('deadline_ms')
+    if deadline_ms is not None:
+        if not isinstance(deadline_ms, (int, float)) or deadline_ms <= 0:
+            raise HTTPException(status_code=400, detail="deadline_ms must be a positive number")
+        set_deadline(deadline_ms / 1000)
+
+# Optional section and page range the answer must come from, as a where clause for retrieval
+def get_filter(data: dict):
+    section = data.get('section')
+    if section is not None and not (isinstance(section, str) or (isinstance(section, list) and all(isinstance(name, str) for name in section))):
+        raise HTTPException(status_code=400, detail="section must be a section name or a list of names")
+    pages = data.get('pages')
+    if pages is not None:
+        if not (isinstance(pages, list) and len(pages) == 2 and all(isinstance(page, int) and page >= 1 for page in pages) and pages[0] <= pages[1]):
+            raise HTTPException(status_code=400, detail="pages must be [first, last] page numbers, starting at 1")
+    return section_filter(section, pages)
+
+def get_context_mode(data: dict) -> str:
+    mode = data.get('context_mode', 'full')
+    if mode not in context_modes:
+        raise HTTPException(status_code=400, detail=f"context_mode must be one of {', '.join(context_modes)}")
+    return mode
+
+# The same answer in the shape the client asked for; answers cached before references existed have none
+def shape_response(result: dict, mode: str) -> dict:
+    if mode == "full":
+        return result
+    shaped = {key: value for key, value in result.items() if key not in ("context", "references")}
+    if mode == "refs":
+        shaped["references"] = result.get("references", [])
+    return shaped
+
+# Identical questions to the same document and sections asked at the same time share one answer
+def flight_key(document_id: str, question: str, filter: dict = None) -> tuple:
+    return (document_id, normalize_question(question), json.dumps(filter, sort_keys=True) if filter else None)
+
 # Example endpoint for /api/query, applying the OpenAPI validation dependency via Depends
 @api_router.post("/query", dependencies=[Depends(openapi_validation_dependency)])
-async def query(data: dict):
-    response = askLLM(data['query'])
-    return response
\ No newline at end of file
+async def query(data: dict, request: Request):
+    resources = get_resources(request)
+    session = get_session(data, resources)
+    document_id = get_document_id({'document_id': session.document_id} if session else data, resources)
+    apply_deadline(data)
+    filter = get_filter(data)
+    mode = get_context_mode(data)
+    key = flight_key(document_id, data['query'], filter)
+
+    async def compute():
+        async with resources.registry.use(document_id) as collection:
+            return await askLLMAsync(
+                data['query'], llm=resources.llm, vectorstore=collection.vectorstore, cache=collection.cache,
+                lexical_index=collection.lexical_index, prompt=collection.prompt, filter=filter, session=session
+            )
+
+    try:
+        if session is not None:
+            # Each turn builds on the one before, so a conversation answers one question at a time and shares none
+            async with resources.sessions.lock(session.id), resources.limiter:
+                response = await compute()
+                resources.sessions.save(session)
+            response = {**response, "session": session.status()}
+        elif coalesce_enabled and resources.flights.in_flight(key):
+            # Joining an answer already being computed costs nothing, so it takes no query slot
+            response = await resources.flights.do(key, compute)
+        else:
+            async with resources.limiter:
+                response = await (resources.flights.do(key, compute) if coalesce_enabled else compute())
+    except OverloadedError as e:
+        # Backpressure: tell the client to retry rather than queueing without bound
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except CircuitOpenError as e:
+        # Upstream is unhealthy and there is no fallback model: fail fast instead of waiting on it
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(int(e.retry_after), 1))})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    # Serialize here rather than in FastAPI so the time shows up as its own stage
+    with stage("serialize"):
+        return ORJSONResponse(shape_response(response, mode))
+
+# Format one Server-Sent Event
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+# Streaming variant of /api/query: context first, then answer tokens as Server-Sent Events
+@api_router.post("/query/stream", dependencies=[Depends(openapi_validation_dependency)])
+async def query_stream(data: dict, request: Request):
+    resources = get_resources(request)
+    session = get_session(data, resources)
+    document_id = get_document_id({'document_id': session.document_id} if session else data, resources)
+    apply_deadline(data)
+    filter = get_filter(data)
+    mode = get_context_mode(data)
+    key = flight_key(document_id, data['query'], filter)
+    # Conversations never share a stream
+    coalesce = coalesce_enabled and session is None
+
+    async def produce():
+        async with resources.registry.use(document_id) as collection:
+            async for message in askLLMStream(
+                data['query'], llm=resources.llm, vectorstore=collection.vectorstore, cache=collection.cache,
+                lexical_index=collection.lexical_index, prompt=collection.prompt, filter=filter, session=session
+            ):
+                yield message
+
+    # The turn is recorded before the done event, so the client can ask its next question as soon as it arrives
+    async def produce_turn():
+        async with resources.sessions.lock(session.id):
+            async for message in produce():
+                if message['event'] == "done":
+                    resources.sessions.save(session)
+                    message = {**message, "data": {**message['data'], "session": session.status()}}
+                yield message
+
+    try:
+        if coalesce:
+            # Starting a stream takes a query slot until its answer is done; listeners of one already running replay it
+            # and take none. A listener's deadline covers the wait for the first answer token, as it does for the LLM call.
+            messages = await resources.flights.stream(
+                key, produce, on_start=resources.limiter.acquire, on_finish=resources.limiter.release,
+                settled=lambda message: message['event'] != "context"
+            )
+        else:
+            await resources.limiter.acquire()
+            messages = produce_turn() if session is not None else produce()
+    except OverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    async def event_stream():
+        try:
+            async for message in messages:
+                if message['event'] == "context":
+                    # Every listener of a shared stream gets the context in its own mode
+                    if mode == "refs":
+                        yield format_sse("references", message.get('references', []))
+                    elif mode == "full":
+                        yield format_sse("context", message['data'])
+                    continue
+                yield format_sse(message['event'], message['data'])
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            yield format_sse("error", {"detail": str(e)})
+        except Exception as e:
+            print(f"Error while streaming response: {e}")
+            yield format_sse("error", {"detail": "An error occurred while processing your query."})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Hold the query slot until the stream is finished or the client disconnects; a shared stream holds its own
+        background=None if coalesce else BackgroundTask(resources.limiter.release)
+    )
+
+# Many questions in one request: retrieval is batched, answers come back as NDJSON lines as they finish
+@api_router.post("/query/batch", dependencies=[Depends(openapi_validation_dependency)])
+async def query_batch(data: dict, request: Request):
+    resources = get_resources(request)
+    questions = data.get('queries')
+    if not isinstance(questions, list) or not questions or not all(isinstance(question, str) for question in questions):
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list of strings")
+    if len(questions) > max_batch_size:
+        raise HTTPException(status_code=413, detail=f"At most {max_batch_size} queries per batch")
+    document_id = get_document_id(data, resources)
+    filter = get_filter(data)
+    mode = get_context_mode(data)
+    # The whole batch takes one query slot; its LLM calls are limited by BATCH_CONCURRENCY
+    try:
+        await resources.limiter.acquire()
+    except OverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    try:
+        collection = await resources.registry.acquire(document_id)
+    except BaseException:
+        resources.limiter.release()
+        raise
+
+    async def result_lines():
+        async for result in askLLMBatch(
+            questions, llm=resources.llm, vectorstore=collection.vectorstore, cache=collection.cache,
+            lexical_index=collection.lexical_index, prompt=collection.prompt, filter=filter
+        ):
+            yield orjson.dumps(shape_response(result, mode)) + b"\n"
+
+    def release():
+        resources.registry.release(collection)
+        resources.limiter.release()
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+# Documents that can be queried, with whether each one is loaded right now
+@api_router.get("/documents")
+async def documents(request: Request):
+    return get_resources(request).registry.list()
+
+# Sections of a document that questions can be limited to, from its table of contents
+@api_router.get("/sections")
+async def sections(request: Request, document_id: Optional[str] = None):
+    resources = get_resources(request)
+    async with resources.registry.use(get_document_id({'document_id': document_id}, resources)) as collection:
+        return collection.section_index.describe() if collection.section_index is not None else []
+
+# Chunk ids are hashes of their content and location, so a chunk behind an id never changes
+def chunk_response(request: Request, content, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(content, headers=headers)
+
+# Text and metadata of one chunk referenced by a refs-mode answer
+@api_router.get("/chunks/{chunk_id}")
+async def chunk(chunk_id: str, request: Request, document_id: Optional[str] = None):
+    resources = get_resources(request)
+    async with resources.registry.use(get_document_id({'document_id': document_id}, resources)) as collection:
+        chunks = await aget_chunks(collection.vectorstore, [chunk_id])
+    if not chunks:
+        raise HTTPException(status_code=404, detail=f"Unknown chunk: {chunk_id}")
+    return chunk_response(request, chunks[0], f'"{chunk_id}"')
+
+# Several chunks in one request: ?ids=a,b,c
+@api_router.get("/chunks")
+async def chunks(request: Request, ids: str, document_id: Optional[str] = None):
+    resources = get_resources(request)
+    chunk_ids = list(dict.fromkeys(id for id in ids.split(",") if id))
+    if not chunk_ids:
+        raise HTTPException(status_code=400, detail="ids must list at least one chunk id")
+    if len(chunk_ids) > max_chunk_batch:
+        raise HTTPException(status_code=413, detail=f"At most {max_chunk_batch} chunks per request")
+    async with resources.registry.use(get_document_id({'document_id': document_id}, resources)) as collection:
+        found = await aget_chunks(collection.vectorstore, chunk_ids)
+    found_ids = {chunk['id'] for chunk in found}
+    content = {"chunks": found, "missing": [id for id in chunk_ids if id not in found_ids]}
+    if content["missing"]:
+        # Missing ids may exist after the next index build, don't let anyone cache the gap
+        return ORJSONResponse(content, headers={"Cache-Control": "no-store"})
+    return chunk_response(request, content, f'"{hashlib.sha256(",".join(chunk_ids).encode("utf-8")).hexdigest()[:32]}"')
+
+def get_known_session(session_id: str, resources):
+    session = resources.sessions.get(session_id) if sessions_enabled else None
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    return session
+
+# Start a conversation: pass the session_id with each question and follow-ups are answered with what came before
+@api_router.post("/sessions", dependencies=[Depends(openapi_validation_dependency)])
+async def create_session(request: Request, data: Optional[dict] = None):
+    resources = get_resources(request)
+    if not sessions_enabled:
+        raise HTTPException(status_code=404, detail="Sessions are disabled")
+    document_id = get_document_id(data or {}, resources)
+    return ORJSONResponse(resources.sessions.create(document_id).describe(), status_code=201)
+
+# The turns, summary and chunk ids a conversation has so far
+@api_router.get("/sessions/{session_id}")
+async def session_detail(session_id: str, request: Request):
+    return ORJSONResponse(get_known_session(session_id, get_resources(request)).describe())
+
+@api_router.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str, request: Request):
+    resources = get_resources(request)
+    if not (sessions_enabled and resources.sessions.delete(session_id)):
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    return Response(status_code=204)
+
+# Answer and embedding cache hit and miss counters
+@api_router.get("/cache/stats")
+async def cache_stats(request: Request, document_id: Optional[str] = None):
+    resources = get_resources(request)
+    collection = resources.registry.get(get_document_id({'document_id': document_id}, resources))
+    embedding_stats = resources.registry.embeddings.get_stats()
+    # A collection that is not open has no answer cache yet
+    if collection.cache is None:
+        return {"enabled": cache_enabled, "embeddings": embedding_stats}
+    return {"enabled": True, **collection.cache.get_stats(), "embeddings": embedding_stats}
@@ -1,12 +1,22 @@
-import os
-import core.document
-from contextlib import asynccontextmanager
+import time
+started_at = time.perf_counter()  # Start of the startup profile, before the imports below
+
+import os, asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from api.query import api_router  # Import API router from the query file
-from core.openapi import custom_openapi  # Import custom OpenAPI schema override
-from core.vectors import split_document_into_chunks, load_summaries_from_json, store_all_chunks_in_chroma
+from api.metrics import metrics_router
+from api.health import health_router
+from core.openapi import custom_openapi, load_validator  # Import custom OpenAPI schema override
+from core.resources import Resources, warm_up_on_start
+from core.registry import CollectionRegistry, collections_file
+from core.metrics import TimingMiddleware
+from core.startup import StartupProfile, index_on_start
+from core.artifacts import check_index
+from core import vectors
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -15,33 +25,64 @@ file_name = os.getenv('DOCUMENT')
 db_path = os.getenv('CHROMA_PATH')
 summary_file_path = os.getenv('SUMMARY')
 
+startup = StartupProfile(started_at)
+startup.record("imports", time.perf_counter() - started_at)
+
+def build_default_index():
+    from core.indexer import build_index  # Brings in pypdf and the text splitter
+    print("STARTING - Checking the index...")
+    build_index(file_name, summary_file_path, persist_directory=db_path)
+
+# Everything the first question needs, in the background so the server answers /healthz meanwhile.
+# The API returns 503 and /readyz reports progress until it is done.
+async def prepare(app: FastAPI):
+    # Slow imports and file work run on worker threads, the event loop keeps serving the probes
+    try:
+        with startup.phase("registry"):
+            registry = await asyncio.to_thread(CollectionRegistry.from_env)
+        # Add new or changed chunks and drop stale ones; returns right away when the manifest matches.
+        # With a collections file, collections are indexed ahead of time with python -m core.indexer --all
+        if index_on_start and not collections_file:
+            with startup.phase("index"):
+                await asyncio.to_thread(build_default_index)
+        else:
+            with startup.phase("index"):
+                for collection in registry.collections.values():
+                    check_index(collection.chroma_path, {"embedding_model": vectors.embedding_model, "vector_backend": vectors.vector_backend})
+
+        # Open the shared LLM client and collection registry once for the life of the app
+        with startup.phase("resources"):
+            resources = await asyncio.to_thread(Resources(registry).open)
+        app.state.pending_resources = resources
+        with startup.phase("validation"):
+            await asyncio.to_thread(load_validator)
+        if warm_up_on_start:
+            with startup.phase("warm_up"):
+                await resources.warm_up()
+        app.state.resources = resources
+        startup.mark_ready()
+    except Exception as e:
+        startup.mark_failed(e)
+
 # Lifespane logic for start and termination
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # If the DB exists, do nothing, otherwise load the data
-    if os.path.exists(db_path):
-        print("Ready to load existing Chroma DB...")
-    else:
-        # Startup logic: Load the document
-        print("STARTING - Loading document...")
-        documents = core.document.load_document(file_name)
-
-        # Step 1: Split the main document into chunks
-        print("Splitting document into chunks...")
-        chunks = split_document_into_chunks(documents)
-
-        # Step 2: Load summaries from docSummary.json
-        print("Loading summaries...")
-        summary_chunks = load_summaries_from_json(summary_file_path)
-
-        # Step 3: Store all chunks (document + summaries) in Chroma in a unified pass
-        print("Storing all chunks (document and summaries) in Chroma DB...")
-        store_all_chunks_in_chroma(chunks, summary_chunks, persist_directory=db_path)
+    app.state.startup = startup
+    app.state.resources = None
+    app.state.pending_resources = None
+    task = asyncio.create_task(prepare(app))
 
     yield
 
+    # Termination logic: stop a startup still in progress and release pooled connections
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+    if app.state.pending_resources is not None:
+        await app.state.pending_resources.aclose()
+
 # Initialize the FastAPI app
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)  # orjson encodes responses several times faster
 
 # Set the custom OpenAPI schema
 app.openapi = custom_openapi  # Use the custom OpenAPI schema
@@ -49,6 +90,12 @@ app.openapi = custom_openapi  # Use the custom OpenAPI schema
 # Include the /api router under the /api path
 app.include_router(api_router, prefix="/api")
 
+# Prometheus metrics at /metrics, registered before the static mount below takes over "/"
+app.include_router(metrics_router)
+
+# Liveness and readiness probes at /healthz and /readyz
+app.include_router(health_router)
+
 # Allow specific origins (e.g., frontend URL)
 origins = [
     "http://localhost:5173", #svelte dev mode
@@ -65,8 +112,12 @@ app.add_middleware(
     allow_credentials=True,  # Allows cookies or Authorization headers
     allow_methods=["*"],  # Allows all HTTP methods (e.g., GET, POST)
     allow_headers=["*"],  # Allows all headers (e.g., Content-Type, Authorization)
+    expose_headers=["Server-Timing"],  # Lets the UI read the per-stage timings
 )
 
+# Per-stage timings in a Server-Timing header and request metrics for /api
+app.add_middleware(TimingMiddleware)
+
 '''
 @app.get("/")
 async def read_root():
@@ -0,0 +1,46 @@
+import sys, json, argparse
+
+# Metrics where a smaller number is the better result; everything else is better when larger
+lower_is_better = ("_ms", "seconds", "peak_rss_mb")
+
+def flatten(values: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in values.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    rows = []
+    for scenario, new_result in new["scenarios"].items():
+        base_values = flatten(base["scenarios"].get(scenario, {}))
+        for name, value in flatten(new_result).items():
+            if name not in base_values:
+                continue
+            before = base_values[name]
+            change = (value - before) / before * 100 if before else 0.0
+            worse = change > threshold if name.endswith(lower_is_better) else change < -threshold
+            rows.append((f"{scenario}.{name}", before, value, change, worse))
+    return rows
+
+# Compare two results files from benchmarks.run: python -m benchmarks.compare base.json new.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark results files.")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported as a regression")
+    args = parser.parse_args()
+    with open(args.base, "r") as f:
+        base = json.load(f)
+    with open(args.new, "r") as f:
+        new = json.load(f)
+
+    print(f"{base.get('commit')} -> {new.get('commit')}")
+    rows = compare(base, new, args.threshold)
+    for name, before, value, change, worse in rows:
+        print(f"{name:55} {before:>12} {value:>12} {change:>+8.1f}%{'  REGRESSION' if worse else ''}")
+    # Non-zero exit so CI can fail on a regression
+    sys.exit(1 if any(row[4] for row in rows) else 0)
@@ -0,0 +1,101 @@
+import time, asyncio, hashlib, random
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Words the fake chat model answers with; any fixed list works, only determinism matters
+vocabulary = (
+    "the section describes policy agency budget review page document requirement federal program report "
+    "authority staff process committee guidance standard office plan proposal change support funding"
+).split()
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for OpenAIEmbeddings: the same text always gets the same unit vector.
+    Each request sleeps latency seconds plus per_text seconds for every text in it.
+    """
+
+    def __init__(self, dimensions: int = 256, latency: float = 0.05, per_text: float = 0.0005):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text = per_text
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency + self.per_text * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency + self.per_text * len(texts))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatOpenAI. The answer depends only on the prompt; it arrives after
+    latency seconds (time to first token) and then streams at tokens_per_second.
+    """
+
+    model_name: str = "fake-chat"
+    latency: float = 0.5
+    tokens_per_second: float = 80.0
+    response_tokens: int = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _prompt(self, messages: List[BaseMessage]) -> str:
+        return "\n".join(str(message.content) for message in messages)
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        rng = random.Random(_seed(self._prompt(messages)))
+        return [rng.choice(vocabulary) + " " for _ in range(self.response_tokens)]
+
+    def _duration(self) -> float:
+        return self.latency + self.response_tokens / self.tokens_per_second
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._duration())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._tokens(messages))))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._duration())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._tokens(messages))))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        time.sleep(self.latency)
+        for token in self._tokens(messages):
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(messages):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+def install(llm: BaseChatModel, embeddings: Embeddings):
+    """
+    Swap the fakes in for OpenAI: every vector store opened afterwards embeds with `embeddings`
+    (behind the usual CachedEmbeddings) and Resources.open() gets `llm` from initialize_llm.
+    """
+    import core.vectors, core.llm, core.resources
+    from core.embeddings import CachedEmbeddings
+    core.vectors.embeddings = CachedEmbeddings(embeddings, model_name="fake-embedding")
+    core.llm.initialize_llm = lambda *args, **kwargs: llm
+    core.resources.initialize_llm = core.llm.initialize_llm
@@ -0,0 +1,380 @@
+import os, sys, json, time, asyncio, argparse, platform, resource, subprocess, tempfile
+from pathlib import Path
+import numpy as np
+
+# Benchmarks run from ./service with: python -m benchmarks.run
+service_root = Path(__file__).resolve().parent.parent
+scenarios = ["ingest", "summarize", "query", "session", "vectors", "startup"]
+
+def latency_stats(latencies: list) -> dict:
+    # Milliseconds; empty when nothing was measured
+    if not latencies:
+        return {}
+    values = np.asarray(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2)
+    }
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def git_commit() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=service_root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--", "."], cwd=service_root, capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": None}
+
+def prepare_inputs(args, workdir: str) -> dict:
+    from benchmarks.synthetic import write_pdf, make_sections, write_sections, write_summary
+    pdf_path = os.path.join(workdir, "bench.pdf")
+    sections_path = os.path.join(workdir, "sections.json")
+    summary_path = os.path.join(workdir, "summary.json")
+    write_pdf(pdf_path, args.pages, args.words_per_page, seed=args.seed)
+    sections = make_sections(args.pages, seed=args.seed)
+    write_sections(sections_path, sections)
+    write_summary(summary_path, sections)
+    # The service resolves document paths relative to ./service
+    return {
+        "document": os.path.relpath(pdf_path, service_root),
+        "summary": os.path.relpath(summary_path, service_root),
+        "sections": sections
+    }
+
+def run_ingest(args, workdir: str) -> dict:
+    from core.pagestore import open_pages
+    from core.vectors import split_document_into_chunks, load_summaries_from_json, store_all_chunks_in_chroma
+    inputs = prepare_inputs(args, workdir)
+    persist_directory = os.path.join(workdir, "chroma")
+
+    def ingest() -> tuple:
+        start_time = time.perf_counter()
+        # Chunks are split lazily, so the pages stay open until they are all stored
+        with open_pages(inputs["document"]) as pages:
+            chunks = split_document_into_chunks(iter(pages))
+            vectorstore = store_all_chunks_in_chroma(chunks, load_summaries_from_json(inputs["summary"]), persist_directory=persist_directory)
+        return time.perf_counter() - start_time, vectorstore._collection.count()
+
+    seconds, chunk_count = ingest()
+    # Second pass over unchanged input: every chunk is already stored, nothing is embedded
+    resync_seconds, _ = ingest()
+    return {
+        "pages": args.pages,
+        "chunks": chunk_count,
+        "seconds": round(seconds, 3),
+        "pages_per_second": round(args.pages / seconds, 1),
+        "chunks_per_second": round(chunk_count / seconds, 1),
+        "resync_seconds": round(resync_seconds, 3),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def run_summarize(args, workdir: str) -> dict:
+    import core.llm
+    from core.pagestore import open_pages
+    from processing.summarize import process_section, summarize_sections
+    inputs = prepare_inputs(args, workdir)
+    llm = core.llm.initialize_llm()  # The fake installed by run_scenario
+    with open_pages(inputs["document"]) as documents:
+        latencies = []
+        start_time = time.perf_counter()
+        for section in inputs["sections"]:
+            section_start = time.perf_counter()
+            process_section(dict(section), documents, llm)
+            latencies.append(time.perf_counter() - section_start)
+        sequential_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        asyncio.run(summarize_sections([dict(section) for section in inputs["sections"]], documents, llm))
+        concurrent_seconds = time.perf_counter() - start_time
+
+    return {
+        "sections": len(inputs["sections"]),
+        "latency": latency_stats(latencies),
+        "sequential_seconds": round(sequential_seconds, 3),
+        "sequential_sections_per_second": round(len(latencies) / sequential_seconds, 2),
+        "concurrent_seconds": round(concurrent_seconds, 3),
+        "concurrent_sections_per_second": round(len(latencies) / concurrent_seconds, 2),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+async def open_api(inputs: dict, persist_directory: str):
+    from fastapi import FastAPI
+    from api.query import api_router
+    from core.registry import CollectionRegistry, Collection
+    from core.resources import Resources
+
+    # The API router without the static UI mounts of app.py
+    app = FastAPI()
+    app.include_router(api_router, prefix="/api")
+    registry = CollectionRegistry([Collection("bench", "Benchmark Document", inputs["document"], inputs["summary"], persist_directory)])
+    resources = Resources(registry).open()
+    await resources.warm_up()
+    app.state.resources = resources
+    return app, resources
+
+async def query_load(args, inputs: dict, persist_directory: str) -> dict:
+    import httpx
+    from benchmarks.synthetic import questions
+
+    app, resources = await open_api(inputs, persist_directory)
+    pending = questions(args.requests, seed=args.seed)
+    latencies = []
+    statuses = {}
+
+    async def worker(client: httpx.AsyncClient):
+        while pending:
+            question = pending.pop()
+            request_start = time.perf_counter()
+            response = await client.post("/api/query", json={"query": question})
+            latencies.append(time.perf_counter() - request_start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        seconds = time.perf_counter() - start_time
+    await resources.aclose()
+
+    return {
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "latency": latency_stats(latencies),
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(latencies) / seconds, 2)
+    }
+
+def run_query(args, workdir: str) -> dict:
+    from core.indexer import build_index
+    inputs = prepare_inputs(args, workdir)
+    persist_directory = os.path.join(workdir, "chroma")
+    build_index(inputs["document"], inputs["summary"], persist_directory=persist_directory)
+    result = asyncio.run(query_load(args, inputs, persist_directory))
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+async def session_load(args, inputs: dict, persist_directory: str) -> dict:
+    import httpx
+    from core.metrics import llm_tokens
+    from benchmarks.synthetic import questions
+
+    app, resources = await open_api(inputs, persist_directory)
+    # A conversation that keeps going: a new question, then follow-ups that reuse or extend its context
+    followups = ["Why?", "Tell me more about that.", "What about page {page}?"]
+    asked = questions(args.turns, seed=args.seed)
+    turns = []
+
+    def prompt_tokens() -> float:
+        with llm_tokens.lock:
+            return llm_tokens.values.get(("query", "input"), 0)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        session_id = (await client.post("/api/sessions", json={})).json()["session_id"]
+        for turn in range(args.turns):
+            question = asked[turn] if turn % 4 == 0 else followups[turn % 4 - 1].format(page=turn + 1)
+            tokens_before = prompt_tokens()
+            request_start = time.perf_counter()
+            response = await client.post("/api/query", json={"query": question, "session_id": session_id, "context_mode": "none"})
+            seconds = time.perf_counter() - request_start
+            turns.append({"seconds": seconds, "prompt_tokens": prompt_tokens() - tokens_before, "retrieval": response.json()["session"]["retrieval"]})
+        history_tokens = (await client.get(f"/api/sessions/{session_id}")).json()["history_tokens"]
+    await resources.aclose()
+
+    # Flat means the last turns cost about what the first ones did
+    quarter = max(len(turns) // 4, 1)
+    by_retrieval = {}
+    for turn in turns:
+        by_retrieval.setdefault(turn["retrieval"], []).append(turn["seconds"])
+    return {
+        "turns": len(turns),
+        "latency": latency_stats([turn["seconds"] for turn in turns]),
+        "latency_by_retrieval": {mode: latency_stats(latencies) for mode, latencies in sorted(by_retrieval.items())},
+        "first_quarter_prompt_tokens": round(float(np.mean([turn["prompt_tokens"] for turn in turns[:quarter]])), 1),
+        "last_quarter_prompt_tokens": round(float(np.mean([turn["prompt_tokens"] for turn in turns[-quarter:]])), 1),
+        "first_quarter_latency_ms": round(float(np.mean([turn["seconds"] for turn in turns[:quarter]])) * 1000, 2),
+        "last_quarter_latency_ms": round(float(np.mean([turn["seconds"] for turn in turns[-quarter:]])) * 1000, 2),
+        "history_tokens": history_tokens
+    }
+
+def run_session(args, workdir: str) -> dict:
+    from core.indexer import build_index
+    inputs = prepare_inputs(args, workdir)
+    persist_directory = os.path.join(workdir, "chroma")
+    build_index(inputs["document"], inputs["summary"], persist_directory=persist_directory)
+    result = asyncio.run(session_load(args, inputs, persist_directory))
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def run_vectors(args, workdir: str) -> dict:
+    # Startup and search latency of each vector backend over the same chunks, without the API around them
+    from langchain.schema import Document
+    from benchmarks.synthetic import page_text, questions
+    from core import vectors
+    import random
+    rng = random.Random(args.seed)
+    chunks = [
+        Document(page_content=page_text(number, 60, rng), metadata={"source": "bench.pdf", "page": number % args.pages})
+        for number in range(args.chunks)
+    ]
+    query_embeddings = vectors.embeddings.embed_documents(questions(args.requests, seed=args.seed))
+
+    results = {}
+    for backend in ("chroma", "numpy"):
+        persist_directory = os.path.join(workdir, backend)
+        vectorstore = vectors.load_chroma(persist_directory, backend=backend)
+        vectors.sync_chunks_in_chroma(vectorstore, iter(chunks))
+        vectors.close_chroma(vectorstore)
+
+        # Startup: open the stored index and answer a first search
+        start_time = time.perf_counter()
+        vectorstore = vectors.load_chroma(persist_directory, backend=backend)
+        vectorstore.similarity_search_by_vector_with_relevance_scores(query_embeddings[0], k=7)
+        open_seconds = time.perf_counter() - start_time
+
+        def timed(search) -> list:
+            latencies = []
+            for embedding in query_embeddings:
+                search_start = time.perf_counter()
+                search(embedding)
+                latencies.append(time.perf_counter() - search_start)
+            return latencies
+
+        single = timed(lambda embedding: vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=7))
+        filtered = timed(lambda embedding: vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=7, filter={"page": {"$lt": max(args.pages // 10, 1)}}))
+        start_time = time.perf_counter()
+        vectorstore._collection.query(query_embeddings=query_embeddings, n_results=7)
+        batch_seconds = time.perf_counter() - start_time
+        vectors.close_chroma(vectorstore)
+
+        results[backend] = {
+            "open_ms": round(open_seconds * 1000, 2),
+            "latency": latency_stats(single),
+            "filtered_latency": latency_stats(filtered),
+            "batch_ms": round(batch_seconds * 1000, 2),
+            "batch_queries_per_second": round(len(query_embeddings) / batch_seconds, 1)
+        }
+    return {"chunks": args.chunks, "queries": len(query_embeddings), **results, "peak_rss_mb": peak_rss_mb()}
+
+def import_profile(workdir: str) -> dict:
+    # A fresh interpreter imports the app with -X importtime; the slowest modules are what to defer next
+    command = [sys.executable, "-X", "importtime", "-c", "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"]
+    completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True, check=True)
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line.split(":", 1)[1].split("|")
+        modules.append((int(cumulative), name.strip()))
+    slowest = sorted(modules, reverse=True)[:15]
+    return {
+        "import_seconds": round(float(completed.stdout.strip().splitlines()[-1]), 3),
+        "slowest_imports_ms": {name: round(cumulative / 1000, 1) for cumulative, name in slowest}
+    }
+
+def run_startup(args, workdir: str) -> dict:
+    # Cold import of the app, then the time until /readyz with a prebuilt index, as a replica starts
+    from core.indexer import build_index
+    inputs = prepare_inputs(args, workdir)
+    persist_directory = os.path.join(workdir, "chroma")
+    build_index(inputs["document"], inputs["summary"], persist_directory=persist_directory)
+    for directory in ("static", "data"):
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+    os.environ.update({"CHROMA_PATH": persist_directory, "DOCUMENT": inputs["document"], "SUMMARY": inputs["summary"], "INDEX_ON_START": "false"})
+    result = import_profile(workdir)
+
+    from fastapi.testclient import TestClient
+    import app
+    with TestClient(app.app) as client:
+        while True:
+            report = client.get("/readyz").json()
+            if report["status"] != "starting":
+                break
+            time.sleep(0.01)
+    # imports were already loaded by this process, the cold figure is import_seconds
+    return {**result, "startup": report, "peak_rss_mb": peak_rss_mb()}
+
+def run_scenario(args) -> dict:
+    # Runs inside the child process, with the fakes installed before anything talks to OpenAI
+    from benchmarks.fakes import FakeEmbeddings, FakeChatModel, install
+    install(
+        FakeChatModel(latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second, response_tokens=args.llm_response_tokens),
+        FakeEmbeddings(dimensions=args.embedding_dimensions, latency=args.embedding_latency)
+    )
+    runner = {"ingest": run_ingest, "summarize": run_summarize, "query": run_query, "session": run_session, "vectors": run_vectors, "startup": run_startup}[args.child]
+    return runner(args, os.getcwd())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with deterministic stand-ins for the OpenAI models.")
+    parser.add_argument("--scenario", nargs="+", choices=scenarios + ["all"], default=["all"])
+    parser.add_argument("--pages", type=int, default=100, help="Pages in the synthetic PDF")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--requests", type=int, default=200, help="Questions sent in the query scenario")
+    parser.add_argument("--turns", type=int, default=40, help="Questions asked in one conversation in the session scenario")
+    parser.add_argument("--chunks", type=int, default=5000, help="Chunks stored in the vectors scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Questions in flight at once in the query scenario")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds before the fake chat model's first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--llm-response-tokens", type=int, default=100)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per fake embedding request")
+    parser.add_argument("--embedding-dimensions", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--child", choices=scenarios, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    if args.child:
+        result = run_scenario(args)
+        with open(args.result_file, "w") as f:
+            json.dump(result, f)
+        return
+
+    selected = scenarios if "all" in args.scenario else [name for name in scenarios if name in args.scenario]
+    environment = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([str(service_root), os.environ.get("PYTHONPATH", "")]),
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+        "OPENAPI_SPEC": str(service_root / "openapi.yaml")
+    }
+    results = {}
+    for name in selected:
+        # A fresh process and working directory per scenario, so peak RSS and caches are its own
+        with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir:
+            result_file = os.path.join(workdir, "result.json")
+            print(f"Running {name}...")
+            command = [sys.executable, "-m", "benchmarks.run", *sys.argv[1:], "--child", name, "--result-file", result_file]
+            subprocess.run(command, cwd=workdir, env=environment, check=True, stdout=subprocess.DEVNULL)
+            with open(result_file, "r") as f:
+                results[name] = json.load(f)
+        print(json.dumps(results[name], indent=2))
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("child", "result_file", "output", "scenario")}
+    report = {
+        **git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+        "scenarios": results
+    }
+    output = args.output or str(service_root / "benchmarks" / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    main()
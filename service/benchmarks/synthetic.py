@@ -0,0 +1,84 @@
+import json, random
+
+# Topic words give pages distinct, searchable content; filler words pad them to a realistic length
+topics = (
+    "budget defense energy education health housing labor trade treasury justice commerce agriculture "
+    "transportation veterans interior environment immigration intelligence science technology"
+).split()
+filler = (
+    "the of and to in a is that for on with as by this be are from or at an which will shall may "
+    "department office program policy federal state agency should would must review authority"
+).split()
+
+def page_text(page: int, words: int, rng: random.Random) -> str:
+    topic = topics[page % len(topics)]
+    body = [rng.choice(filler) if rng.random() < 0.8 else topic for _ in range(words)]
+    return f"Page {page + 1} {topic.title()} " + " ".join(body)
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path: str, pages: int, words_per_page: int = 400, seed: int = 0) -> list:
+    """
+    Write a text-only PDF with one Helvetica text block per page and return the page texts.
+    The same arguments always produce the same file.
+    """
+    rng = random.Random(seed)
+    texts = [page_text(page, words_per_page, rng) for page in range(pages)]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in texts:
+        lines = [text[i:i + 95] for i in range(0, len(text), 95)]
+        stream = "BT /F1 9 Tf 36 770 Td 11 TL " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R /Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>"
+
+    output = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(output)
+    return texts
+
+def make_sections(pages: int, section_pages: int = 8, seed: int = 0) -> list:
+    # Same shape as the SECTIONS table of contents: sectionName, pageRange (1-based, inclusive), author
+    rng = random.Random(seed)
+    sections = []
+    for number, start in enumerate(range(1, pages + 1, section_pages), 1):
+        end = min(start + rng.randint(max(section_pages // 2, 1), section_pages) - 1, pages)
+        sections.append({
+            "sectionName": f"{number}. {topics[(start - 1) % len(topics)].upper()}",
+            "pageRange": [start, end],
+            "author": None if number % 3 else f"Author {number}"
+        })
+    return sections
+
+def write_sections(path: str, sections: list):
+    with open(path, "w") as f:
+        json.dump(sections, f, indent=4)
+
+def write_summary(path: str, sections: list):
+    # A docSummary.json as summarize.py would write it, with short made-up summaries
+    summaries = [{**section, "summary": f"{section['sectionName']} covers pages {section['pageRange'][0]} to {section['pageRange'][1]}."} for section in sections]
+    write_sections(path, summaries)
+
+def questions(count: int, seed: int = 0) -> list:
+    # Distinct questions so the answer cache does not turn the benchmark into a cache benchmark
+    rng = random.Random(seed)
+    templates = [
+        "What does the document say about {topic}?",
+        "Summarize the {topic} section on page {page}.",
+        "Which office is responsible for {topic} {word}?",
+        "How does the {topic} policy change {word} review?"
+    ]
+    return [
+        rng.choice(templates).format(topic=rng.choice(topics), page=rng.randint(1, 500), word=rng.choice(filler)) + f" ({number})"
+        for number in range(count)
+    ]
@@ -0,0 +1,66 @@
+import os, json, time, shutil
+
+manifest_name = "index_manifest.json"
+current_name = "current"  # Names the published index version in an artifact directory
+
+def load_manifest(persist_directory: str):
+    manifest_path = os.path.join(persist_directory, manifest_name)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(persist_directory: str, manifest: dict):
+    os.makedirs(persist_directory, exist_ok=True)
+    with open(os.path.join(persist_directory, manifest_name), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+# An artifact directory holds one complete index per version and a `current` file naming the one
+# to serve. Anything else is an index directory and is used as is.
+def resolve_index(path: str) -> str:
+    current_path = os.path.join(path, current_name)
+    if not os.path.isfile(current_path):
+        return path
+    with open(current_path, 'r') as f:
+        return os.path.join(path, f.read().strip())
+
+def publish_index(persist_directory: str, artifact_directory: str, keep: int = 3) -> str:
+    """
+    Copy a built index into artifact_directory as a new version and point `current` at it.
+    Both steps are renames, so replicas reading the directory see the old version or the new
+    one, never a partial copy. Only the newest `keep` versions are kept. Returns the version.
+    """
+    manifest = load_manifest(persist_directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No index manifest in {persist_directory}, build the index first")
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{manifest['version']}"
+    os.makedirs(artifact_directory, exist_ok=True)
+    target = os.path.join(artifact_directory, version)
+    staging = os.path.join(artifact_directory, f".{version}.tmp")
+    shutil.copytree(persist_directory, staging)
+    os.replace(staging, target)
+
+    current_path = os.path.join(artifact_directory, current_name)
+    with open(f"{current_path}.tmp", 'w') as f:
+        f.write(version)
+    os.replace(f"{current_path}.tmp", current_path)
+
+    # Versions sort by their timestamp prefix
+    versions = sorted(name for name in os.listdir(artifact_directory) if os.path.isfile(os.path.join(artifact_directory, name, manifest_name)))
+    for old in versions[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(artifact_directory, old), ignore_errors=True)
+    print(f"Published index version {version} to {artifact_directory}")
+    return version
+
+# Fail at startup rather than on the first question when the mounted index is missing or was
+# built for another embedding model or vector backend
+def check_index(path: str, expected: dict) -> dict:
+    persist_directory = resolve_index(path)
+    manifest = load_manifest(persist_directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No index in {persist_directory}; build it with python -m core.indexer or set INDEX_ON_START=true")
+    for key, value in expected.items():
+        # Manifests written before a key existed are not checked for it
+        if key in manifest and manifest[key] != value:
+            raise ValueError(f"The index in {persist_directory} was built with {key}={manifest.get(key)}, this service uses {value}")
+    return manifest
@@ -0,0 +1,158 @@
+import os, re, time, json, hashlib, sqlite3
+from collections import OrderedDict
+import numpy as np
+from core.artifacts import load_manifest
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+cache_enabled = os.getenv('ANSWER_CACHE', 'true').lower() == 'true'
+cache_size = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+cache_ttl = float(os.getenv('ANSWER_CACHE_TTL', '86400'))
+cache_threshold = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+cache_path = os.getenv('ANSWER_CACHE_PATH')  # Optional SQLite file to keep answers across restarts
+version_check_interval = float(os.getenv('ANSWER_CACHE_VERSION_CHECK', '30'))
+
+# Lowercase, collapse whitespace and drop trailing punctuation so trivial variations share a key
+def normalize_question(question: str) -> str:
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+# Fingerprint of everything an answer depends on: the collection contents and the prompt
+def index_fingerprint(vectorstore, prompt_template: str) -> str:
+    collection = vectorstore._collection
+    manifest = load_manifest(vectorstore._persist_directory) if vectorstore._persist_directory else None
+    index_version = manifest.get("version", "") if manifest else ""
+    parts = [collection.name, str(collection.count()), index_version, prompt_template]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+class AnswerCache:
+    """
+    Two-tier answer cache. The exact tier matches the normalized question, the semantic tier
+    matches question embeddings above a cosine similarity threshold. Entries are evicted LRU
+    and expire after the TTL. Everything is dropped when the version (index_fingerprint) changes.
+    """
+
+    def __init__(self, max_entries: int = cache_size, ttl: float = cache_ttl, threshold: float = cache_threshold, path: str = cache_path):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version = None
+        self.entries = OrderedDict()  # normalized question -> {"embedding", "response", "created"}
+        self._matrix = None  # Stacked embeddings for the semantic tier, rebuilt when entries change
+        self._keys = []
+        self._last_version_check = 0.0
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, version TEXT, embedding BLOB, response TEXT, created REAL)"
+            )
+
+    def set_version(self, version: str):
+        if version == self.version:
+            return
+        if self.version is not None:
+            self.stats["invalidations"] += 1
+            print(f"Answer cache invalidated (version {self.version} -> {version})")
+        self.version = version
+        self.entries.clear()
+        self._matrix = None
+        if self.db is not None:
+            # Drop answers built against an older index or prompt, then reload the rest
+            self.db.execute("DELETE FROM answers WHERE version != ?", (version,))
+            self.db.commit()
+            rows = self.db.execute(
+                "SELECT key, embedding, response, created FROM answers WHERE created > ? ORDER BY created DESC LIMIT ?",
+                (time.time() - self.ttl, self.max_entries)
+            ).fetchall()
+            for key, embedding, response, created in reversed(rows):
+                vector = np.frombuffer(embedding, dtype=np.float32) if embedding else None
+                self.entries[key] = {"embedding": vector, "response": json.loads(response), "created": created}
+
+    def check_version(self, version_fn):
+        # Recompute the fingerprint at most once per interval, it costs a collection count
+        now = time.monotonic()
+        if self.version is None or now - self._last_version_check >= version_check_interval:
+            self._last_version_check = now
+            self.set_version(version_fn())
+
+    def _expired(self, entry) -> bool:
+        return time.time() - entry["created"] > self.ttl
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        self._matrix = None
+        if self.db is not None:
+            self.db.execute("DELETE FROM answers WHERE key = ?", (key,))
+            self.db.commit()
+
+    def get_exact(self, question: str):
+        key = normalize_question(question)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        self.stats["exact_hits"] += 1
+        return entry["response"]
+
+    def record_miss(self):
+        # For lookups that stop after the exact tier, e.g. the lexical fast path
+        self.stats["misses"] += 1
+
+    def get_similar(self, embedding):
+        if self._matrix is None:
+            self._keys = [key for key, entry in self.entries.items() if entry["embedding"] is not None]
+            self._matrix = np.stack([self.entries[key]["embedding"] for key in self._keys]) if self._keys else np.empty((0, 0), dtype=np.float32)
+        if not self._keys:
+            self.stats["misses"] += 1
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        similarities = self._matrix @ query
+        best = int(np.argmax(similarities))
+        key = self._keys[best]
+        entry = self.entries.get(key)
+        if similarities[best] < self.threshold or entry is None or self._expired(entry):
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["semantic_hits"] += 1
+        return entry["response"]
+
+    def put(self, question: str, embedding, response: dict):
+        key = normalize_question(question)
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        entry = {"embedding": vector, "response": response, "created": time.time()}
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self._matrix = None
+        while len(self.entries) > self.max_entries:
+            oldest, _ = self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+            if self.db is not None:
+                self.db.execute("DELETE FROM answers WHERE key = ?", (oldest,))
+        if self.db is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO answers (key, version, embedding, response, created) VALUES (?, ?, ?, ?, ?)",
+                (key, self.version, vector.tobytes() if vector is not None else None, json.dumps(response), entry["created"])
+            )
+            self.db.commit()
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["exact_hits"] + self.stats["semantic_hits"] + self.stats["misses"]
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        return {**self.stats, "entries": len(self.entries), "hit_rate": hits / lookups if lookups else 0.0, "version": self.version}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
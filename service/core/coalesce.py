@@ -0,0 +1,148 @@
+import os, time, asyncio
+from core.metrics import coalesced_requests
+from core.resilience import DeadlineExceeded, remaining_time
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+coalesce_enabled = os.getenv('COALESCE_QUERIES', 'true').lower() == 'true'
+
+_end = object()
+
+class _StreamFlight:
+    # One in-flight stream: every event so far, for late joiners, and a queue per listener
+    def __init__(self):
+        self.events = []
+        self.listeners = set()
+        self.finished = False
+        self.task = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        if self.finished:
+            queue.put_nowait(_end)
+        self.listeners.add(queue)
+        return queue
+
+    def publish(self, event):
+        self.events.append(event)
+        for queue in self.listeners:
+            queue.put_nowait(event)
+
+    def finish(self, error: BaseException = None):
+        self.finished = True
+        for queue in self.listeners:
+            if error is not None:
+                queue.put_nowait(error)
+            queue.put_nowait(_end)
+
+class SingleFlight:
+    """
+    Concurrent requests with the same key share one computation. The first caller starts it,
+    later callers wait on the same result (or replay the same event stream) instead of repeating
+    the embedding, search and LLM call. The computation runs as its own task, so it completes for
+    the others even if the caller that started it disconnects. It runs under the deadline of the
+    caller that started it; every later caller stops waiting at its own deadline.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.streams = {}
+
+    def in_flight(self, key, stream: bool = False) -> bool:
+        return key in (self.streams if stream else self.calls)
+
+    async def do(self, key, compute):
+        task = self.calls.get(key)
+        timeout = None
+        if task is not None:
+            coalesced_requests.inc(mode="query")
+            timeout = remaining_time(None)
+        else:
+            task = asyncio.ensure_future(compute())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._forget(self.calls, key, done))
+        if timeout is None:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"No answer within {timeout * 1000:.0f} ms")
+
+    async def stream(self, key, produce, on_start=None, on_finish=None, settled=None):
+        """
+        Joins the stream with this key, or starts it with produce(), an async iterator of events,
+        and returns the events for this caller. Whether to join or start is decided here and the
+        caller is subscribed right away, so a stream that finishes before the caller reads it is
+        replayed rather than started again. on_start is awaited only by a caller that starts the
+        stream (and may raise to refuse it), on_finish runs when that stream's task is done.
+        A caller that joins gives up at its own deadline, which stops applying once it has
+        received an event for which settled(event) is true.
+        """
+        flight = self.streams.get(key)
+        if flight is None and on_start is not None:
+            await on_start()
+            # Someone else may have started the same stream while this caller waited
+            flight = self.streams.get(key)
+            if flight is not None and on_finish is not None:
+                on_finish()
+        timeout = None
+        if flight is not None:
+            coalesced_requests.inc(mode="stream")
+            timeout = remaining_time(None)
+        else:
+            flight = _StreamFlight()
+            self.streams[key] = flight
+            flight.task = asyncio.ensure_future(self._run_stream(key, flight, produce))
+            if on_finish is not None:
+                flight.task.add_done_callback(lambda task: on_finish())
+        return self._listen(flight, flight.subscribe(), timeout, settled)
+
+    async def _listen(self, flight: _StreamFlight, queue: asyncio.Queue, timeout: float, settled):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                if deadline is None:
+                    event = await queue.get()
+                else:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), max(deadline - time.monotonic(), 0))
+                    except asyncio.TimeoutError:
+                        raise DeadlineExceeded(f"No answer within {timeout * 1000:.0f} ms")
+                if event is _end:
+                    return
+                if isinstance(event, BaseException):
+                    raise event
+                if settled is not None and settled(event):
+                    deadline = None
+                yield event
+        finally:
+            flight.listeners.discard(queue)
+            # Nobody is listening any more, stop paying for the answer
+            if not flight.listeners and not flight.finished:
+                flight.task.cancel()
+
+    async def _run_stream(self, key, flight: _StreamFlight, produce):
+        try:
+            async for event in produce():
+                flight.publish(event)
+        except asyncio.CancelledError:
+            flight.finish()
+            raise
+        except Exception as e:
+            flight.finish(e)
+        else:
+            flight.finish()
+        finally:
+            if self.streams.get(key) is flight:
+                del self.streams[key]
+
+    @staticmethod
+    def _forget(calls: dict, key, task):
+        if calls.get(key) is task:
+            del calls[key]
+        # Mark a failure as seen, the callers that are still waiting get it from the task itself
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,126 @@
+import os, re, json
+from core.tokens import count_tokens
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+context_token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))
+context_candidates = int(os.getenv('CONTEXT_CANDIDATES', '12'))
+context_min_k = int(os.getenv('CONTEXT_MIN_K', '3'))
+context_max_k = int(os.getenv('CONTEXT_MAX_K', '7'))
+adaptive_k_gap = float(os.getenv('CONTEXT_SCORE_GAP', '0.3'))
+mmr_lambda = float(os.getenv('CONTEXT_MMR_LAMBDA', '0.7'))
+
+def _terms(text: str) -> set:
+    return set(re.findall(r"\w+", text.lower()))
+
+def _similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+# Keep the strongest candidates and stop at the first large drop in (normalized) relevance
+def adaptive_cutoff(results: list, min_k: int = context_min_k, max_k: int = context_max_k, gap: float = adaptive_k_gap) -> list:
+    results = sorted(results, key=lambda result: result[1], reverse=True)[:max_k]
+    if len(results) <= min_k:
+        return results
+    top, bottom = results[0][1], results[-1][1]
+    spread = top - bottom
+    if spread <= 0:
+        return results
+    for i in range(min_k, len(results)):
+        if (results[i - 1][1] - results[i][1]) / spread > gap:
+            return results[:i]
+    return results
+
+# Maximal marginal relevance: trade relevance against overlap with what is already selected
+def mmr_order(results: list, mmr_weight: float = mmr_lambda) -> list:
+    if not results:
+        return []
+    top, bottom = results[0][1], min(score for _, score in results)
+    spread = (top - bottom) or 1.0
+    candidates = [(document, (score - bottom) / spread, _terms(document.page_content)) for document, score in results]
+    selected = []
+    while candidates:
+        best = max(
+            range(len(candidates)),
+            key=lambda i: mmr_weight * candidates[i][1] - (1 - mmr_weight) * max((_similarity(candidates[i][2], chosen[2]) for chosen in selected), default=0.0)
+        )
+        selected.append(candidates.pop(best))
+    return [(document, relevance) for document, relevance, _ in selected]
+
+# Join two chunks of the same page that share text at the seam (the splitter overlap); None if they don't
+def merge_overlap(first: str, second: str, min_overlap: int = 20):
+    if second in first:
+        return first
+    if first in second:
+        return second
+    probe = second[:min_overlap]
+    position = first.find(probe)
+    while position != -1:
+        if second.startswith(first[position:]):
+            return first[:position] + second
+        position = first.find(probe, position + 1)
+    return None
+
+# Returns [text, relevance, document, merged documents] entries, with overlapping chunks of one page merged into the first
+def merge_same_page(results: list) -> list:
+    merged = []
+    for document, relevance in results:
+        key = (document.metadata.get('source'), document.metadata.get('page'), document.metadata.get('section_name'))
+        for entry in merged:
+            kept_document = entry[2]
+            if (kept_document.metadata.get('source'), kept_document.metadata.get('page'), kept_document.metadata.get('section_name')) != key:
+                continue
+            text = merge_overlap(entry[0], document.page_content) or merge_overlap(document.page_content, entry[0])
+            if text is not None:
+                entry[0] = text
+                entry[1] = max(entry[1], relevance)
+                entry[3].append(document)
+                break
+        else:
+            merged.append([document.page_content, relevance, document, [document]])
+    return merged
+
+# First and last page (page_end when a chunk runs across a page break) covered by some chunks, in any order
+def page_range(documents: list) -> tuple:
+    pages = [document.metadata.get('page') for document in documents if document.metadata.get('page') is not None]
+    ends = [document.metadata.get('page_end', document.metadata.get('page')) for document in documents]
+    ends = [end for end in ends if end is not None]
+    first = min(pages) if pages else None
+    return first, max(ends) if ends else first
+
+def serialize_context(context_list: list) -> str:
+    # Compact JSON: no indentation or spaces after separators, non-ASCII kept as is
+    return json.dumps(context_list, separators=(",", ":"), ensure_ascii=False)
+
+def assemble_context(results: list, build_entry, token_budget: int = context_token_budget, build_reference=None):
+    """
+    Turn (document, relevance) candidates, higher relevance is better, into the prompt context.
+    Picks k from the score gaps, orders by MMR, merges overlapping chunks from the same page and
+    stops at the token budget. build_entry maps (document, text, (first page, last page)) to a
+    context entry and build_reference maps (merged documents, relevance) to the reference returned
+    instead of the text.
+    Returns (context entries, serialized context, tokens saved against the old k=7 indented JSON,
+    references).
+    """
+    baseline = [build_entry(document, document.page_content, page_range([document])) for document, _ in sorted(results, key=lambda result: result[1], reverse=True)[:7]]
+    baseline_tokens = count_tokens(json.dumps(baseline, indent=2))
+
+    chosen = mmr_order(adaptive_cutoff(results))
+    context_list = []
+    references = []
+    used_tokens = 2  # The enclosing brackets
+    for text, relevance, document, documents in merge_same_page(chosen):
+        # A merged entry spans every page its chunks do
+        entry = build_entry(document, text, page_range(documents))
+        entry_tokens = count_tokens(serialize_context([entry]))
+        if context_list and used_tokens + entry_tokens > token_budget:
+            continue
+        context_list.append(entry)
+        if build_reference is not None:
+            references.append(build_reference(documents, relevance))
+        used_tokens += entry_tokens
+
+    context = serialize_context(context_list)
+    return context_list, context, max(baseline_tokens - count_tokens(context), 0), references
@@ -1,19 +1,123 @@
-from langchain_community.document_loaders import PyPDFLoader
+import os, hashlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterator
+from langchain_core.documents import Document
+from dotenv import load_dotenv
 
-# Global variable to hold the loaded documents
-documents = []
+load_dotenv(override=True)
 
-def load_document(file_path: str):
-    global documents
-    print("starting load...", file_path)
+# Page extraction runs in a process pool; each task parses a contiguous range of pages
+extract_workers = int(os.getenv('PDF_WORKERS', str(os.cpu_count() or 1)))
+pages_per_task = int(os.getenv('PDF_PAGES_PER_TASK', '16'))
+
+def resolve_path(file_path: str) -> str:
     # Get the absolute path to ensure it's correct relative to the root
     root_dir = Path(__file__).resolve().parent.parent
-    full_path = f"{root_dir}/{file_path}"
-    # Load the document
-    loader = PyPDFLoader(full_path)
-    documents = loader.load()
-    # validate - delete these later
-    print(f"Loaded {len(documents)} pages from the PDF")
-    return documents
-    
\ No newline at end of file
+    return f"{root_dir}/{file_path}"
+
+# Hash a file in blocks so large PDFs are never read into memory at once
+def file_hash(file_path: str):
+    full_path = resolve_path(file_path)
+    if not os.path.exists(full_path):
+        return None
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# pypdf is only needed when indexing or summarizing, not to answer questions
+def open_pdf(path: str):
+    from pypdf import PdfReader
+    return PdfReader(path)
+
+# Runs in a worker process: extract the text of pages [start, end), 0-based
+def _extract_range(full_path: str, start: int, end: int) -> list:
+    reader = open_pdf(full_path)
+    return [reader.pages[i].extract_text() for i in range(start, end)]
+
+def _page_document(full_path: str, page: int, text: str) -> Document:
+    # Same metadata as PyPDFLoader: the source path and the 0-based page number
+    return Document(page_content=text, metadata={'source': full_path, 'page': page})
+
+def iter_pages(file_path: str, start: int = 1, end: int = None, workers: int = None, reader=None) -> Iterator[Document]:
+    """
+    Yield one Document per page, in page order, from start to end (1-based, inclusive).
+    Page ranges are extracted in parallel, and only a few ranges are held in memory at once.
+    A reader that is already open is used instead of parsing the PDF again when extracting serially.
+    """
+    full_path = resolve_path(file_path)
+    if reader is None:
+        reader = open_pdf(full_path)
+    total = len(reader.pages)
+    end = total if end is None else min(end, total)
+    workers = workers or extract_workers
+    ranges = [(first, min(first + pages_per_task, end)) for first in range(start - 1, end, pages_per_task)]
+
+    if workers <= 1 or len(ranges) <= 1:
+        for page in range(start - 1, end):
+            yield _page_document(full_path, page, reader.pages[page].extract_text())
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            # Keep a bounded number of ranges in flight, then yield the oldest in order
+            while next_range < len(ranges) and len(pending) < workers * 2:
+                first, last = ranges[next_range]
+                pending.append((first, pool.submit(_extract_range, full_path, first, last)))
+                next_range += 1
+            first, future = pending.pop(0)
+            for offset, text in enumerate(future.result()):
+                yield _page_document(full_path, first + offset, text)
+
+class PdfPages:
+    """
+    Read-only sequence over the pages of a PDF, parsed once and kept open until closed.
+    Indexing and slicing extract only the requested pages, so callers like the summarizer can
+    read a section at a time without loading the whole document; iterating extracts every page
+    in parallel.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.full_path = resolve_path(file_path)
+        self._reader = open_pdf(self.full_path)
+        self.page_count = len(self._reader.pages)
+
+    def __len__(self):
+        return self.page_count
+
+    def _document(self, page: int) -> Document:
+        return _page_document(self.full_path, page, self._reader.pages[page].extract_text())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._document(page) for page in range(*index.indices(self.page_count))]
+        if index < 0:
+            index += self.page_count
+        if not 0 <= index < self.page_count:
+            raise IndexError("page index out of range")
+        return self._document(index)
+
+    def __iter__(self):
+        return iter_pages(self.file_path, reader=self._reader)
+
+    def close(self):
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load_document(file_path: str) -> Iterator[Document]:
+    # Pages one at a time, so a large PDF is never in memory all at once
+    from core.pagestore import open_pages  # Imported here, core.pagestore builds on this module
+    print("starting load...", file_path)
+    with open_pages(file_path) as pages:
+        print(f"Loading {len(pages)} pages from the PDF")
+        yield from pages
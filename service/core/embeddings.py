@@ -0,0 +1,212 @@
+import os, asyncio, hashlib, sqlite3, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+embedding_cache_size = int(os.getenv('EMBEDDING_CACHE_SIZE', '10000'))
+embedding_cache_path = os.getenv('EMBEDDING_CACHE_PATH')  # Optional SQLite file so re-ingestion reuses vectors
+batch_window = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '5')) / 1000
+max_batch_size = int(os.getenv('EMBEDDING_MAX_BATCH', '64'))
+
+# Which model embeds chunks and questions: openai, onnx (local CPU model) or hashing (offline, for tests)
+embedding_provider = os.getenv('EMBEDDING_PROVIDER', 'openai')
+default_models = {"openai": "text-embedding-3-large", "onnx": "sentence-transformers/all-MiniLM-L6-v2", "hashing": "hashing"}
+embedding_model_name = os.getenv('EMBEDDING_MODEL') or default_models.get(embedding_provider)
+embedding_dimensions = int(os.getenv('EMBEDDING_DIMENSIONS', '0')) or None  # Fewer dimensions, less memory per vector
+embedding_threads = int(os.getenv('EMBEDDING_THREADS', '0')) or None  # Local inference threads, all cores by default
+embedding_model_dir = os.getenv('EMBEDDING_MODEL_DIR', 'models')  # Downloaded local models, relative to ./service
+
+# Names the model and its dimensions, so cached vectors and index manifests change when either does
+def embedding_model_id(provider: str = embedding_provider, model: str = embedding_model_name, dimensions: int = embedding_dimensions) -> str:
+    if provider not in default_models:
+        raise ValueError(f"Unknown EMBEDDING_PROVIDER {provider}, expected openai, onnx or hashing")
+    name = model if provider in ("openai", "hashing") else f"{provider}:{model}"
+    return f"{name}@{dimensions}" if dimensions else name
+
+def create_embeddings(provider: str = embedding_provider, model: str = embedding_model_name, dimensions: int = embedding_dimensions):
+    """
+    Build the configured embedding model. Returns (embeddings, model id).
+    """
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"), model=model, dimensions=dimensions)
+    elif provider == "onnx":
+        from core.local_embeddings import OnnxEmbeddings
+        root_dir = Path(__file__).resolve().parent.parent
+        embeddings = OnnxEmbeddings(model, str(root_dir / embedding_model_dir), dimensions=dimensions, threads=embedding_threads)
+    elif provider == "hashing":
+        from core.local_embeddings import HashingEmbeddings
+        embeddings = HashingEmbeddings(dimensions=dimensions or 384)
+    else:
+        raise ValueError(f"Unknown EMBEDDING_PROVIDER {provider}, expected openai, onnx or hashing")
+    return embeddings, embedding_model_id(provider, model, dimensions)
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings object with an LRU cache keyed by model and text hash, optionally
+    backed by SQLite. Concurrent aembed_query calls within a short window are sent to the
+    wrapped model together, up to max_batch_size texts per embed_documents request; aembed_queries
+    takes the same path for many questions at once. `underlying` can also be a function that
+    returns the model, called on first use.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, max_entries: int = embedding_cache_size, path: str = embedding_cache_path):
+        self._underlying = underlying
+        self._load_lock = threading.Lock()
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "batches": 0, "batched_texts": 0}
+        self._pending = []  # (text, future) waiting for the next micro-batch
+        self._flush_handle = None
+        self._flush_tasks = set()  # The loop only keeps weak references to tasks, a collected flush would strand its batch
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+
+    @property
+    def underlying(self) -> Embeddings:
+        if not isinstance(self._underlying, Embeddings):
+            with self._load_lock:
+                if not isinstance(self._underlying, Embeddings):
+                    self._underlying = self._underlying()
+        return self._underlying
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _get(self, key: str):
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+            elif self.db is not None:
+                row = self.db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+            self.stats["hits" if vector is not None else "misses"] += 1
+            return vector
+
+    def _remember(self, key: str, vector):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _put_many(self, keys: List[str], vectors):
+        with self.lock:
+            rows = []
+            for key, vector in zip(keys, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+            if self.db is not None:
+                self.db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self.db.commit()
+
+    # Split texts into cached vectors and the unique texts that still need embedding
+    def _lookup(self, texts: List[str]):
+        keys = [self.key(text) for text in texts]
+        found = {}
+        missing = OrderedDict()
+        for text, key in zip(texts, keys):
+            if key in found or key in missing:
+                continue
+            vector = self._get(key)
+            if vector is not None:
+                found[key] = vector
+            else:
+                missing[key] = text
+        return keys, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            self._put_many(list(missing.keys()), vectors)
+            found.update(zip(missing.keys(), (np.asarray(v, dtype=np.float32) for v in vectors)))
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            self._put_many(list(missing.keys()), vectors)
+            found.update(zip(missing.keys(), (np.asarray(v, dtype=np.float32) for v in vectors)))
+        return [found[key].tolist() for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._get(self.key(text))
+        if vector is not None:
+            return vector.tolist()
+
+        # Queue the text for the next micro-batch and wait for its vector
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= max_batch_size:
+            self._schedule_flush(loop, 0)
+        elif self._flush_handle is None:
+            self._schedule_flush(loop, batch_window)
+        return await future
+
+    # Several questions at once, embedded and cached exactly as aembed_query embeds each of them
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.aembed_query(text) for text in texts)))
+
+    def _schedule_flush(self, loop, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(delay, self._start_flush, loop)
+
+    def _start_flush(self, loop):
+        task = loop.create_task(self._flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error while embedding queued queries: {task.exception()}")
+
+    async def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending[:max_batch_size], self._pending[max_batch_size:]
+        if not pending:
+            return
+        if self._pending:
+            self._schedule_flush(asyncio.get_running_loop(), 0)
+        texts = list(OrderedDict.fromkeys(text for text, _ in pending))
+        self.stats["batches"] += 1
+        self.stats["batched_texts"] += len(pending)
+        # Every waiting query gets a vector or an error, whatever goes wrong
+        try:
+            vectors = await self.underlying.aembed_documents(texts)
+            self._put_many([self.key(text) for text in texts], vectors)
+            by_text = {text: np.asarray(vector, dtype=np.float32).tolist() for text, vector in zip(texts, vectors, strict=True)}
+        except asyncio.CancelledError:
+            for _, future in pending:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future in pending:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "entries": len(self.entries)}
@@ -0,0 +1,118 @@
+import os, hashlib, argparse, time
+from itertools import chain
+from core.artifacts import load_manifest, save_manifest, publish_index
+from core.document import file_hash
+from core.pagestore import open_pages
+from core.lexical import build_lexical_index, lexical_index_name
+from core.sections import find_sections_file, load_sections_file, section_index_name
+from core.vectors import load_chroma, split_document_into_chunks, load_summaries_from_json, sync_chunks_in_chroma, embedding_model, vector_backend, chunk_tokens, chunk_overlap_tokens
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+file_name = os.getenv('DOCUMENT')
+db_path = os.getenv('CHROMA_PATH')
+summary_file_path = os.getenv('SUMMARY')
+sections_file_path = os.getenv('PRE_PROCESSED_SECTIONS')
+
+# Everything that decides what the index contains; if none of it changed there is nothing to do
+def index_inputs(document_path: str, summary_path: str, sections_path: str = None) -> dict:
+    return {
+        "document": document_path,
+        "document_sha256": file_hash(document_path),
+        "summary": summary_path,
+        "summary_sha256": file_hash(summary_path),
+        "sections": sections_path,
+        "sections_sha256": file_hash(sections_path) if sections_path else None,
+        "embedding_model": embedding_model,
+        "vector_backend": vector_backend,
+        "chunk_tokens": chunk_tokens,
+        "chunk_overlap_tokens": chunk_overlap_tokens
+    }
+
+def build_index(document_path: str = file_name, summary_path: str = summary_file_path, persist_directory: str = db_path, force: bool = False, batch_size: int = None, workers: int = None, sections_path: str = sections_file_path) -> dict:
+    """
+    Bring the Chroma index in line with the current PDF, summary file and table of contents.
+    Only new or changed chunks are embedded and stale ones are deleted. Returns the manifest
+    that was written.
+    """
+    sections_path = find_sections_file(sections_path)
+    inputs = index_inputs(document_path, summary_path, sections_path)
+    manifest = load_manifest(persist_directory)
+
+    if inputs["document_sha256"] is None:
+        if manifest is not None:
+            print(f"Document {document_path} not found, using the existing index as is.")
+            return manifest
+        raise FileNotFoundError(f"The document {document_path} does not exist.")
+
+    if manifest is not None and not force and all(manifest.get(key) == value for key, value in inputs.items()):
+        if not os.path.exists(os.path.join(persist_directory, lexical_index_name)):
+            build_lexical_index(load_chroma(persist_directory), persist_directory)
+        print("Index is up to date, nothing to do.")
+        return manifest
+
+    start_time = time.time()
+    # Chunks never cross a section boundary and carry the section they belong to
+    sections = load_sections_file(sections_path)
+    summary_chunks = load_summaries_from_json(summary_path)
+
+    vectorstore = load_chroma(persist_directory)
+    if manifest is not None and manifest.get("embedding_model") != inputs["embedding_model"]:
+        # Vectors from another model or dimension count cannot be searched with the new one
+        print(f"Embedding model changed from {manifest.get('embedding_model')} to {inputs['embedding_model']}, re-embedding every chunk")
+        vectorstore.reset_collection()
+    # Pages are extracted, split and embedded as a stream, never all in memory at once
+    with open_pages(document_path) as pages:
+        chunks = split_document_into_chunks(iter(pages), chunk_size=inputs["chunk_tokens"], overlap=inputs["chunk_overlap_tokens"], sections=sections)
+        result = sync_chunks_in_chroma(vectorstore, chain(chunks, summary_chunks), batch_size=batch_size, workers=workers)
+    build_lexical_index(vectorstore, persist_directory)
+    if sections is not None:
+        sections.save(persist_directory)
+    elif os.path.exists(os.path.join(persist_directory, section_index_name)):
+        os.remove(os.path.join(persist_directory, section_index_name))
+
+    manifest = {
+        **inputs,
+        # Changes whenever the set of chunks changes, used to invalidate cached answers
+        "version": hashlib.sha256("".join(result["ids"]).encode("utf-8")).hexdigest()[:16],
+        "chunks": result["total"],
+        "section_count": len(sections.sections) if sections is not None else 0,
+        "added": result["added"],
+        "removed": result["removed"],
+        "chunks_per_second": round(result["chunks_per_second"], 1),
+        "tokens_per_second": round(result["tokens_per_second"], 1),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+    save_manifest(persist_directory, manifest)
+    print(f"Index built in {time.time() - start_time:.1f} seconds ({result['added']} added, {result['removed']} removed)")
+    return manifest
+
+# Run ahead of time from ./service with: python -m core.indexer
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the Chroma index for the document.")
+    parser.add_argument("--document-id", default=None, help="Index one collection from COLLECTIONS_FILE")
+    parser.add_argument("--all", action="store_true", help="Index every collection in COLLECTIONS_FILE")
+    parser.add_argument("--document", default=file_name, help="PDF to index, relative to ./service")
+    parser.add_argument("--summary", default=summary_file_path, help="Summary JSON to index, relative to ./service")
+    parser.add_argument("--sections", default=sections_file_path, help="Preprocessed table of contents, relative to ./service")
+    parser.add_argument("--persist-directory", default=db_path, help="Chroma directory")
+    parser.add_argument("--force", action="store_true", help="Re-check every chunk even if the inputs are unchanged")
+    parser.add_argument("--batch-size", type=int, default=None, help="Chunks per embedding request (EMBED_BATCH_SIZE)")
+    parser.add_argument("--workers", type=int, default=None, help="Embedding requests running at once (EMBED_WORKERS)")
+    parser.add_argument("--publish", default=None, help="Artifact directory to copy the built index into as a new version, for replicas to mount")
+    parser.add_argument("--keep", type=int, default=3, help="Published versions to keep")
+    args = parser.parse_args()
+    if args.all or args.document_id:
+        from core.registry import CollectionRegistry  # Imported here, the registry builds on this module
+        registry = CollectionRegistry.from_env()
+        collections = registry.collections.values() if args.all else [registry.get(args.document_id)]
+        for collection in collections:
+            print(f"Indexing {collection.id}...")
+            build_index(collection.document, collection.summary, collection.chroma_path, force=args.force, batch_size=args.batch_size, workers=args.workers, sections_path=collection.sections)
+            if args.publish:
+                publish_index(collection.chroma_path, os.path.join(args.publish, collection.id), keep=args.keep)
+    else:
+        build_index(args.document, args.summary, args.persist_directory, force=args.force, batch_size=args.batch_size, workers=args.workers, sections_path=args.sections)
+        if args.publish:
+            publish_index(args.persist_directory, args.publish, keep=args.keep)
@@ -0,0 +1,138 @@
+import os, re, json, math, time
+from collections import Counter, defaultdict
+import numpy as np
+from langchain_core.documents import Document
+from core.sections import matches_filter
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+lexical_index_name = "bm25_index.json"
+lexical_min_coverage = float(os.getenv('LEXICAL_MIN_COVERAGE', '1.0'))
+lexical_min_margin = float(os.getenv('LEXICAL_MIN_MARGIN', '0.5'))
+
+# Words too common to decide whether a chunk answers the question
+stopwords = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from", "how", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "were", "what", "when", "where", "which", "who", "why", "with"
+}
+
+def tokenize(text: str) -> list:
+    return re.findall(r"\w+", text.lower())
+
+class BM25Index:
+    """
+    Okapi BM25 over the same chunks as the vector store. Built at ingestion, saved next to the
+    Chroma data and loaded once; search is a handful of numpy operations per query term.
+    """
+
+    def __init__(self, ids: list, texts: list, metadatas: list, doc_lengths: list, postings: dict, k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        self.average_length = float(self.doc_lengths.mean()) if len(ids) else 0.0
+        self.k1 = k1
+        self.b = b
+        # term -> (document indexes, term frequencies)
+        self.postings = {term: (np.asarray(docs, dtype=np.int32), np.asarray(freqs, dtype=np.float32)) for term, (docs, freqs) in postings.items()}
+        self._masks = {}  # where clause -> chunks it allows, filters repeat so they are worked out once
+
+    @classmethod
+    def build(cls, ids: list, texts: list, metadatas: list):
+        doc_lengths = []
+        postings = defaultdict(lambda: ([], []))
+        for index, text in enumerate(texts):
+            terms = Counter(tokenize(text))
+            doc_lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                postings[term][0].append(index)
+                postings[term][1].append(freq)
+        return cls(ids, texts, metadatas, doc_lengths, dict(postings))
+
+    def mask(self, where: dict) -> np.ndarray:
+        key = json.dumps(where, sort_keys=True)
+        if key not in self._masks:
+            if len(self._masks) >= 256:
+                self._masks.clear()
+            self._masks[key] = np.array([matches_filter(metadata or {}, where) for metadata in self.metadatas], dtype=bool)
+        return self._masks[key]
+
+    def search(self, query: str, k: int = 7, where: dict = None) -> list:
+        # Returns (index, score) pairs, best first; with a where clause only matching chunks are scored
+        if not self.ids:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        count = len(self.ids)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, freqs = self.postings[term]
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.average_length)
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+        if where:
+            scores[~self.mask(where)] = 0.0
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(index), float(scores[index])) for index in top if scores[index] > 0]
+
+    def coverage(self, query: str, index: int) -> float:
+        # Share of the meaningful query terms that appear in the chunk
+        terms = {term for term in tokenize(query) if term not in stopwords}
+        if not terms:
+            return 0.0
+        found = sum(1 for term in terms if term in self.postings and index in self.postings[term][0])
+        return found / len(terms)
+
+    def is_confident(self, query: str, results: list) -> bool:
+        # Exact names, dates and titles: the top chunk has every term and clearly beats the runner up
+        if not results:
+            return False
+        top_score = results[0][1]
+        second_score = results[1][1] if len(results) > 1 else 0.0
+        margin = (top_score - second_score) / top_score if top_score else 0.0
+        return margin >= lexical_min_margin and self.coverage(query, results[0][0]) >= lexical_min_coverage
+
+    def document(self, index: int) -> Document:
+        return Document(page_content=self.texts[index], metadata=self.metadatas[index] or {})
+
+    def save(self, persist_directory: str):
+        data = {
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "doc_lengths": self.doc_lengths.astype(int).tolist(),
+            "postings": {term: [docs.tolist(), freqs.astype(int).tolist()] for term, (docs, freqs) in self.postings.items()}
+        }
+        path = os.path.join(persist_directory, lexical_index_name)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+
+def load_lexical_index(persist_directory: str):
+    path = os.path.join(persist_directory, lexical_index_name)
+    if not os.path.exists(path):
+        print(f"No lexical index at {path}, using vector search only")
+        return None
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return BM25Index(data["ids"], data["texts"], data["metadatas"], data["doc_lengths"], data["postings"])
+
+# Rebuild the lexical index from whatever the vector store holds now
+def build_lexical_index(vectorstore, persist_directory: str) -> BM25Index:
+    start_time = time.time()
+    contents = vectorstore.get(include=["documents", "metadatas"])
+    index = BM25Index.build(contents["ids"], contents["documents"], contents["metadatas"])
+    index.save(persist_directory)
+    print(f"Lexical index built over {len(index.ids)} chunks in {time.time() - start_time:.1f} seconds")
+    return index
+
+# Reciprocal rank fusion: each list contributes 1 / (rrf_k + rank) for every chunk it ranks
+def reciprocal_rank_fusion(ranked_lists: list, rrf_k: int = 60) -> list:
+    scores = defaultdict(float)
+    for ranked in ranked_lists:
+        for rank, id in enumerate(ranked):
+            scores[id] += 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,49 @@
+import asyncio, os
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+max_concurrent_queries = int(os.getenv('MAX_CONCURRENT_QUERIES', '32'))
+max_queued_queries = int(os.getenv('MAX_QUEUED_QUERIES', '64'))
+queue_timeout = float(os.getenv('QUERY_QUEUE_TIMEOUT', '30'))
+
+class OverloadedError(Exception):
+    pass
+
+class ConcurrencyLimiter:
+    """
+    Caps how many queries run at once and how many may wait for a slot. Requests beyond the
+    queue depth, or that wait longer than the queue timeout, raise OverloadedError right away.
+    """
+
+    def __init__(self, max_concurrent: int = max_concurrent_queries, max_queued: int = max_queued_queries, timeout: float = queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+
+    async def acquire(self):
+        if self._semaphore.locked() and self.waiting >= self.max_queued:
+            raise OverloadedError(f"Query queue is full ({self.waiting} waiting)")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise OverloadedError(f"Timed out after {self.timeout}s waiting for a query slot")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
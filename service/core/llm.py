@@ -1,39 +1,59 @@
-import os, json
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from core.vectors import load_chroma, query_vector_store
+from __future__ import annotations  # ChatOpenAI and PromptTemplate are only imported when first used
+import os, time, asyncio
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+from core.vectors import load_chroma, query_vector_store, aquery_vector_store, aquery_vector_store_batch, aget_documents, fuse_results, lexical_fast_path, chunk_id
+from core.cache import index_fingerprint, normalize_question
+from core.context import assemble_context, context_candidates, page_range
+from core.metrics import stage, record_stage, record_llm_tokens, answer_cache_lookups, session_turns, timings_ms
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+    from langchain_core.prompts import PromptTemplate
+
 load_dotenv(override=True)
 
 doc_name = os.getenv('DOCUMENT_TITLE')
 db_path = os.getenv('CHROMA_PATH')
+request_timeout = float(os.getenv('LLM_REQUEST_TIMEOUT', '30'))
+batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', '8'))  # LLM completions running at once per batch
 
-def initialize_llm(model_name: str = "gpt-4o", temperature: float = 0.4) -> ChatOpenAI:
+def initialize_llm(model_name: str = "gpt-4o", temperature: float = 0.4, http_client=None, http_async_client=None) -> ChatOpenAI:
     openai_api_key = os.getenv('OPENAI_API_KEY')
     if not openai_api_key:
         raise ValueError("OpenAI API key not found.")
-    
+
+    # langchain_openai takes over a second to import, so it loads with the first client rather than with the app
+    from langchain_openai import ChatOpenAI
     llm = ChatOpenAI(
         model_name=model_name,
         temperature=temperature,
         openai_api_key=openai_api_key,
-        request_timeout=30  # Timeout after 30 seconds if no response
+        request_timeout=request_timeout,  # Upper bound per HTTP call, core.resilience applies tighter per-request deadlines
+        http_client=http_client,  # Shared, pooled clients when provided by core.resources
+        http_async_client=http_async_client
     )
     
     return llm
 
-def get_summary_prompt() -> PromptTemplate:
+def get_summary_prompt(title: str = None, template: str = None) -> PromptTemplate:
+    # Each collection can bring its own template; {doc_name} in it is replaced by the title
+    from langchain_core.prompts import PromptTemplate  # Pulls in langsmith, about a second to import
+    title = title or doc_name
+    if template:
+        return PromptTemplate(template=template.replace("{doc_name}", title), input_variables=["question", "context"])
+
     prompt_text = (
-        f"You are a helpful and dispassionate resource to answer the provided question(s) pertaining to the document titled {doc_name} using only the information provided below 'Context'. "
+        f"You are a helpful and dispassionate resource to answer the provided question(s) pertaining to the document titled {title} using only the information provided below 'Context'. "
         f"Do not directly reference the fact that there is 'context' or say things like 'based on the provided context'. Simply, respond to the question. "
         f"The question to be answered can be found below under 'Question'. "
-        f"If the question is obviously not pertaining to {doc_name} or the context, explain that this agent is designed to answer questions about {doc_name} and ask that they ask a question about that topic. "
+        f"If the question is obviously not pertaining to {title} or the context, explain that this agent is designed to answer questions about {title} and ask that they ask a question about that topic. "
         f"Review the context thoroughly and if you notice any conflicting or contradictory information, do your best to reconcile and respond while making it clear that the user should check your response with the document. "
         f"If the context does not provide enough information to answer the question, clearly state 'I'm not sure, but that doesn't mean the answer is not in the document. My responses are not perfect.' "
         f"Do not attempt to infer or make assumptions beyond the provided information. "
         f"If the question is too ambiguous, do your best to answer, but then also suggest a different wording to the question for clarification that they could use to ask you for a better response. "
-        f"When responding, be sure to cite the relevant sections or page numbers of the source material ({doc_name}) as provided whenever possible. "
+        f"When responding, be sure to cite the relevant sections or page numbers of the source material ({title}) as provided whenever possible. "
         
         f"\nQuestion:\n{{question}}"
         f"\nContext:\n{{context}}"
@@ -44,39 +64,317 @@ def get_summary_prompt() -> PromptTemplate:
     )
     return prompt
 
-def askLLM(question: str) -> str:
-    try:
+def context_entry(result, context_text: str, pages: tuple = None) -> dict:
+    page_num, page_end = pages or page_range([result])
+    if page_end is not None and page_end != page_num:
+        # The chunk runs across a page break
+        page_num = f"{page_num}-{page_end}"
+    section = result.metadata.get("section_name") or "See reference below for section details"
+
+    # Create a JSON-like structured object
+    return {
+        "Section": section,
+        "Page(s)": page_num,
+        "Reference": context_text
+    }
+
+# Where a context entry came from, without its text: the ids of its chunks (GET /api/chunks/{id}) and its relevance
+def context_reference(documents: list, relevance: float) -> dict:
+    page, page_end = page_range(documents)
+    return {
+        "ids": [chunk_id(document) for document in documents],
+        "score": round(float(relevance), 4),
+        "page": page,
+        "page_end": page_end,
+        "section": documents[0].metadata.get('section_name')
+    }
+
+# A follow-up goes into the prompt's {question} with the conversation so far, so collection templates need no history slot
+def question_with_history(question: str, history: str = None) -> str:
+    if not history:
+        return question
+    return f"Earlier in this conversation:\n{history}\n\nAnswer this follow-up question: {question}"
+
+# Deduplicated, diversity-ordered context within the token budget, serialized compactly
+def build_budgeted_prompt(question: str, context_results, prompt: PromptTemplate = None, history: str = None) -> tuple:
+    context_list, context, tokens_saved, references = assemble_context(context_results, context_entry, build_reference=context_reference)
+    prompt = prompt or get_summary_prompt()
+    prompt_text = prompt.format(question=question_with_history(question, history), context=context)
+    return context_list, prompt_text, tokens_saved, references
+
+def response_text(response) -> str:
+    # Extract content if it's an AIMessage-like object
+    if hasattr(response, 'content'):
+        return response.content.strip()
+    return response.strip()
+
+# Sync version of askLLMAsync without the cache or lexical search: the same candidates, token budget and compact context
+def askLLM(question: str, llm: ChatOpenAI = None, vectorstore=None, prompt: PromptTemplate = None) -> dict:
+    # Use the shared clients from core.resources when given, otherwise build them for this call
+    if llm is None:
         llm = initialize_llm()
+    if vectorstore is None:
         vectorstore = load_chroma(db_path)
-        
-        # Retrieve Context
-        context_results = query_vector_store(vectorstore=vectorstore, query=question)
-        
-        # Extract context - assuming context_results is a list of tuples (document, score)
-        context_list = []
-        for result, score in context_results:
-            page_num = result.metadata.get('page')
-            section = result.metadata.get("section_name") or "See reference below for section details"
-            context_text = result.page_content
-
-            # Create a JSON-like structured object
-            context_entry = {
-                "Section": section,
-                "Page(s)": page_num,
-                "Reference": context_text
-            }
-            context_list.append(context_entry)
-        
-        # Convert the list of context entries into a JSON-like string
-        context = json.dumps(context_list, indent=2)
-        prompt = get_summary_prompt()
-        prompt_text = prompt.format(question=question,context=context)
 
+    with stage("search"):
+        dense_results = query_vector_store(vectorstore=vectorstore, query=question, k=context_candidates)
+    # Chroma returns distances, lower is closer
+    context_results = [(document, 1.0 / (1.0 + distance)) for document, distance in dense_results]
+    with stage("prompt"):
+        context_list, prompt_text, tokens_saved, references = build_budgeted_prompt(question, context_results, prompt)
+
+    with stage("llm"):
         response = llm.invoke(prompt_text)
-        # Extract content if it's an AIMessage-like object
-        if hasattr(response, 'content'):
-            return { "response": response.content.strip(), "context": context_list}
+    answer = response_text(response)
+    record_llm_tokens("query", prompt_text, answer, response)
+    return { "response": answer, "context": context_list, "references": references, "prompt_tokens_saved": tokens_saved}
+
+# Async version of askLLM: nothing here blocks the event loop while waiting on OpenAI or Chroma
+# With a session (core.sessions.Session) the question continues that conversation and is recorded as its next turn
+async def askLLMAsync(question: str, llm: ChatOpenAI = None, vectorstore=None, cache=None, lexical_index=None, prompt: PromptTemplate = None, filter: dict = None, session=None) -> dict:
+    if llm is None:
+        llm = initialize_llm()
+    if vectorstore is None:
+        vectorstore = load_chroma(db_path)
+    if filter:
+        # Cached answers were retrieved from the whole document
+        cache = None
+
+    cached, context_results, query_embedding, history = await retrieve_turn_context(question, session, vectorstore, cache, lexical_index, prompt, filter)
+    if history:
+        # A follow-up's answer depends on its conversation, it must not be served to anyone else
+        cache = None
+    result = cached if cached is not None else await generate_answer(question, llm, context_results, query_embedding, cache, prompt, history)
+    if session is not None:
+        session.add_turn(question, result["response"], result.get("references", []))
+    return result
+
+# Build the prompt from the retrieved context, ask the LLM and remember the answer
+async def generate_answer(question: str, llm: ChatOpenAI, context_results, query_embedding=None, cache=None, prompt: PromptTemplate = None, history: str = None) -> dict:
+    with stage("prompt"):
+        context_list, prompt_text, tokens_saved, references = build_budgeted_prompt(question, context_results, prompt, history)
+
+    with stage("llm"):
+        response = await llm.ainvoke(prompt_text)
+    result = { "response": response_text(response), "context": context_list, "references": references, "prompt_tokens_saved": tokens_saved}
+    record_llm_tokens("query", prompt_text, result["response"], response)
+    if cache is not None:
+        cache.put(question, query_embedding, result)
+    return result
+
+async def askLLMBatch(questions: list, llm: ChatOpenAI = None, vectorstore=None, cache=None, lexical_index=None, prompt: PromptTemplate = None, concurrency: int = batch_concurrency, filter: dict = None):
+    """
+    Answer many questions with one embedding request and one vector search for the whole batch,
+    then up to `concurrency` LLM completions at a time. Yields {"index", "question", ...answer}
+    or {"index", "question", "error"} for each question as soon as it is answered.
+    """
+    if llm is None:
+        llm = initialize_llm()
+    if vectorstore is None:
+        vectorstore = load_chroma(db_path)
+    if filter:
+        cache = None
+
+    # Repeated questions (after normalization) are retrieved and answered once
+    unique = {}
+    for index, question in enumerate(questions):
+        unique.setdefault(normalize_question(question), []).append(index)
+    groups = list(unique.values())
+    retrieved = await retrieve_context_batch([questions[group[0]] for group in groups], vectorstore, cache, lexical_index, prompt, filter=filter)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(position: int):
+        question = questions[groups[position][0]]
+        cached, context_results, query_embedding = retrieved[position]
+        try:
+            if cached is not None:
+                return position, cached
+            async with semaphore:
+                return position, await generate_answer(question, llm, context_results, query_embedding, cache, prompt)
+        except Exception as e:
+            print(f"Error answering batch question {groups[position][0]}: {e}")
+            return position, {"error": "An error occurred while processing this question."}
+
+    tasks = [asyncio.ensure_future(answer(position)) for position in range(len(groups))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            position, result = await next_done
+            for index in groups[position]:
+                yield {"index": index, "question": questions[index], **result}
+    finally:
+        # The client went away: don't keep paying for answers nobody will read
+        for task in tasks:
+            task.cancel()
+
+# Streaming version of askLLMAsync: yields the retrieved context first, then answer tokens as they arrive
+async def askLLMStream(question: str, llm: ChatOpenAI = None, vectorstore=None, cache=None, lexical_index=None, prompt: PromptTemplate = None, filter: dict = None, session=None):
+    if llm is None:
+        llm = initialize_llm()
+    if vectorstore is None:
+        vectorstore = load_chroma(db_path)
+    if filter:
+        cache = None
+
+    cached, context_results, query_embedding, history = await retrieve_turn_context(question, session, vectorstore, cache, lexical_index, prompt, filter)
+    if history:
+        cache = None
+    if cached is not None:
+        yield {"event": "context", "data": cached["context"], "references": cached.get("references", [])}
+        yield {"event": "token", "data": cached["response"]}
+        if session is not None:
+            session.add_turn(question, cached["response"], cached.get("references", []))
+        yield {"event": "done", "data": {"timings": timings_ms()}}
+        return
+
+    with stage("prompt"):
+        context_list, prompt_text, tokens_saved, references = build_budgeted_prompt(question, context_results, prompt, history)
+    # The full context, and its references for clients that only want chunk ids
+    yield {"event": "context", "data": context_list, "references": references}
+
+    tokens = []
+    usage = None
+    start_time = time.perf_counter()
+    async for chunk in llm.astream(prompt_text):
+        if not tokens:
+            record_stage("llm_first_token", time.perf_counter() - start_time)
+        usage = getattr(chunk, 'usage_metadata', None) or usage
+        token = chunk.content if hasattr(chunk, 'content') else chunk
+        if token:
+            tokens.append(token)
+            yield {"event": "token", "data": token}
+    record_stage("llm", time.perf_counter() - start_time)
+    answer = "".join(tokens).strip()
+    record_llm_tokens("query", prompt_text, answer, SimpleNamespace(usage_metadata=usage))
+    if cache is not None:
+        cache.put(question, query_embedding, { "response": answer, "context": context_list, "references": references, "prompt_tokens_saved": tokens_saved})
+    if session is not None:
+        session.add_turn(question, answer, references)
+    # Headers are sent before the answer streams, so the stage breakdown comes with the last event
+    yield {"event": "done", "data": {"prompt_tokens_saved": tokens_saved, "timings": timings_ms()}}
+
+# Context for the next turn of a conversation. The first turn is an ordinary question. Follow-ups
+# depend on what came before, so they skip the answer cache: one that names nothing new ("why?",
+# "explain that") is answered from the chunks of the previous answer without searching, a short one
+# is searched together with the previous question (see Session.retrieval_mode).
+# Returns retrieve_context's tuple and the conversation so far for the prompt, None without a session.
+async def retrieve_turn_context(question: str, session, vectorstore, cache=None, lexical_index=None, prompt: PromptTemplate = None, filter: dict = None):
+    if session is None or not session.turns:
+        cached, context_results, query_embedding = await retrieve_context(question, vectorstore, cache, lexical_index, prompt, filter=filter)
+        if session is not None:
+            session.last_retrieval = "cache" if cached is not None else "fresh"
+            session_turns.inc(retrieval=session.last_retrieval)
+        return cached, context_results, query_embedding, None
+
+    history = session.history_text()
+    mode = session.retrieval_mode(question)
+    context_results = None
+    # The previous chunks may come from outside the sections asked for now
+    if mode == "reuse" and not filter:
+        with stage("session"):
+            references = session.turns[-1]["references"]
+            scores = {id: reference["score"] for reference in references for id in reference["ids"]}
+            context_results = [(document, scores[id]) for id, document in await aget_documents(vectorstore, list(scores))]
+    if not context_results:
+        # A filter was given or the chunks are gone after an index rebuild: search with the previous question
+        mode = "expand" if mode == "reuse" else mode
+        query = question if mode == "fresh" else session.search_query(question)
+        _, context_results, _ = await retrieve_context(query, vectorstore, None, lexical_index, prompt, filter=filter)
+    session.last_retrieval = mode
+    session_turns.inc(retrieval=mode)
+    return None, context_results, None, history
+
+# retrieve_context for a whole batch: one embedding request and one vector search for every
+# question that is not answered by the cache or the lexical fast path. Same tuples, in order.
+async def retrieve_context_batch(questions: list, vectorstore, cache=None, lexical_index=None, prompt: PromptTemplate = None, k: int = context_candidates, filter: dict = None) -> list:
+    retrieved = [None] * len(questions)
+    lexical = [[] for _ in questions]
+    if cache is not None:
+        with stage("cache"):
+            cache.check_version(lambda: index_fingerprint(vectorstore, (prompt or get_summary_prompt()).template))
+            for index, question in enumerate(questions):
+                cached = cache.get_exact(question)
+                if cached is not None:
+                    answer_cache_lookups.inc(result="exact")
+                    retrieved[index] = (cached, None, None)
+
+    pending = []
+    with stage("lexical"):
+        for index, question in enumerate(questions):
+            if retrieved[index] is not None:
+                continue
+            lexical[index] = lexical_index.search(question, k, where=filter) if lexical_index is not None else []
+            if lexical_fast_path and lexical[index] and lexical_index.is_confident(question, lexical[index]):
+                if cache is not None:
+                    cache.record_miss()
+                    answer_cache_lookups.inc(result="miss")
+                retrieved[index] = (None, [(lexical_index.document(i), score) for i, score in lexical[index]], None)
+            else:
+                pending.append(index)
+    if not pending:
+        return retrieved
+
+    with stage("embed"):
+        # Embedded as queries, so each answer matches the one the single-question path would give
+        embeddings = await vectorstore.embeddings.aembed_queries([questions[index] for index in pending])
+    searches = []
+    for index, query_embedding in zip(pending, embeddings):
+        cached = cache.get_similar(query_embedding) if cache is not None else None
+        if cache is not None:
+            answer_cache_lookups.inc(result="semantic" if cached is not None else "miss")
+        if cached is not None:
+            retrieved[index] = (cached, None, query_embedding)
         else:
-            return { "response": response.strip(), "context": context_list}
-    except Exception as e:
-        raise e
\ No newline at end of file
+            searches.append((index, query_embedding))
+    if not searches:
+        return retrieved
+
+    with stage("search"):
+        dense = await aquery_vector_store_batch(vectorstore, [query_embedding for _, query_embedding in searches], k=k, filter=filter)
+    for (index, query_embedding), dense_results in zip(searches, dense):
+        if lexical[index]:
+            results = fuse_results(dense_results, lexical_index, lexical[index], k)
+        else:
+            results = [(document, 1.0 / (1.0 + distance)) for document, distance in dense_results]
+        retrieved[index] = (None, results, query_embedding)
+    return retrieved
+
+# Answer cache, lexical and vector retrieval in cheapest-first order.
+# Returns (cached answer or None, context results, query embedding or None)
+# Context results are (document, relevance) pairs, higher relevance is better.
+# filter (see core.sections.section_filter) limits both searches to matching chunks.
+async def retrieve_context(question: str, vectorstore, cache=None, lexical_index=None, prompt: PromptTemplate = None, k: int = context_candidates, filter: dict = None):
+    if cache is not None:
+        with stage("cache"):
+            cache.check_version(lambda: index_fingerprint(vectorstore, (prompt or get_summary_prompt()).template))
+            cached = cache.get_exact(question)
+        if cached is not None:
+            answer_cache_lookups.inc(result="exact")
+            return cached, None, None
+
+    # Exact names, dates and titles are answered from the lexical index without an embedding call
+    with stage("lexical"):
+        lexical_results = lexical_index.search(question, k, where=filter) if lexical_index is not None else []
+        confident = lexical_fast_path and lexical_results and lexical_index.is_confident(question, lexical_results)
+    if confident:
+        if cache is not None:
+            cache.record_miss()
+            answer_cache_lookups.inc(result="miss")
+        return None, [(lexical_index.document(index), score) for index, score in lexical_results], None
+
+    # The query embedding is shared by the semantic cache lookup and the vector search
+    with stage("embed"):
+        query_embedding = await vectorstore.embeddings.aembed_query(question)
+    if cache is not None:
+        with stage("cache"):
+            cached = cache.get_similar(query_embedding)
+        answer_cache_lookups.inc(result="semantic" if cached is not None else "miss")
+        if cached is not None:
+            return cached, None, query_embedding
+
+    with stage("search"):
+        dense_results = await aquery_vector_store(vectorstore=vectorstore, query=question, k=k, query_embedding=query_embedding, filter=filter)
+    if lexical_results:
+        with stage("fusion"):
+            return None, fuse_results(dense_results, lexical_index, lexical_results, k), query_embedding
+    # Chroma returns distances, lower is closer
+    return None, [(document, 1.0 / (1.0 + distance)) for document, distance in dense_results], query_embedding
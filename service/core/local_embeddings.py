@@ -0,0 +1,115 @@
+import os, re, zlib, asyncio
+from functools import lru_cache
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class HashingEmbeddings(Embeddings):
+    """
+    Feature hashing of words and word pairs into a fixed number of dimensions. No model files and
+    no network, and the same text gets the same vector in every process, which makes it useful for
+    tests and offline development. Similarity is purely lexical.
+    """
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def _vector(self, text: str) -> np.ndarray:
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        if features:
+            # crc32 rather than hash(), which changes between processes
+            hashes = np.array([zlib.crc32(feature.encode("utf-8")) for feature in features], dtype=np.uint32)
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vector, hashes % self.dimensions, signs)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return _normalize(np.stack([self._vector(text) for text in texts])).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+# Model files are looked up (or downloaded) once per process and the session is shared by every caller
+@lru_cache(maxsize=None)
+def load_onnx_model(model_name: str, model_dir: str, threads: int, max_length: int) -> tuple:
+    import onnxruntime
+    from tokenizers import Tokenizer
+
+    path = model_name if os.path.isdir(model_name) else _download_model(model_name, model_dir)
+    candidates = [os.path.join(path, "model.onnx"), os.path.join(path, "onnx", "model.onnx")]
+    model_path = next((candidate for candidate in candidates if os.path.exists(candidate)), None)
+    if model_path is None:
+        raise FileNotFoundError(f"No model.onnx found for embedding model {model_name} in {path}")
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+    tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+    tokenizer.enable_truncation(max_length=max_length)
+    pad_id = tokenizer.token_to_id("[PAD]")
+    tokenizer.enable_padding(pad_id=pad_id if pad_id is not None else 0, pad_token="[PAD]" if pad_id is not None else "<pad>")
+    print(f"Loaded embedding model {model_name} from {model_path} ({threads} threads)")
+    return session, tokenizer
+
+def _download_model(model_name: str, model_dir: str) -> str:
+    # Hugging Face repo id, e.g. sentence-transformers/all-MiniLM-L6-v2; only the ONNX export and tokenizer are fetched
+    from huggingface_hub import snapshot_download
+    return snapshot_download(model_name, cache_dir=model_dir, allow_patterns=["model.onnx", "onnx/model.onnx", "tokenizer.json"])
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence-transformer model exported to ONNX, run on the CPU with onnxruntime: token embeddings
+    are mean pooled over the attention mask and L2 normalized. Texts are embedded batch_size at a
+    time, sorted by length so each batch pads little, with `threads` threads per batch. Setting
+    `dimensions` keeps the first dimensions only, which suits Matryoshka-trained models.
+    """
+
+    def __init__(self, model_name: str, model_dir: str, dimensions: int = None, threads: int = None, batch_size: int = 32, max_length: int = 512):
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.session, self.tokenizer = load_onnx_model(model_name, model_dir, threads or os.cpu_count() or 1, max_length)
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64), "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]  # (texts, tokens, hidden size)
+        mask = attention_mask[:, :, None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.dimensions:
+            vectors = vectors[:, :self.dimensions]
+        return _normalize(vectors.astype(np.float32))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for index, vector in zip(batch, self._embed_batch([texts[index] for index in batch])):
+                vectors[index] = vector
+        return np.stack(vectors).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    # onnxruntime releases the GIL, so inference on a worker thread keeps the event loop free
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,168 @@
+import time, threading, contextvars
+from contextlib import contextmanager
+from core.tokens import count_tokens
+
+# Seconds; covers a cache hit (a few ms) up to a slow LLM call
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+registry = []
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """
+    Prometheus counter with optional labels. Safe to use from worker threads.
+    """
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+class Histogram:
+    """
+    Prometheus histogram with optional labels; buckets are cumulative when rendered.
+    """
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = default_buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.lock:
+            entry = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, entry in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    bucket_labels = _label_text(self.labels, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _label_text(self.labels, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {entry[-2]}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {entry[-1]}")
+        return lines
+
+def render() -> str:
+    # Prometheus text exposition format
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+stage_seconds = Histogram("askdoc_stage_seconds", "Time spent in each stage of answering a question, summarizing a section or indexing", ("stage",))
+request_seconds = Histogram("askdoc_request_seconds", "API request latency until the response is complete", ("method", "path"))
+requests_total = Counter("askdoc_requests_total", "API requests by status code", ("method", "path", "status"))
+llm_tokens = Counter("askdoc_llm_tokens_total", "LLM tokens sent and received", ("component", "direction"))
+answer_cache_lookups = Counter("askdoc_answer_cache_lookups_total", "Answer cache lookups by result", ("result",))
+coalesced_requests = Counter("askdoc_coalesced_requests_total", "Requests that joined an identical in-flight question instead of starting their own", ("mode",))
+llm_resilience = Counter("askdoc_llm_resilience_total", "Hedged requests, fallbacks, deadline misses, errors and circuit breaker rejections of LLM calls", ("event",))
+session_turns = Counter("askdoc_session_turns_total", "Questions asked in a conversation session, by how their context was found", ("retrieval",))
+session_events = Counter("askdoc_sessions_total", "Conversation sessions created, loaded from disk, expired and evicted from memory", ("event",))
+indexed_chunks = Counter("askdoc_indexed_chunks_total", "Chunks embedded and written to the vector store, and their tokens; the rate is the indexing throughput", ("unit",))
+summary_sections = Counter("askdoc_summary_sections_total", "Sections processed by the summarizer", ("status",))
+
+# Stage durations of the request being handled, for its Server-Timing header
+_timings = contextvars.ContextVar("timings", default=None)
+
+def start_timings() -> dict:
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+def current_timings() -> dict:
+    return _timings.get() or {}
+
+def record_stage(name: str, seconds: float):
+    stage_seconds.observe(seconds, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+@contextmanager
+def stage(name: str):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start_time)
+
+def timings_ms() -> dict:
+    return {name: round(seconds * 1000, 1) for name, seconds in current_timings().items()}
+
+def server_timing(timings: dict) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+def record_llm_tokens(component: str, prompt_text: str, completion_text: str, response=None):
+    # Use the provider's counts when the response carries them, otherwise count locally
+    usage = getattr(response, "usage_metadata", None) or {}
+    llm_tokens.inc(usage.get("input_tokens") or count_tokens(prompt_text), component=component, direction="input")
+    llm_tokens.inc(usage.get("output_tokens") or count_tokens(completion_text), component=component, direction="output")
+
+class TimingMiddleware:
+    """
+    ASGI middleware for /api requests: counts and times each request and adds a Server-Timing
+    header with the stages recorded while it was handled.
+    """
+
+    def __init__(self, app, prefix: str = "/api"):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        timings = start_timings()
+        start_time = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing({**timings, "total": time.perf_counter() - start_time})
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            # The route template rather than the raw path keeps the label set small
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            request_seconds.observe(time.perf_counter() - start_time, method=scope["method"], path=path)
+            requests_total.inc(method=scope["method"], path=path, status=status)
@@ -0,0 +1,348 @@
+import os, json, shutil, threading
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.documents import Document
+
+vectors_file_name = "numpy_vectors.f32"
+columns_file_name = "numpy_vectors.json"
+
+# Chroma-style where clauses: {"page": 3}, {"page": {"$gte": 3}}, {"$and": [...]}, {"$or": [...]}.
+# Range operators compare numbers only, like Chroma; chunks whose value is not a number never match them.
+_equality = {
+    "$eq": lambda column, value: column == value,
+    "$ne": lambda column, value: column != value,
+    "$in": lambda column, value: np.isin(column, list(value)),
+    "$nin": lambda column, value: ~np.isin(column, list(value))
+}
+_ranges = {
+    "$gt": lambda column, value: column > value,
+    "$gte": lambda column, value: column >= value,
+    "$lt": lambda column, value: column < value,
+    "$lte": lambda column, value: column <= value
+}
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _metadata_column(values: list) -> tuple:
+    # Every value for equality filters, and numbers as floats (NaN otherwise) for range filters
+    objects = np.empty(len(values), dtype=object)
+    objects[:] = values
+    numbers = np.array([value if _is_number(value) else np.nan for value in values], dtype=np.float64)
+    present = np.array([value is not None for value in values], dtype=bool)
+    return objects, numbers, present
+
+class _Snapshot:
+    # Everything a search reads, swapped in one assignment so searches never see a half-written update
+    def __init__(self, matrix: np.ndarray, ids: list, documents: list, metadatas: dict):
+        self.matrix = matrix
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas  # key -> list of values, None where a chunk has no such key
+        self.positions = {id: position for position, id in enumerate(ids)}
+        self._columns = {}
+
+    def column(self, key: str):
+        if key not in self._columns:
+            self._columns[key] = _metadata_column(self.metadatas.get(key, [None] * len(self.ids)))
+        return self._columns[key]
+
+    def metadata(self, position: int) -> dict:
+        return {key: values[position] for key, values in self.metadatas.items() if values[position] is not None}
+
+class NumpyCollection:
+    """
+    Exact vector search over normalized float32 embeddings in a memory-mapped file, with ids,
+    texts and metadata in a columnar JSON sidecar. Has the parts of the Chroma collection API
+    the service uses (count, peek, get, query, upsert, delete), so it can stand in for Chroma.
+    Distances are squared L2 between unit vectors, what Chroma reports for normalized embeddings.
+    """
+
+    name = "numpy"
+
+    def __init__(self, persist_directory: str):
+        self.persist_directory = persist_directory
+        self.vectors_path = os.path.join(persist_directory, vectors_file_name)
+        self.columns_path = os.path.join(persist_directory, columns_file_name)
+        self.dimensions = None
+        self.lock = threading.Lock()  # Serializes writers; searches read the current snapshot
+        self.snapshot = self._load()
+        self._pending = None  # Writes not yet in the sidecar, see buffered_writes
+        self._buffering = 0
+
+    def _load(self) -> _Snapshot:
+        if not os.path.exists(self.columns_path):
+            return _Snapshot(np.zeros((0, 0), dtype=np.float32), [], [], {})
+        with open(self.columns_path, 'r') as f:
+            columns = json.load(f)
+        self.dimensions = columns["dimensions"]
+        count = len(columns["ids"])
+        if count:
+            # The sidecar decides how many rows are valid; rows past it are from an interrupted write
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(count, self.dimensions))
+        else:
+            matrix = np.zeros((0, self.dimensions), dtype=np.float32)
+        return _Snapshot(matrix, columns["ids"], columns["documents"], columns["metadatas"])
+
+    def _save(self, ids: list, documents: list, metadatas: dict):
+        # Vectors are written before the sidecar, which is replaced atomically
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with open(f"{self.columns_path}.tmp", 'w') as f:
+            json.dump({"dimensions": self.dimensions, "ids": ids, "documents": documents, "metadatas": metadatas}, f)
+        os.replace(f"{self.columns_path}.tmp", self.columns_path)
+        self.snapshot = self._load()
+
+    def count(self) -> int:
+        return len(self.snapshot.ids)
+
+    def peek(self, limit: int = 10) -> dict:
+        return self.get(limit=limit, include=["embeddings", "documents", "metadatas"])
+
+    def get(self, ids: list = None, where: dict = None, limit: int = None, offset: int = None, include: list = ["metadatas", "documents"]) -> dict:
+        snapshot = self.snapshot
+        if ids is not None:
+            positions = [snapshot.positions[id] for id in ids if id in snapshot.positions]
+        else:
+            positions = list(range(len(snapshot.ids)))
+        if where:
+            mask = self._mask(snapshot, where)
+            positions = [position for position in positions if mask[position]]
+        positions = positions[offset or 0:]
+        if limit is not None:
+            positions = positions[:limit]
+        return {
+            "ids": [snapshot.ids[position] for position in positions],
+            "embeddings": np.asarray(snapshot.matrix[positions]) if "embeddings" in include else None,
+            "documents": [snapshot.documents[position] for position in positions] if "documents" in include else None,
+            "metadatas": [snapshot.metadata(position) for position in positions] if "metadatas" in include else None
+        }
+
+    def query(self, query_embeddings: list, n_results: int = 10, where: dict = None, include: list = ["metadatas", "documents", "distances"]) -> dict:
+        snapshot = self.snapshot
+        queries = _normalize(query_embeddings)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if not snapshot.ids:
+            for key in results:
+                results[key] = [[] for _ in queries]
+            return results
+
+        # Pre-filter: only rows matching the where clause are scored
+        candidates = np.flatnonzero(self._mask(snapshot, where)) if where else None
+        matrix = snapshot.matrix if candidates is None else snapshot.matrix[candidates]
+        k = min(n_results, matrix.shape[0])
+        # One matmul scores every query against every row; argpartition finds the top k without a full sort
+        similarities = queries @ matrix.T
+        if k < matrix.shape[0]:
+            top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(matrix.shape[0]), (len(queries), 1))
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        distances = np.maximum(2.0 - 2.0 * np.take_along_axis(top_similarities, order, axis=1), 0.0)
+
+        for rows, row_distances in zip(top, distances):
+            positions = rows if candidates is None else candidates[rows]
+            results["ids"].append([snapshot.ids[position] for position in positions])
+            results["documents"].append([snapshot.documents[position] for position in positions])
+            results["metadatas"].append([snapshot.metadata(position) for position in positions])
+            results["distances"].append(row_distances.tolist())
+        return {key: value for key, value in results.items() if key == "ids" or key in include}
+
+    @contextmanager
+    def buffered_writes(self):
+        """
+        Upserts inside the block append their vectors and update the columns in memory; the
+        sidecar is written, and the new rows become searchable, once when the block ends. Without
+        it every upsert rewrites the whole sidecar, which makes a large ingest quadratic.
+        """
+        with self.lock:
+            self._buffering += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._buffering -= 1
+                if not self._buffering:
+                    self._flush()
+
+    def _begin_write(self) -> dict:
+        if self._pending is None:
+            snapshot = self.snapshot
+            self._pending = {
+                "ids": list(snapshot.ids),
+                "documents": list(snapshot.documents),
+                "metadatas": {key: list(values) for key, values in snapshot.metadatas.items()},
+                "positions": dict(snapshot.positions),
+                "stored": len(snapshot.ids),  # Rows the current snapshot has memory-mapped
+                "updates": {}  # position -> vector for rows below stored
+            }
+            if os.path.exists(self.vectors_path):
+                # Drop rows left over from an interrupted write before appending
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(len(snapshot.ids) * self.dimensions * 4)
+        return self._pending
+
+    def upsert(self, ids: list, embeddings: list, documents: list = None, metadatas: list = None):
+        vectors = _normalize(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        with self.lock:
+            if self.dimensions is None:
+                self.dimensions = vectors.shape[1]
+            elif vectors.shape[1] != self.dimensions:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the index dimension {self.dimensions}")
+            pending = self._begin_write()
+            new_ids, new_documents, new_metadatas = pending["ids"], pending["documents"], pending["metadatas"]
+            first_appended = len(new_ids)
+            appended = []
+            rewrites = []  # (row, vector) for rows appended earlier in this buffer, no snapshot maps them yet
+            for id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+                position = pending["positions"].get(id)
+                if position is None:
+                    position = len(new_ids)
+                    pending["positions"][id] = position
+                    new_ids.append(id)
+                    new_documents.append(document)
+                    for values in new_metadatas.values():
+                        values.append(None)
+                    appended.append(vector)
+                else:
+                    new_documents[position] = document
+                    if position < pending["stored"]:
+                        pending["updates"][position] = vector
+                    elif position < first_appended:
+                        rewrites.append((position, vector))
+                    else:
+                        appended[position - first_appended] = vector
+                for key in new_metadatas:
+                    new_metadatas[key][position] = None
+                for key, value in (metadata or {}).items():
+                    new_metadatas.setdefault(key, [None] * len(new_ids))[position] = value
+
+            row_bytes = self.dimensions * 4
+            os.makedirs(self.persist_directory, exist_ok=True)
+            with open(self.vectors_path, 'r+b' if os.path.exists(self.vectors_path) else 'w+b') as f:
+                for position, vector in rewrites:
+                    f.seek(position * row_bytes)
+                    f.write(vector.tobytes())
+                f.seek(first_appended * row_bytes)
+                if appended:
+                    f.write(np.stack(appended).tobytes())
+            if not self._buffering:
+                self._flush()
+
+    def _flush(self):
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        if pending["updates"]:
+            # Live snapshots have these rows memory-mapped: write a new file and rename it over the old one
+            row_bytes = self.dimensions * 4
+            shutil.copyfile(self.vectors_path, f"{self.vectors_path}.tmp")
+            with open(f"{self.vectors_path}.tmp", 'r+b') as f:
+                for position, vector in sorted(pending["updates"].items()):
+                    f.seek(position * row_bytes)
+                    f.write(vector.tobytes())
+            os.replace(f"{self.vectors_path}.tmp", self.vectors_path)
+        self._save(pending["ids"], pending["documents"], pending["metadatas"])
+
+    def delete(self, ids: list = None):
+        with self.lock:
+            self._flush()
+            snapshot = self.snapshot
+            removed = {snapshot.positions[id] for id in ids or [] if id in snapshot.positions}
+            if not removed:
+                return
+            keep = [position for position in range(len(snapshot.ids)) if position not in removed]
+            matrix = np.asarray(snapshot.matrix[keep])
+            # Compact into a new file; open memmaps of the old one stay valid until released
+            with open(f"{self.vectors_path}.tmp", 'wb') as f:
+                f.write(matrix.tobytes())
+            os.replace(f"{self.vectors_path}.tmp", self.vectors_path)
+            self._save(
+                [snapshot.ids[position] for position in keep],
+                [snapshot.documents[position] for position in keep],
+                {key: [values[position] for position in keep] for key, values in snapshot.metadatas.items()}
+            )
+
+    def reset(self):
+        # Remove every vector, the next upsert may use a different dimension count
+        with self.lock:
+            self._pending = None
+            for path in (self.columns_path, self.vectors_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.dimensions = None
+            self.snapshot = self._load()
+
+    def close(self):
+        self.snapshot = _Snapshot(np.zeros((0, 0), dtype=np.float32), [], [], {})
+
+    def _mask(self, snapshot: _Snapshot, where: dict) -> np.ndarray:
+        mask = np.ones(len(snapshot.ids), dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._mask(snapshot, clause)
+            elif key == "$or":
+                either = np.zeros(len(snapshot.ids), dtype=bool)
+                for clause in condition:
+                    either |= self._mask(snapshot, clause)
+                mask &= either
+            else:
+                objects, numbers, present = snapshot.column(key)
+                operators = condition if isinstance(condition, dict) else {"$eq": condition}
+                for operator, value in operators.items():
+                    if operator in _equality:
+                        # Chunks without the key never match, as in Chroma
+                        mask &= present & _equality[operator](objects, value)
+                    elif operator in _ranges:
+                        with np.errstate(invalid="ignore"):
+                            mask &= _ranges[operator](numbers, value)
+                    else:
+                        raise ValueError(f"Unsupported filter operator {operator}")
+        return mask
+
+class NumpyVectorStore:
+    """
+    Drop-in for the langchain Chroma store on top of NumpyCollection: the same search methods,
+    and the same embeddings / _collection / _persist_directory attributes the service reads.
+    """
+
+    def __init__(self, persist_directory: str, embedding_function):
+        self._persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self._collection = NumpyCollection(persist_directory)
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def get(self, ids: list = None, where: dict = None, limit: int = None, offset: int = None, include: list = ["metadatas", "documents"]) -> dict:
+        return self._collection.get(ids=ids, where=where, limit=limit, offset=offset, include=include)
+
+    def delete(self, ids: list = None):
+        self._collection.delete(ids)
+
+    def reset_collection(self):
+        self._collection.reset()
+
+    # Returns (document, distance) pairs like Chroma, lower is closer
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: list, k: int = 4, filter: dict = None) -> list:
+        results = self._collection.query(query_embeddings=[embedding], n_results=k, where=filter)
+        return [
+            (Document(page_content=text, metadata=metadata), distance)
+            for text, metadata, distance in zip(results["documents"][0], results["metadatas"][0], results["distances"][0])
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict = None) -> list:
+        return self.similarity_search_by_vector_with_relevance_scores(self.embeddings.embed_query(query), k=k, filter=filter)
+
+    def close(self):
+        self._collection.close()
@@ -1,6 +1,7 @@
-from openapi_core.spec.paths import Spec
-from openapi_core.contrib.fastapi.middlewares import FastAPIOpenAPIMiddleware
+import threading
+from functools import lru_cache
 from fastapi import Request
+from core.metrics import stage
 import yaml, os
 from dotenv import load_dotenv
 
@@ -11,7 +12,20 @@ open_api = os.getenv('OPENAPI_SPEC')
 # Load the OpenAPI spec using PyYAML
 with open(open_api, "r") as file:
     spec_dict = yaml.safe_load(file)  # Parse the YAML spec
-spec = Spec.from_dict(spec_dict)
+
+# openapi_core is slow to import, so the validator is built during startup or by the first request that
+# needs it. Both can run at once on different threads, and concurrent imports of openapi_core deadlock.
+_validator_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def _load_validator():
+    from openapi_core.spec.paths import Spec
+    from openapi_core.contrib.fastapi.middlewares import FastAPIOpenAPIMiddleware
+    return Spec.from_dict(spec_dict), FastAPIOpenAPIMiddleware
+
+def load_validator():
+    with _validator_lock:
+        return _load_validator()
 
 # Override FastAPI's OpenAPI schema to use the custom OpenAPI spec
 def custom_openapi():
@@ -19,5 +33,7 @@ def custom_openapi():
 
 # Create a wrapper around the FastAPIOpenAPIMiddleware for OpenAPI validation
 def openapi_validation_dependency(request: Request):
-    middleware = FastAPIOpenAPIMiddleware(request.app, openapi=spec)
+    with stage("validation"):
+        spec, FastAPIOpenAPIMiddleware = load_validator()
+        middleware = FastAPIOpenAPIMiddleware(request.app, openapi=spec)
     return middleware
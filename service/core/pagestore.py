@@ -0,0 +1,103 @@
+import os, json, mmap, shutil, time
+from array import array
+from pathlib import Path
+from langchain_core.documents import Document
+from core.document import iter_pages, resolve_path, file_hash, PdfPages
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+page_cache_enabled = os.getenv('PAGE_CACHE', 'true').lower() == 'true'
+page_cache_dir = os.getenv('PAGE_CACHE_DIR', 'page_cache')  # Relative to ./service, like DOCUMENT
+
+class PageStore:
+    """
+    Parsed pages of one PDF on disk: pages.txt holds the UTF-8 text of every page back to back
+    and offsets.bin holds n + 1 byte offsets into it. The text file is memory-mapped, so reading
+    a page range is a slice of the map with no PDF parsing.
+    """
+
+    def __init__(self, directory: str, source: str):
+        self.directory = directory
+        self.source = source  # Absolute PDF path, used as page metadata like PyPDFLoader
+        self.offsets = array('Q')
+        with open(os.path.join(directory, "offsets.bin"), 'rb') as f:
+            self.offsets.frombytes(f.read())
+        self._file = open(os.path.join(directory, "pages.txt"), 'rb')
+        # mmap cannot map an empty file, a PDF without text has nothing to slice anyway
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # Zero-copy view of the bytes for pages [start, end), 0-based
+    def page_bytes(self, start: int, end: int) -> memoryview:
+        return memoryview(self._map)[self.offsets[start]:self.offsets[end]]
+
+    def page_text(self, page: int) -> str:
+        return str(self.page_bytes(page, page + 1), "utf-8")
+
+    def _document(self, page: int) -> Document:
+        return Document(page_content=self.page_text(page), metadata={'source': self.source, 'page': page})
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._document(page) for page in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        return self._document(index)
+
+    def __iter__(self):
+        for page in range(len(self)):
+            yield self._document(page)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def build_page_store(file_path: str, directory: str):
+    # Write into a temporary directory and rename it, so a partial build is never picked up
+    temp_directory = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    start_time = time.time()
+    offsets = array('Q', [0])
+    with open(os.path.join(temp_directory, "pages.txt"), 'wb') as f:
+        for page in iter_pages(file_path):
+            data = page.page_content.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    with open(os.path.join(temp_directory, "offsets.bin"), 'wb') as f:
+        offsets.tofile(f)
+    with open(os.path.join(temp_directory, "meta.json"), 'w') as f:
+        json.dump({"document": file_path, "pages": len(offsets) - 1}, f)
+    try:
+        os.rename(temp_directory, directory)
+    except OSError:
+        # Another process finished the same build first, keep theirs
+        shutil.rmtree(temp_directory, ignore_errors=True)
+    print(f"Cached {len(offsets) - 1} parsed pages of {file_path} in {time.time() - start_time:.1f} seconds")
+
+def open_pages(file_path: str):
+    """
+    Page source for a PDF, shared by the service and the processing scripts. Pages are parsed
+    once per PDF content hash and cached under PAGE_CACHE_DIR; later calls read the cache.
+    """
+    if not os.path.exists(resolve_path(file_path)):
+        raise FileNotFoundError(file_path)
+    if not page_cache_enabled:
+        return PdfPages(file_path)
+    root_dir = Path(__file__).resolve().parent.parent
+    directory = os.path.join(root_dir, page_cache_dir, file_hash(file_path))
+    if not os.path.exists(os.path.join(directory, "offsets.bin")):
+        build_page_store(file_path, directory)
+    return PageStore(directory, resolve_path(file_path))
@@ -0,0 +1,163 @@
+import os, json, asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from core.llm import get_summary_prompt
+from core import vectors
+from core.vectors import load_chroma, close_chroma
+from core.lexical import load_lexical_index
+from core.sections import load_section_index
+from core.cache import AnswerCache, cache_enabled, cache_path
+from core.artifacts import resolve_index
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+collections_file = os.getenv('COLLECTIONS_FILE')  # JSON list of collections; without it the single DOCUMENT is served
+default_document_id = os.getenv('DEFAULT_DOCUMENT_ID', 'default')
+max_open_collections = int(os.getenv('MAX_OPEN_COLLECTIONS', '8'))
+hybrid_search = os.getenv('HYBRID_SEARCH', 'true').lower() == 'true'
+
+class Collection:
+    """
+    One indexed document: where its files live, its title and prompt, and, while it is open,
+    its vector store, lexical index, section index and answer cache.
+    """
+
+    def __init__(self, id: str, title: str, document: str, summary: str, chroma_path: str, prompt: str = None, sections: str = None):
+        self.id = id
+        self.title = title
+        self.document = document
+        self.summary = summary
+        self.chroma_path = chroma_path
+        self.sections = sections  # Preprocessed table of contents, used when indexing
+        self.prompt = get_summary_prompt(title, prompt)
+        self.vectorstore = None
+        self.lexical_index = None
+        self.section_index = None
+        self.cache = None
+        self.users = 0  # Requests currently holding the collection; it is never evicted while in use
+
+    @classmethod
+    def from_dict(cls, config: dict):
+        return cls(config['id'], config.get('title', config['id']), config.get('document'), config.get('summary'), config['chroma_path'], config.get('prompt'), config.get('sections'))
+
+    def describe(self) -> dict:
+        return {"id": self.id, "title": self.title, "open": self.is_open}
+
+    @property
+    def is_open(self) -> bool:
+        return self.vectorstore is not None
+
+    def open(self):
+        # chroma_path can be an artifact directory of published versions, then the current one is opened
+        persist_directory = resolve_index(self.chroma_path)
+        self.vectorstore = load_chroma(persist_directory)
+        self.lexical_index = load_lexical_index(persist_directory) if hybrid_search else None
+        self.section_index = load_section_index(persist_directory)
+        if cache_enabled:
+            # Each collection gets its own answers; a shared cache file is split per collection
+            path = None
+            if cache_path:
+                root, extension = os.path.splitext(cache_path)
+                path = f"{root}.{self.id}{extension}"
+            self.cache = AnswerCache(path=path)
+        print(f"Collection {self.id} opened")
+        return self
+
+    def warm_up(self):
+        # Load the index (Chroma's SQLite and HNSW, or the mapped NumPy file) by searching with a stored vector, no embedding call needed
+        collection = self.vectorstore._collection
+        count = collection.count()
+        if count:
+            sample = collection.peek(1).get('embeddings')
+            if sample is not None and len(sample):
+                collection.query(query_embeddings=[sample[0]], n_results=1)
+        print(f"Warm-up of {self.id} complete, {count} vectors available")
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        if self.vectorstore is not None:
+            close_chroma(self.vectorstore)
+        self.vectorstore = None
+        self.lexical_index = None
+        self.section_index = None
+        self.cache = None
+        print(f"Collection {self.id} closed")
+
+class CollectionRegistry:
+    """
+    Every known collection, with at most max_open of them open at once. Collections are opened
+    on first use and the least recently used idle one is closed to make room.
+    """
+
+    def __init__(self, collections: list, default_id: str = default_document_id, max_open: int = max_open_collections):
+        self.collections = {collection.id: collection for collection in collections}
+        self.default_id = default_id if default_id in self.collections else next(iter(self.collections), None)
+        self.max_open = max_open
+        self.open_collections = OrderedDict()  # id -> Collection, least recently used first
+        self.locks = {}
+
+    @classmethod
+    def from_env(cls):
+        if collections_file:
+            with open(collections_file, 'r') as f:
+                collections = [Collection.from_dict(config) for config in json.load(f)]
+        else:
+            collections = [Collection(
+                'default', os.getenv('DOCUMENT_TITLE'), os.getenv('DOCUMENT'), os.getenv('SUMMARY'), os.getenv('CHROMA_PATH'),
+                sections=os.getenv('PRE_PROCESSED_SECTIONS')
+            )]
+        return cls(collections)
+
+    @property
+    def embeddings(self):
+        # One embedding model and cache is shared by every collection
+        return vectors.embeddings
+
+    def get(self, document_id: str = None) -> Collection:
+        # Raises KeyError for unknown ids
+        return self.collections[document_id or self.default_id]
+
+    def list(self) -> list:
+        return [collection.describe() for collection in self.collections.values()]
+
+    def _evict(self):
+        for id, collection in list(self.open_collections.items()):
+            if len(self.open_collections) < self.max_open:
+                return
+            if collection.users == 0:
+                del self.open_collections[id]
+                collection.close()
+
+    async def acquire(self, document_id: str = None) -> Collection:
+        collection = self.get(document_id)
+        collection.users += 1
+        try:
+            lock = self.locks.setdefault(collection.id, asyncio.Lock())
+            async with lock:
+                if not collection.is_open:
+                    self._evict()
+                    await asyncio.to_thread(collection.open)
+                    self.open_collections[collection.id] = collection
+        except BaseException:
+            collection.users -= 1
+            raise
+        self.open_collections.move_to_end(collection.id)
+        return collection
+
+    def release(self, collection: Collection):
+        collection.users -= 1
+
+    @asynccontextmanager
+    async def use(self, document_id: str = None):
+        collection = await self.acquire(document_id)
+        try:
+            yield collection
+        finally:
+            self.release(collection)
+
+    def close(self):
+        for collection in self.open_collections.values():
+            collection.close()
+        self.open_collections.clear()
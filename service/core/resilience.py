@@ -0,0 +1,246 @@
+import os, time, asyncio, contextvars
+from collections import deque
+import numpy as np
+from core.metrics import llm_resilience
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+llm_deadline = float(os.getenv('LLM_DEADLINE', '30'))  # Seconds per LLM call when the request sets no deadline
+hedge_enabled = os.getenv('LLM_HEDGE', 'true').lower() == 'true'
+hedge_percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+hedge_min_delay = float(os.getenv('LLM_HEDGE_MIN_DELAY', '1.0'))
+hedge_initial_delay = float(os.getenv('LLM_HEDGE_INITIAL_DELAY', '5.0'))  # Until enough latencies are recorded
+hedge_ratio = float(os.getenv('LLM_HEDGE_RATIO', '0.1'))  # Most hedged calls per call, over time
+breaker_failures = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+breaker_reset = float(os.getenv('LLM_BREAKER_RESET', '30'))
+fallback_model = os.getenv('LLM_FALLBACK_MODEL')  # e.g. the SUMMARY_MODEL; no fallback when unset
+
+class DeadlineExceeded(Exception):
+    pass
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM is unavailable, retry in {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+# Absolute deadline (time.monotonic()) of the request being handled, if it set one
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+def set_deadline(seconds: float):
+    _deadline.set(time.monotonic() + seconds)
+
+def remaining_time(default: float = llm_deadline) -> float:
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(deadline - time.monotonic(), 0.0)
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures and rejects calls for `reset` seconds, then lets
+    a single trial call through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failures: int = breaker_failures, reset: float = breaker_reset):
+        self.failures = failures
+        self.reset = reset
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.opened_at + self.reset - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.retry_after() > 0 or self.trial_running:
+            return False
+        self.trial_running = True
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.trial_running or self.consecutive_failures >= self.failures:
+            if self.opened_at is None or self.trial_running:
+                print(f"LLM circuit opened after {self.consecutive_failures} failures")
+            self.opened_at = time.monotonic()
+        self.trial_running = False
+
+class ResilientLLM:
+    """
+    Wraps the chat model for the query path. Each call gets the request's remaining deadline,
+    a duplicate (hedged) request goes out if the first is slower than the recent p95, a circuit
+    breaker fails fast while upstream is unhealthy, and errors can fall back to a cheaper model.
+    Hedges are capped at hedge_ratio of calls so a slow upstream does not get double the load.
+    """
+
+    def __init__(self, llm, fallback=None, hedge: bool = hedge_enabled):
+        self.llm = llm
+        self.fallback = fallback
+        self.hedge = hedge
+        self.breaker = CircuitBreaker()
+        self.latencies = deque(maxlen=200)
+        self.hedge_budget = 1.0
+
+    @property
+    def model_name(self):
+        return getattr(self.llm, "model_name", None)
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < 20:
+            return hedge_initial_delay
+        return max(float(np.percentile(self.latencies, hedge_percentile)), hedge_min_delay)
+
+    def _take_hedge(self) -> bool:
+        if not self.hedge or self.hedge_budget < 1.0:
+            return False
+        self.hedge_budget -= 1.0
+        return True
+
+    async def _race(self, input, timeout: float, **kwargs):
+        # The first request, plus a hedge once it is slower than usual; the first answer wins
+        start_time = time.monotonic()
+        primary = asyncio.ensure_future(self.llm.ainvoke(input, **kwargs))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=min(self.hedge_delay(), timeout))
+            if not done and self._take_hedge():
+                llm_resilience.inc(event="hedge_sent")
+                tasks.append(asyncio.ensure_future(self.llm.ainvoke(input, **kwargs)))
+            running = list(tasks)
+            while True:
+                remaining = timeout - (time.monotonic() - start_time)
+                done, pending = await asyncio.wait(running, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceeded(f"No LLM response within {timeout * 1000:.0f} ms")
+                winner = done.pop()
+                if winner.exception() is None or not pending:
+                    break
+                # One of the two failed, keep waiting for the other
+                running = list(pending)
+            if winner is not primary:
+                llm_resilience.inc(event="hedge_won")
+            self.latencies.append(time.monotonic() - start_time)
+            return winner.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def ainvoke(self, input, **kwargs):
+        self.hedge_budget = min(self.hedge_budget + hedge_ratio, 10.0)
+        timeout = remaining_time()
+        if timeout <= 0:
+            llm_resilience.inc(event="deadline_exceeded")
+            raise DeadlineExceeded("The request deadline passed before the LLM call")
+
+        if not self.breaker.allow():
+            llm_resilience.inc(event="circuit_rejected")
+            return await self._fallback(input, CircuitOpenError(self.breaker.retry_after()), **kwargs)
+        try:
+            response = await self._race(input, timeout, **kwargs)
+        except asyncio.CancelledError:
+            self.breaker.trial_running = False
+            raise
+        except DeadlineExceeded:
+            llm_resilience.inc(event="deadline_exceeded")
+            # A deadline shorter than usual latency says nothing about upstream health
+            if timeout >= self.hedge_delay():
+                self.breaker.record_failure()
+            else:
+                self.breaker.trial_running = False
+            raise
+        except Exception as e:
+            llm_resilience.inc(event="error")
+            self.breaker.record_failure()
+            return await self._fallback(input, e, **kwargs)
+        self.breaker.record_success()
+        return response
+
+    async def _fallback(self, input, error: Exception, **kwargs):
+        timeout = remaining_time()
+        if self.fallback is None or timeout <= 0:
+            raise error
+        llm_resilience.inc(event="fallback")
+        try:
+            return await asyncio.wait_for(self.fallback.ainvoke(input, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"No fallback LLM response within {timeout * 1000:.0f} ms")
+
+    async def astream(self, input, **kwargs):
+        # Streams are not hedged; the deadline covers the wait for the first token
+        self.hedge_budget = min(self.hedge_budget + hedge_ratio, 10.0)
+        llm = self.llm
+        if not self.breaker.allow():
+            llm_resilience.inc(event="circuit_rejected")
+            if self.fallback is None:
+                raise CircuitOpenError(self.breaker.retry_after())
+            llm_resilience.inc(event="fallback")
+            llm = self.fallback
+
+        stream = llm.astream(input, **kwargs)
+        timeout = remaining_time()
+        try:
+            first = await asyncio.wait_for(stream.__anext__(), timeout)
+        except StopAsyncIteration:
+            self._record(llm, None)
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away before the first token: that says nothing about upstream health,
+            # but a half-open trial must not stay marked as running or the circuit never closes
+            if llm is self.llm:
+                self.breaker.trial_running = False
+            await stream.aclose()
+            raise
+        except asyncio.TimeoutError:
+            llm_resilience.inc(event="deadline_exceeded")
+            self._record(llm, DeadlineExceeded())
+            # Don't leave the upstream request open
+            await stream.aclose()
+            raise DeadlineExceeded(f"No LLM response within {timeout * 1000:.0f} ms")
+        except Exception as e:
+            llm_resilience.inc(event="error")
+            self._record(llm, e)
+            await stream.aclose()
+            if llm is self.fallback or self.fallback is None:
+                raise
+            llm_resilience.inc(event="fallback")
+            async for chunk in self.fallback.astream(input, **kwargs):
+                yield chunk
+            return
+        self._record(llm, None)
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+    def _record(self, llm, error):
+        # Only the primary model's health drives the circuit
+        if llm is not self.llm:
+            return
+        if error is None:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def invoke(self, input, **kwargs):
+        # Sync path (askLLM): circuit breaking only
+        if not self.breaker.allow():
+            llm_resilience.inc(event="circuit_rejected")
+            if self.fallback is None:
+                raise CircuitOpenError(self.breaker.retry_after())
+            return self.fallback.invoke(input, **kwargs)
+        try:
+            response = self.llm.invoke(input, **kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return response
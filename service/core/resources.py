@@ -0,0 +1,83 @@
+import os, asyncio
+import httpx
+from core.llm import initialize_llm
+from core.limits import ConcurrencyLimiter
+from core.registry import CollectionRegistry
+from core.coalesce import SingleFlight
+from core.sessions import SessionStore
+from core.resilience import ResilientLLM, fallback_model
+from core.tokens import count_tokens
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# Connection pool settings for the OpenAI HTTP clients
+max_connections = int(os.getenv('LLM_MAX_CONNECTIONS', '100'))
+max_keepalive = int(os.getenv('LLM_MAX_KEEPALIVE', '20'))
+keepalive_expiry = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '30'))
+warm_up_on_start = os.getenv('WARM_UP', 'true').lower() == 'true'
+
+class Resources:
+    """
+    Long-lived clients shared by every request: pooled HTTP clients, the chat model, the
+    collection registry, the query concurrency limiter, in-flight question coalescing and
+    conversation sessions.
+    Created once in the app lifespan and stored on app.state.
+    """
+
+    def __init__(self, registry: CollectionRegistry = None):
+        self.http_client = None
+        self.http_async_client = None
+        self.llm = None
+        self.registry = registry or CollectionRegistry.from_env()
+        self.limiter = ConcurrencyLimiter()
+        self.flights = SingleFlight()
+        self.sessions = SessionStore()
+
+    def open(self):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http_client = httpx.Client(limits=limits)
+        self.http_async_client = httpx.AsyncClient(limits=limits)
+        # Deadlines, hedging and circuit breaking around the chat model, optionally falling back to a cheaper one
+        primary = initialize_llm(http_client=self.http_client, http_async_client=self.http_async_client)
+        fallback = initialize_llm(model_name=fallback_model, http_client=self.http_client, http_async_client=self.http_async_client) if fallback_model else None
+        self.llm = ResilientLLM(primary, fallback)
+        print(f"Resources opened (max connections: {max_connections}, keepalive: {max_keepalive})")
+        return self
+
+    async def warm_up(self):
+        # Open the default collection ahead of the first request, the others open on first use
+        async with self.registry.use() as collection:
+            await asyncio.to_thread(collection.warm_up)
+        # Load the embedding model and tokenizer and connect to the LLM API, so the first question pays for none of it
+        await asyncio.gather(asyncio.to_thread(self.warm_up_models), self.warm_up_llm())
+
+    def warm_up_models(self):
+        self.registry.embeddings.underlying  # Creates the embedding model on first access
+        count_tokens("warm up")
+
+    async def warm_up_llm(self):
+        llm = self.llm.llm
+        if not hasattr(llm, "openai_api_key"):
+            return
+        # Any response leaves a pooled TLS connection for the first question to reuse; /models is free
+        base_url = getattr(llm, "openai_api_base", None) or "https://api.openai.com/v1"
+        api_key = llm.openai_api_key.get_secret_value() if llm.openai_api_key else ""
+        try:
+            await self.http_async_client.get(f"{base_url.rstrip('/')}/models", headers={"Authorization": f"Bearer {api_key}"}, timeout=5)
+        except httpx.HTTPError as e:
+            print(f"Warning: Could not connect to the LLM API during warm-up: {e}")
+
+    async def aclose(self):
+        if self.http_async_client is not None:
+            await self.http_async_client.aclose()
+        if self.http_client is not None:
+            self.http_client.close()
+        self.registry.close()
+        self.sessions.close()
+        self.llm = None
+        print("Resources closed")
@@ -0,0 +1,118 @@
+import os, json
+from bisect import bisect_right
+from core.document import resolve_path
+from processing.preprocessing import merge_overlapping_sections
+
+section_index_name = "section_index.json"
+
+class SectionIndex:
+    """
+    Page to section lookup over the preprocessed table of contents. Overlapping sections are
+    merged, so the intervals are disjoint and sorted and a page is found with one binary search.
+    Pages are 0-based like chunk metadata, while the TOC pageRange is 1-based and inclusive.
+    """
+
+    def __init__(self, sections: list):
+        self.sections = merge_overlapping_sections([{"author": None, **section} for section in sections]) if sections else []
+        self.starts = [section['pageRange'][0] - 1 for section in self.sections]
+        self.ends = [section['pageRange'][1] - 1 for section in self.sections]
+
+    def section_for(self, page: int):
+        # The section containing this page, or None for pages between or outside sections
+        position = bisect_right(self.starts, page) - 1
+        if position >= 0 and page <= self.ends[position]:
+            return self.sections[position]
+        return None
+
+    def get(self, name: str):
+        return next((section for section in self.sections if section['sectionName'] == name), None)
+
+    def describe(self) -> list:
+        return [{"name": section['sectionName'], "pageRange": section['pageRange']} for section in self.sections]
+
+    def save(self, persist_directory: str):
+        path = os.path.join(persist_directory, section_index_name)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(self.sections, f)
+        os.replace(f"{path}.tmp", path)
+
+# PRE_PROCESSED_SECTIONS relative to ./service, or None when there is no such file. preprocessing.py
+# writes it in ./processing, so it is looked up there as well.
+def find_sections_file(file_path: str):
+    if not file_path:
+        return None
+    for path in (file_path, os.path.join("processing", file_path)):
+        if os.path.exists(resolve_path(path)):
+            return path
+    print(f"Warning: The sections file {file_path} does not exist, chunks will have no section")
+    return None
+
+def load_sections_file(file_path: str):
+    if not file_path:
+        return None
+    with open(resolve_path(file_path), 'r') as f:
+        return SectionIndex(json.load(f))
+
+# The section index saved with the vector store at indexing time
+def load_section_index(persist_directory: str):
+    path = os.path.join(persist_directory, section_index_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return SectionIndex(json.load(f))
+
+# Where clause for the vector store and lexical index. section is a name or a list of names,
+# pages is [first, last], 1-based and inclusive like the TOC; a chunk matches if it overlaps them.
+def section_filter(section=None, pages: list = None):
+    clauses = []
+    if section:
+        names = [section] if isinstance(section, str) else list(section)
+        clauses.append({"section_name": {"$in": names}})
+    if pages:
+        first, last = pages
+        clauses.append({"page": {"$lte": last - 1}})
+        clauses.append({"page_end": {"$gte": first - 1}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+# Evaluate a where clause against one chunk's metadata, for indexes that are not the vector store
+def matches_filter(metadata: dict, where: dict) -> bool:
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, clause) for clause in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            operators = condition if isinstance(condition, dict) else {"$eq": condition}
+            for operator, expected in operators.items():
+                if not _compare(operator, value, expected):
+                    return False
+    return True
+
+def _compare(operator: str, value, expected) -> bool:
+    if value is None:
+        return False
+    if operator == "$eq":
+        return value == expected
+    if operator == "$ne":
+        return value != expected
+    if operator == "$in":
+        return value in expected
+    if operator == "$nin":
+        return value not in expected
+    # Range operators only compare numbers, like Chroma
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return False
+    if operator == "$gt":
+        return value > expected
+    if operator == "$gte":
+        return value >= expected
+    if operator == "$lt":
+        return value < expected
+    if operator == "$lte":
+        return value <= expected
+    raise ValueError(f"Unsupported filter operator {operator}")
@@ -0,0 +1,219 @@
+import os, re, json, time, secrets, sqlite3, asyncio
+from collections import OrderedDict
+from core.tokens import count_tokens
+from core.lexical import tokenize, stopwords
+from core.metrics import session_events
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+sessions_enabled = os.getenv('SESSIONS', 'true').lower() == 'true'
+session_ttl = float(os.getenv('SESSION_TTL', '3600'))  # Seconds since the last turn
+max_sessions = int(os.getenv('SESSION_MAX', '10000'))  # Kept in memory; with SESSION_PATH older ones stay on disk
+session_path = os.getenv('SESSION_PATH')  # Optional SQLite file so conversations survive restarts
+session_turns = int(os.getenv('SESSION_TURNS', '3'))  # Recent turns kept word for word, older ones are summarized
+history_tokens = int(os.getenv('SESSION_HISTORY_TOKENS', '800'))  # Most prompt tokens spent on the conversation
+summary_tokens = int(os.getenv('SESSION_SUMMARY_TOKENS', '250'))  # Share of history_tokens for the rolling summary
+summary_line_tokens = 60  # Each summarized turn: the question and the first sentence of its answer
+followup_terms = int(os.getenv('SESSION_FOLLOWUP_TERMS', '3'))  # Questions with fewer new terms are searched with the previous one
+
+# Words that ask for more of the same rather than name a topic: "why?", "tell me more", "explain that"
+followup_words = {
+    "about", "again", "also", "and", "answer", "can", "clarify", "could", "detail", "details", "elaborate", "else",
+    "example", "examples", "expand", "explain", "further", "go", "i", "it", "its", "me", "mean", "means", "more",
+    "please", "previous", "so", "tell", "than", "that", "them", "then", "there", "these", "they", "those", "you", "your"
+}
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    while tokens > max_tokens:
+        text = text[:int(len(text) * max_tokens / tokens * 0.9)]
+        tokens = count_tokens(text)
+    return text.rstrip() + "..."
+
+def first_sentence(text: str) -> str:
+    match = re.match(r"(.+?[.!?])(\s|$)", " ".join(text.split()))
+    return match.group(1) if match else " ".join(text.split())
+
+class Session:
+    """
+    One conversation with a document: the last few turns word for word, a rolling summary of
+    the turns before them within summary_tokens, and the chunks each recent turn was answered
+    from. The conversation costs at most history_tokens of prompt however long it gets.
+    """
+
+    def __init__(self, id: str, document_id: str, turns: list = None, summary: list = None, created: float = None, updated: float = None):
+        self.id = id
+        self.document_id = document_id
+        self.turns = turns or []  # {"question", "answer", "references"}, oldest first
+        self.summary = summary or []  # One line per summarized turn, oldest first
+        self.created = created or time.time()
+        self.updated = updated or self.created
+        self.turn_count = len(self.summary) + len(self.turns)
+        self.last_retrieval = None
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        session = cls(data["id"], data["document_id"], data["turns"], data["summary"], data["created"], data["updated"])
+        session.turn_count = data.get("turn_count", session.turn_count)
+        return session
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id, "document_id": self.document_id, "turns": self.turns, "summary": self.summary,
+            "created": self.created, "updated": self.updated, "turn_count": self.turn_count
+        }
+
+    def add_turn(self, question: str, answer: str, references: list):
+        self.turns.append({"question": question, "answer": answer, "references": references})
+        self.turn_count += 1
+        self.updated = time.time()
+        while len(self.turns) > session_turns:
+            turn = self.turns.pop(0)
+            self.summary.append(truncate_tokens(f"{turn['question']} -> {first_sentence(turn['answer'])}", summary_line_tokens))
+        while len(self.summary) > 1 and count_tokens("\n".join(self.summary)) > summary_tokens:
+            self.summary.pop(0)
+
+    def history_text(self) -> str:
+        # Newest turns first until the budget is spent, then back in conversation order
+        if not self.turns and not self.summary:
+            return ""
+        budget = history_tokens
+        lines = []
+        if self.summary:
+            summary = "Earlier: " + "; ".join(self.summary)
+            summary = truncate_tokens(summary, min(summary_tokens, budget))
+            budget -= count_tokens(summary)
+        recent = []
+        for turn in reversed(self.turns):
+            text = truncate_tokens(f"User: {turn['question']}\nAssistant: {turn['answer']}", max(budget, 0))
+            tokens = count_tokens(text)
+            if tokens > budget:
+                break
+            recent.append(text)
+            budget -= tokens
+        if self.summary:
+            lines.append(summary)
+        lines.extend(reversed(recent))
+        return "\n".join(lines)
+
+    def new_terms(self, question: str) -> set:
+        return {term for term in tokenize(question) if term not in stopwords and term not in followup_words}
+
+    def retrieval_mode(self, question: str) -> str:
+        """
+        How a question in this conversation finds its context. reuse: it names nothing new ("why?",
+        "explain that"), so the previous turn's chunks are used without searching. expand: a short
+        follow-up ("what about page 12?") is searched together with the previous question. fresh:
+        a first or self-contained question is searched on its own.
+        """
+        if not self.turns:
+            return "fresh"
+        terms = self.new_terms(question)
+        if not terms and self.turns[-1]["references"]:
+            return "reuse"
+        if len(terms) < followup_terms:
+            return "expand"
+        return "fresh"
+
+    def search_query(self, question: str) -> str:
+        return f"{self.turns[-1]['question']} {question}"
+
+    def chunk_ids(self) -> list:
+        return list(dict.fromkeys(id for turn in self.turns for reference in turn["references"] for id in reference["ids"]))
+
+    # What a /query response says about the conversation it continued
+    def status(self) -> dict:
+        return {"id": self.id, "turns": self.turn_count, "retrieval": self.last_retrieval}
+
+    def describe(self) -> dict:
+        history = self.history_text()
+        return {
+            "session_id": self.id,
+            "document_id": self.document_id,
+            "turns": self.turn_count,
+            "recent": [{"question": turn["question"], "answer": turn["answer"]} for turn in self.turns],
+            "summary": self.summary,
+            "chunk_ids": self.chunk_ids(),
+            "history_tokens": count_tokens(history) if history else 0,
+            "expires_in": max(round(self.updated + session_ttl - time.time()), 0)
+        }
+
+class SessionStore:
+    """
+    Conversations by session id: the most recently used max_sessions in memory, expiring ttl
+    seconds after their last turn. With a path, every session is also written to SQLite, so
+    sessions evicted from memory or from before a restart are loaded back on their next turn.
+    """
+
+    def __init__(self, max_entries: int = max_sessions, ttl: float = session_ttl, path: str = session_path):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # id -> Session, least recently used first
+        self.locks = {}  # id -> asyncio.Lock, so the turns of one conversation run one at a time
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT, updated REAL)")
+            self.db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - ttl,))
+            self.db.commit()
+
+    def _expired(self, session: Session) -> bool:
+        return time.time() - session.updated > self.ttl
+
+    def _remember(self, session: Session):
+        self.entries[session.id] = session
+        self.entries.move_to_end(session.id)
+        while len(self.entries) > self.max_entries:
+            oldest, _ = self.entries.popitem(last=False)
+            self.locks.pop(oldest, None)
+            session_events.inc(event="evicted")
+
+    def create(self, document_id: str) -> Session:
+        session = Session(secrets.token_urlsafe(16), document_id)
+        session_events.inc(event="created")
+        self.save(session)
+        return session
+
+    def get(self, id: str):
+        session = self.entries.get(id)
+        if session is None and self.db is not None:
+            row = self.db.execute("SELECT data FROM sessions WHERE id = ?", (id,)).fetchone()
+            if row:
+                session = Session.from_dict(json.loads(row[0]))
+                session_events.inc(event="loaded")
+        if session is None:
+            return None
+        if self._expired(session):
+            session_events.inc(event="expired")
+            self.delete(id)
+            return None
+        self._remember(session)
+        return session
+
+    def save(self, session: Session):
+        self._remember(session)
+        if self.db is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated) VALUES (?, ?, ?)",
+                (session.id, json.dumps(session.to_dict()), session.updated)
+            )
+            self.db.commit()
+
+    def delete(self, id: str) -> bool:
+        found = self.entries.pop(id, None) is not None
+        self.locks.pop(id, None)
+        if self.db is not None:
+            found = self.db.execute("DELETE FROM sessions WHERE id = ?", (id,)).rowcount > 0 or found
+            self.db.commit()
+        return found
+
+    def lock(self, id: str) -> asyncio.Lock:
+        return self.locks.setdefault(id, asyncio.Lock())
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
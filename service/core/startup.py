@@ -0,0 +1,66 @@
+import os, time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# Build or update the index when the app starts. Replicas that mount a prebuilt index (python -m
+# core.indexer --publish) set this to false, then a missing or mismatched index fails readiness.
+index_on_start = os.getenv('INDEX_ON_START', 'true').lower() == 'true'
+
+class StartupProfile:
+    """
+    How long each startup phase took, from the first app import until the service is ready.
+    /readyz reports it, and it is printed once the service is ready or startup failed.
+    """
+
+    def __init__(self, started_at: float = None):
+        self.started_at = started_at or time.perf_counter()
+        self.phases = {}
+        self.current = None
+        self.failed_phase = None
+        self.ready_seconds = None
+        self.error = None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_seconds is not None
+
+    @contextmanager
+    def phase(self, name: str):
+        self.current = name
+        start_time = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            # current is cleared below, before mark_failed runs
+            self.failed_phase = name
+            raise
+        finally:
+            self.phases[name] = round(time.perf_counter() - start_time, 3)
+            self.current = None
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = round(seconds, 3)
+
+    def mark_ready(self):
+        self.ready_seconds = round(time.perf_counter() - self.started_at, 3)
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        print(f"READY in {self.ready_seconds:.2f}s ({phases})")
+
+    def mark_failed(self, error: Exception):
+        self.error = f"{type(error).__name__}: {error}"
+        print(f"STARTUP FAILED during {self.failed_phase or self.current or 'startup'}: {self.error}")
+
+    def report(self) -> dict:
+        status = "ready" if self.ready else "failed" if self.error else "starting"
+        report = {"status": status, "phases": self.phases}
+        if self.ready:
+            report["ready_seconds"] = self.ready_seconds
+        elif self.error:
+            report["phase"] = self.failed_phase
+            report["error"] = self.error
+        else:
+            report["phase"] = self.current
+            report["elapsed_seconds"] = round(time.perf_counter() - self.started_at, 3)
+        return report
@@ -0,0 +1,26 @@
+from functools import lru_cache
+
+# Loaded once per process; None when tiktoken cannot load the encoding (e.g. offline)
+@lru_cache(maxsize=None)
+def _encoding(encoding_name: str, model_name: str = None):
+    try:
+        import tiktoken
+        if model_name is None:
+            return tiktoken.get_encoding(encoding_name)
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            # Newer models than this tiktoken knows use o200k_base
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Could not load tokenizer {model_name or encoding_name}, estimating token counts instead: {e}")
+        return None
+
+# Token count for reporting and budgeting; text-embedding-3 and gpt-4 style models use cl100k_base.
+# With model_name the model's own encoding is used, e.g. to budget requests against its rate limit.
+def count_tokens(text: str, encoding_name: str = "cl100k_base", model_name: str = None) -> int:
+    encoding = _encoding(encoding_name, model_name)
+    if encoding is None:
+        # Fall back to ~4 characters per token
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
@@ -1,39 +1,112 @@
-import os, json
+import os, json, asyncio, hashlib, time
+from contextlib import nullcontext
+from bisect import bisect_right
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain.schema import Document  # Import the Document class
+from langchain_core.documents import Document  # Import the Document class
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
+from core.embeddings import CachedEmbeddings, create_embeddings, embedding_model_id
+from core.tokens import count_tokens
+from core.lexical import reciprocal_rank_fusion
+from core.numpystore import NumpyVectorStore
+from core.metrics import record_stage, indexed_chunks
 
 load_dotenv(override=True)
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
 db_path = os.getenv('CHROMA_PATH')
+vector_backend = os.getenv('VECTOR_BACKEND', 'chroma')  # chroma, or numpy for the in-process memory-mapped index
 
-embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, model="text-embedding-3-large")
+# Cached so repeated questions and re-ingested chunks skip the embedding request (EMBEDDING_PROVIDER picks the model).
+# The model itself is created on first use, which keeps its imports and weights off the app's import path.
+embedding_model = embedding_model_id()
+embeddings = CachedEmbeddings(lambda: create_embeddings()[0], model_name=embedding_model)
+
+# Bounded pool for the blocking vector search so it never runs on the event loop
+search_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SEARCH_THREADS', '8')), thread_name_prefix="chroma-search")
+
+# Hybrid retrieval: fuse BM25 and vector rankings, and answer confident lexical matches without embedding
+rrf_k = int(os.getenv('RRF_K', '60'))
+lexical_fast_path = os.getenv('LEXICAL_FAST_PATH', 'true').lower() == 'true'
+
+# Chunking: sizes are in tokens of the embedding model's tokenizer
+chunk_tokens = int(os.getenv('CHUNK_TOKENS', '400'))
+chunk_overlap_tokens = int(os.getenv('CHUNK_OVERLAP_TOKENS', '100'))
+page_separator = "\n\n"
+
+# Ingestion: chunks embedded per request and embedding requests running at once
+embed_batch_size = int(os.getenv('EMBED_BATCH_SIZE', '256'))
+embed_workers = int(os.getenv('EMBED_WORKERS', '4'))
 
 # DB exists, loading it only
-def load_chroma(persist_directory):
+def load_chroma(persist_directory, backend=None):
+    if (backend or vector_backend) == "numpy":
+        return NumpyVectorStore(persist_directory, embedding_function=embeddings)
+    # chromadb is only imported when the Chroma backend is used
+    from langchain_chroma import Chroma
     vectorstore = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
     return vectorstore
 
-# Step 1: Load and split the document into chunks
-def split_document_into_chunks(documents, chunk_size=1500, overlap=500):
+# Release a store's Chroma system (SQLite connection, HNSW index in memory); the object is unusable afterwards
+def close_chroma(vectorstore):
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.close()
+        return
+    from chromadb.api.shared_system_client import SharedSystemClient
+    system = SharedSystemClient._identifier_to_system.pop(vectorstore._client._identifier, None)
+    if system is not None:
+        system.stop()
+
+# Step 1: Split the document into chunks of at most chunk_size tokens. Consecutive pages of the same
+# section are split as one text, so chunks can run across a page break but never across a section
+# boundary. Pages are streamed in and only one section is held in memory at a time.
+def split_document_into_chunks(documents, chunk_size=None, overlap=None, sections=None):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter  # Only needed when indexing
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,  # Define the chunk size
-        chunk_overlap=overlap,  # Define the overlap between chunks
-        length_function=len  # Use length of characters to determine the chunk size
+        chunk_size=chunk_size or chunk_tokens,  # Define the chunk size
+        chunk_overlap=overlap if overlap is not None else chunk_overlap_tokens,  # Define the overlap between chunks
+        length_function=count_tokens,  # Measure chunks in model tokens rather than characters
+        add_start_index=True
     )
-    return text_splitter.split_documents(documents)
+    for section, pages in group_pages_by_section(documents, sections):
+        yield from split_section(text_splitter, section, pages)
+
+# Runs of consecutive pages that belong to the same section; pages outside every section stand alone
+def group_pages_by_section(documents, sections=None):
+    current, pages = None, []
+    for document in documents:
+        section = sections.section_for(document.metadata.get('page', 0)) if sections is not None else None
+        if pages and (section is None or section is not current):
+            yield current, pages
+            pages = []
+        current = section
+        pages.append(document)
+    if pages:
+        yield current, pages
+
+def split_section(text_splitter, section, pages):
+    offsets = []  # Where each page starts in the joined text
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page.page_content) + len(page_separator)
+    text = page_separator.join(page.page_content for page in pages)
+    metadata = {'source': pages[0].metadata.get('source')}
+    if section is not None:
+        metadata['section_name'] = section['sectionName']
+    for chunk in text_splitter.create_documents([text], [metadata]):
+        start = chunk.metadata['start_index']
+        first = pages[max(bisect_right(offsets, start) - 1, 0)]
+        last = pages[max(bisect_right(offsets, start + len(chunk.page_content) - 1) - 1, 0)]
+        chunk.metadata['page'] = first.metadata.get('page')
+        chunk.metadata['page_end'] = last.metadata.get('page')
+        yield chunk
 
 # Step 2: Load summaries from docSummary.json and create chunks
 def load_summaries_from_json(file_path):
     # Determine the absolute path to the summary file
     root_dir = Path(__file__).resolve().parent.parent
-    print('sum doc', file_path)
     summary_file_path = f"{root_dir}/{file_path}"
-    print('sum path', summary_file_path)
     # Check if the file exists
     if not os.path.exists(summary_file_path):
         print(f"Warning: The file {summary_file_path} does not exist.")
@@ -64,25 +137,163 @@ def load_summaries_from_json(file_path):
 
     return summary_chunks
 
+# Deterministic ID from a chunk's content and location, so re-ingesting the same chunk is a no-op
+def chunk_id(chunk: Document) -> str:
+    metadata = chunk.metadata
+    key = json.dumps([
+        metadata.get('page'),
+        metadata.get('section_name'),
+        metadata.get('start_index'),
+        chunk.page_content
+    ])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+# Embed (id, chunk) pairs in batches on a thread pool and write each batch as soon as it is embedded.
+# Only a few batches are held in memory at once, however many chunks the iterator produces.
+def embed_and_store(vectorstore, id_chunks, batch_size=None, workers=None):
+    batch_size = batch_size or embed_batch_size
+    workers = workers or embed_workers
+    embedding_function = vectorstore.embeddings
+    collection = vectorstore._collection
+    totals = {"chunks": 0, "tokens": 0, "batches": 0}
+    start_time = time.time()
+
+    def embed(batch):
+        texts = [chunk.page_content for _, chunk in batch]
+        batch_start = time.perf_counter()
+        vectors = embedding_function.embed_documents(texts)
+        record_stage("index_embed", time.perf_counter() - batch_start)
+        return batch, vectors, sum(count_tokens(text) for text in texts)
+
+    def write(future):
+        batch, vectors, tokens = future.result()
+        collection.upsert(
+            ids=[id for id, _ in batch],
+            embeddings=vectors,
+            documents=[chunk.page_content for _, chunk in batch],
+            metadatas=[chunk.metadata or None for _, chunk in batch]
+        )
+        totals["chunks"] += len(batch)
+        totals["tokens"] += tokens
+        totals["batches"] += 1
+        indexed_chunks.inc(len(batch), unit="chunks")
+        indexed_chunks.inc(tokens, unit="tokens")
+
+    id_chunks = iter(id_chunks)
+    # The numpy backend writes its index once at the end rather than after every batch
+    buffered_writes = getattr(collection, "buffered_writes", nullcontext)
+    with buffered_writes(), ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+        in_flight = set()
+        while True:
+            batch = list(islice(id_chunks, batch_size))
+            if not batch:
+                break
+            in_flight.add(executor.submit(embed, batch))
+            # Backpressure: wait for a batch to finish before reading more chunks
+            while len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+        for future in in_flight:
+            write(future)
+
+    elapsed = time.time() - start_time
+    totals["seconds"] = elapsed
+    totals["chunks_per_second"] = totals["chunks"] / elapsed if elapsed else 0.0
+    totals["tokens_per_second"] = totals["tokens"] / elapsed if elapsed else 0.0
+    return totals
+
+# Make the collection hold exactly these chunks: add the new ones and delete the stale ones.
+# chunks can be any iterable, it is consumed once as a stream.
+def sync_chunks_in_chroma(vectorstore, chunks, batch_size=None, workers=None):
+    existing_ids = set(vectorstore.get(include=[])['ids'])
+    seen_ids = set()
+
+    def new_chunks():
+        for chunk in chunks:
+            id = chunk_id(chunk)
+            if id in seen_ids:
+                continue
+            seen_ids.add(id)
+            if id not in existing_ids:
+                yield id, chunk
+
+    totals = embed_and_store(vectorstore, new_chunks(), batch_size=batch_size, workers=workers)
+
+    stale_ids = list(existing_ids - seen_ids)
+    for i in range(0, len(stale_ids), 1000):
+        vectorstore.delete(ids=stale_ids[i:i + 1000])
+
+    print(f"Index sync: {totals['chunks']} added, {len(stale_ids)} removed, {len(seen_ids) - totals['chunks']} unchanged")
+    return {**totals, "added": totals["chunks"], "removed": len(stale_ids), "total": len(seen_ids), "ids": sorted(seen_ids)}
+
 # Step 3: Unified storage of document chunks and summaries in Chroma
 def store_all_chunks_in_chroma(doc_chunks, summary_chunks, persist_directory=db_path):
-    # Combine document chunks and summary chunks
-    all_chunks = doc_chunks + summary_chunks
-
-    # Create or load vectorstore
-    if os.path.exists(persist_directory):
-        vectorstore = load_chroma(persist_directory)
-        vectorstore.add_documents(documents=all_chunks)
-    else:
-        vectorstore = Chroma.from_documents(
-            documents=all_chunks,  # List of all chunk objects
-            embedding=embeddings,
-            persist_directory=persist_directory  # Path to save Chroma data
-        )
+    # Stream document chunks then summary chunks without building one combined list
+    all_chunks = chain(doc_chunks, summary_chunks)
+
+    # Create or load the vectorstore, then upsert by chunk ID so nothing is duplicated
+    vectorstore = load_chroma(persist_directory)
+    sync_chunks_in_chroma(vectorstore, all_chunks)
 
     return vectorstore
 
 # Query the vector store
-def query_vector_store(vectorstore, query):
-    results = vectorstore.similarity_search_with_score(query, k=7)
+def query_vector_store(vectorstore, query, k=7):
+    results = vectorstore.similarity_search_with_score(query, k=k)
+    return results
+
+# Async query: embed without blocking the event loop, then search on the bounded thread pool.
+# filter is a Chroma where clause on chunk metadata, e.g. {"page": 3}; only matching chunks are searched.
+async def aquery_vector_store(vectorstore, query, k=7, query_embedding=None, filter=None):
+    if query_embedding is None:
+        query_embedding = await vectorstore.embeddings.aembed_query(query)
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(
+        search_executor,
+        lambda: vectorstore.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k, filter=filter)
+    )
     return results
+
+# Search many query embeddings in one call. Returns one list of (document, distance) per query.
+async def aquery_vector_store_batch(vectorstore, query_embeddings, k=7, filter=None):
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(
+        search_executor,
+        lambda: vectorstore._collection.query(query_embeddings=query_embeddings, n_results=k, where=filter, include=["documents", "metadatas", "distances"])
+    )
+    return [
+        [(Document(page_content=text, metadata=metadata or {}), distance) for text, metadata, distance in zip(texts, metadatas, distances)]
+        for texts, metadatas, distances in zip(results["documents"], results["metadatas"], results["distances"])
+    ]
+
+# Stored chunks by id, in the order asked for; ids that are not stored are left out
+async def aget_chunks(vectorstore, ids: list) -> list:
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(search_executor, lambda: vectorstore.get(ids=ids, include=["documents", "metadatas"]))
+    found = {
+        id: {"id": id, "text": text, "metadata": metadata or {}}
+        for id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+    }
+    return [found[id] for id in ids if id in found]
+
+# The same chunks as (id, Document) pairs, to answer from an earlier answer's context without searching
+async def aget_documents(vectorstore, ids: list) -> list:
+    return [(chunk["id"], Document(page_content=chunk["text"], metadata=chunk["metadata"])) for chunk in await aget_chunks(vectorstore, ids)]
+
+# Combine vector results (document, distance) with BM25 results (index, score) by reciprocal rank fusion.
+# Returns (document, fused score) pairs, higher is better.
+def fuse_results(dense_results, lexical_index, lexical_results, k=7):
+    documents = {}
+    dense_ids = []
+    for document, _ in dense_results:
+        id = chunk_id(document)
+        documents.setdefault(id, document)
+        dense_ids.append(id)
+    lexical_ids = []
+    for index, _ in lexical_results:
+        id = lexical_index.ids[index]
+        documents.setdefault(id, lexical_index.document(index))
+        lexical_ids.append(id)
+    fused = reciprocal_rank_fusion([dense_ids, lexical_ids], rrf_k=rrf_k)
+    return [(documents[id], score) for id, score in fused[:k]]
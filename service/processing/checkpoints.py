@@ -0,0 +1,49 @@
+import os, json, hashlib, logging
+
+class CheckpointStore:
+    """
+    Content-addressed store of finished summaries. The key is a hash of everything that
+    determines a summary (text, section name, authors, prompt template and model), so an
+    unchanged section or page group is found again on the next run and edited ones are not.
+    """
+
+    def __init__(self, directory: str, force: bool = False):
+        self.directory = directory
+        self.force = force  # When set, existing checkpoints are ignored and overwritten
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(text: str, section_name: str, author, template: str, model_name: str) -> str:
+        payload = json.dumps([text, section_name, author, template, model_name])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        if not self.force and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    summary = json.load(f)['summary']
+                self.hits += 1
+                return summary
+            except (json.JSONDecodeError, KeyError) as e:
+                logging.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+        self.misses += 1
+        return None
+
+    def put(self, key: str, summary: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so a crash never leaves a half written checkpoint
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"summary": summary}, f)
+        os.replace(temp_path, path)
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        return f"Checkpoints: {self.hits} reused, {self.misses} summarized ({total} total)"
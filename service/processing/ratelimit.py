@@ -0,0 +1,62 @@
+import asyncio, time, logging
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.available = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    async def take(self, amount: float):
+        # Requests larger than the bucket would wait forever, cap them at a full bucket
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.refill_per_second)
+
+class RateLimiter:
+    """
+    Keeps LLM calls within the configured requests-per-minute and tokens-per-minute. A 429
+    with Retry-After pauses every caller, not just the one that was rejected.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.blocked_until = 0.0
+
+    async def acquire(self, tokens: int):
+        delay = self.blocked_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self.requests.take(1)
+        await self.tokens.take(tokens)
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        logging.info(f"Rate limited, pausing all requests for {seconds:.2f} seconds")
+
+# Seconds the server asked us to wait, if the error carries a Retry-After header
+def retry_after_seconds(error: Exception):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        return None
+    return None
@@ -1,32 +1,33 @@
 # summarization.py
-from langchain_community.document_loaders import PyPDFLoader
 from pathlib import Path
-import os
+import os, sys
 import json
 import logging
 import random, time
+import asyncio, argparse
+from contextlib import contextmanager
 from typing import List, Dict
 from langchain_openai import ChatOpenAI
-from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from tqdm import tqdm  # Added tqdm for progress tracking
 from dotenv import load_dotenv
 
+# Allow running as a script from ./processing while importing shared modules from the service root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from processing.ratelimit import RateLimiter, retry_after_seconds
+from processing.checkpoints import CheckpointStore
+from core.pagestore import open_pages
+from core.tokens import count_tokens
+from core.metrics import stage, record_stage, record_llm_tokens, summary_sections, render as render_metrics
+
 load_dotenv(override=True)
 
 doc_name = os.getenv('DOCUMENT_TITLE')
-
-def load_document(file_path: str):
-    print("starting load...")
-    # Get the absolute path to ensure it's correct relative to the root
-    root_dir = Path(__file__).resolve().parent.parent
-    full_path = f"{root_dir}/{file_path}"
-    # Load the document
-    loader = PyPDFLoader(full_path)
-    documents = loader.load()
-    # validate - delete these later
-    print(f"Loaded {len(documents)} pages from the PDF")
-    return documents
+concurrency = int(os.getenv('SUMMARY_CONCURRENCY', '8'))
+requests_per_minute = int(os.getenv('SUMMARY_RPM', '500'))
+tokens_per_minute = int(os.getenv('SUMMARY_TPM', '200000'))
+checkpoint_dir = os.getenv('SUMMARY_CHECKPOINTS', 'summary_checkpoints')
+metrics_file = os.getenv('SUMMARY_METRICS_FILE', 'summary_metrics.prom')
 
 # Configure logging
 logging.basicConfig(
@@ -82,14 +83,17 @@ def get_summary_prompt(section_name: str, author: str, token_limit: int) -> Prom
     )
     return prompt
 
-def summarize_text(llm: ChatOpenAI, text: str, prompt: PromptTemplate, retries: int = 5, backoff_factor: int = 2, max_delay: int = 60) -> str:
+async def asummarize_text(llm: ChatOpenAI, text: str, prompt: PromptTemplate, limiter: RateLimiter, max_tokens: int, retries: int = 5, backoff_factor: int = 2, max_delay: int = 60) -> str:
     """
-    Summarizes text using the LLM with retry logic and exponential backoff to avoid overwhelming the server.
+    Summarizes text using the LLM, waiting on the shared rate limiter before each call. Failed
+    calls are retried with exponential backoff, or after Retry-After when the API sends one.
 
     Args:
         llm (ChatOpenAI): The initialized LangChain LLM.
         text (str): The text to summarize.
         prompt (PromptTemplate): The prompt template for summarization.
+        limiter (RateLimiter): Shared requests/tokens per minute limiter.
+        max_tokens (int): Expected completion size, counted against the tokens per minute.
         retries (int): Maximum number of retry attempts.
         backoff_factor (int): Base multiplier for exponential backoff.
         max_delay (int): Maximum delay between retries.
@@ -97,114 +101,167 @@ def summarize_text(llm: ChatOpenAI, text: str, prompt: PromptTemplate, retries:
     Returns:
         str: The generated summary.
     """
+    prompt_text = prompt.format(text=text)
+    request_tokens = count_tokens(prompt_text, model_name=getattr(llm, "model_name", "gpt-4o-mini")) + max_tokens
     for attempt in range(retries):
         try:
-            # Use the prompt to generate a formatted prompt string with the actual content
-            prompt_text = prompt.format(text=text)
+            await limiter.acquire(request_tokens)
             start_time = time.time()
             logging.info(f"Starting summarization for prompt: {prompt.template[:50]}... with text length: {len(text)}")
-            # Generate the summary using the LLM
-            summary = llm.invoke(prompt_text)
+            with stage("summary_llm"):
+                summary = await llm.ainvoke(prompt_text)
             end_time = time.time()
             logging.info(f"Completed summarization in {end_time - start_time:.2f} seconds")
-            # Extract content if it's an AIMessage-like object
-            if hasattr(summary, 'content'):
-                return summary.content.strip()
-            else:
-                return summary.strip()
+            summary_text = summary.content.strip() if hasattr(summary, 'content') else summary.strip()
+            record_llm_tokens("summary", prompt_text, summary_text, summary)
+            return summary_text
 
         except Exception as e:
-            # Log the failure and retry, if it's not the last attempt
             logging.warning(f"Attempt {attempt + 1} failed with error: {e}")
 
             if attempt < retries - 1:
-                # Calculate exponential backoff delay with jitter
-                delay = min(max_delay, backoff_factor ** attempt + random.uniform(0, 1))
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    # The server told us how long to wait, hold back every worker for that long
+                    delay = retry_after
+                    limiter.pause(delay)
+                else:
+                    delay = min(max_delay, backoff_factor ** attempt + random.uniform(0, 1))
                 logging.info(f"Retrying in {delay:.2f} seconds...")
-                time.sleep(delay)  # Delay before retrying
+                await asyncio.sleep(delay)
             else:
                 logging.error(f"All {retries} attempts failed for summarization.")
                 raise e
 
+async def summarize_with_checkpoint(llm: ChatOpenAI, text: str, prompt: PromptTemplate, limiter: RateLimiter, max_tokens: int, checkpoints: CheckpointStore, section_name: str, author) -> str:
+    # Reuse the stored summary when the text, section, authors, prompt and model are unchanged
+    if checkpoints is None:
+        return await asummarize_text(llm, text, prompt, limiter, max_tokens)
+    key = checkpoints.key(text, section_name, author, prompt.template, getattr(llm, "model_name", None))
+    summary = checkpoints.get(key)
+    if summary is None:
+        summary = await asummarize_text(llm, text, prompt, limiter, max_tokens)
+        checkpoints.put(key, summary)
+    return summary
+
+def write_summary_log(section_name: str, log_text: str, summary: str):
+    # Write summary to log file - Remove this later
+    summary_log_file = "summaries_log.txt"
+    with open(summary_log_file, 'a') as log_file:
+        log_file.write(f"Section: {section_name} (Text length: {len(log_text)})\n")
+        log_file.write(f"Summary:\n{summary}\n")
+        log_file.write("=" * 50 + "\n")
+
+# Time a whole section and count it as summarized, skipped or failed
+@contextmanager
+def section_metrics(section: Dict):
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        summary_sections.inc(status="failed")
+        raise
+    else:
+        summary_sections.inc(status="summarized" if 'summary' in section else "skipped")
+    finally:
+        record_stage("summary_section", time.perf_counter() - start_time)
+
+def process_section(section: Dict, document: List, llm: ChatOpenAI, checkpoints: CheckpointStore = None) -> Dict:
+    # One section on its own, for callers without an event loop; the summaries come from aprocess_section
+    return asyncio.run(aprocess_section(section, document, llm, RateLimiter(requests_per_minute, tokens_per_minute), checkpoints))
 
+async def read_pages(document, start: int, end: int) -> List:
+    # Page extraction is CPU work, keep it off the event loop so other sections keep summarizing
+    return await asyncio.to_thread(lambda: document[start:end])
 
-def process_section(section: Dict, document: List, llm: ChatOpenAI) -> Dict:
+async def aprocess_section(section: Dict, document: List, llm: ChatOpenAI, limiter: RateLimiter, checkpoints: CheckpointStore = None) -> Dict:
+    """
+    Summarizes one section: up to 5 pages in a single request, longer sections in 5 page
+    groups whose summaries are then summarized together. The group summaries are requested
+    concurrently, then reduced into the final summary in page order. With a
+    checkpoint store, unchanged group and section summaries are reused instead of requested.
+    """
     section_name = section['sectionName']
     page_start, page_end = section['pageRange']
     author = section.get('author', None)
 
-    # Calculate number of pages
-    num_pages = page_end - page_start + 1
+    with section_metrics(section):
+        num_pages = page_end - page_start + 1
 
-    # Validate the page range before proceeding
-    if page_start < 1 or page_end > len(document):
-        logging.error(f"Page range for section '{section_name}' is out of bounds. Skipping this section.")
-        return section
+        if page_start < 1 or page_end > len(document):
+            logging.error(f"Page range for section '{section_name}' is out of bounds. Skipping this section.")
+            return section
 
-    try:
-        if num_pages <= 5:
-            # Concatenate pages by extracting 'page_content' from each document object
-            pages_text = " ".join(doc.page_content for doc in document[page_start - 1: page_end])
-            # Check if `pages_text` is empty
-            if not pages_text.strip():
-                logging.warning(f"No content found for section '{section_name}'. Skipping this section.")
-                return section
-            logging.info(f"Creating prompt for '{section_name}'.")
-            prompt = get_summary_prompt(section_name, author, 700)
-            logging.info(f"Summarizing '{section_name}'.")
-            summary = summarize_text(llm, pages_text, prompt)
-        else:
-            # Split into groups of 5 pages
-            group_summaries = []
-            for i in range(page_start, page_end + 1, 5):
-                group_end = min(i + 4, page_end)
-                if i - 1 >= len(document) or group_end > len(document):
-                    logging.error(f"Page range {i} to {group_end} for section '{section_name}' is out of bounds. Skipping this group.")
-                    continue
-
-                # Extract 'page_content' from each document object in the group
-                group_text = " ".join(doc.page_content for doc in document[i - 1: group_end])
-                # Check if `group_text` is empty
-                if not group_text.strip():
-                    logging.warning(f"No content found for pages {i}-{group_end} in section '{section_name}'. Skipping this group.")
-                    continue
-                
-                logging.info(f"Creating prompt for sub-section of '{section_name}'.")
-                prompt = get_summary_prompt(section_name, author, 500)
-                logging.info(f"Summarizing for sub-section of '{section_name}'.")
-                group_summary = summarize_text(llm, group_text, prompt)
-                logging.info(f"Appending to group summary for sub-section of '{section_name}'.")
-                group_summaries.append(group_summary)
-
-            # Concatenate group summaries and create final summary
-            if group_summaries:
-                logging.info(f"Validated that there is a group summary for '{section_name}'.")
-                concatenated_summaries = " ".join(group_summaries)
-                logging.info(f"Creating prompt after processign sub-sections for '{section_name}'.")
-                final_prompt = get_summary_prompt(section_name, author, 700)
-                logging.info(f"Summarizing after processign sub-sections for '{section_name}'.")
-                summary = summarize_text(llm, concatenated_summaries, final_prompt)
+        try:
+            if num_pages <= 5:
+                pages_text = " ".join(doc.page_content for doc in await read_pages(document, page_start - 1, page_end))
+                if not pages_text.strip():
+                    logging.warning(f"No content found for section '{section_name}'. Skipping this section.")
+                    return section
+                prompt = get_summary_prompt(section_name, author, 700)
+                logging.info(f"Summarizing '{section_name}'.")
+                summary = await summarize_with_checkpoint(llm, pages_text, prompt, limiter, 700, checkpoints, section_name, author)
             else:
-                logging.warning(f"No valid group summaries generated for section '{section_name}'. Skipping final summary.")
-                return section
-
-        # Add summary to section
-        section['summary'] = summary
-
-        # Write summary to log file - Remove this later
-        summary_log_file = "summaries_log.txt"
-        log_text = pages_text if num_pages <= 5 else concatenated_summaries
-        with open(summary_log_file, 'a') as log_file:
-            log_file.write(f"Section: {section_name} (Text length: {len(log_text)})\n")
-            log_file.write(f"Summary:\n{summary}\n")
-            log_file.write("=" * 50 + "\n")
-
-        logging.info(f"Summarized section: {section_name}")
-        return section
-    except Exception as e:
-        logging.error(f"Error processing section '{section_name}': {e}")
-        raise e
+                # Collect the valid 5 page groups, then summarize them all at once
+                group_texts = []
+                for i in range(page_start, page_end + 1, 5):
+                    group_end = min(i + 4, page_end)
+                    if i - 1 >= len(document) or group_end > len(document):
+                        logging.error(f"Page range {i} to {group_end} for section '{section_name}' is out of bounds. Skipping this group.")
+                        continue
+                    group_text = " ".join(doc.page_content for doc in await read_pages(document, i - 1, group_end))
+                    if not group_text.strip():
+                        logging.warning(f"No content found for pages {i}-{group_end} in section '{section_name}'. Skipping this group.")
+                        continue
+                    group_texts.append(group_text)
 
+                prompt = get_summary_prompt(section_name, author, 500)
+                logging.info(f"Summarizing {len(group_texts)} sub-sections of '{section_name}'.")
+                # gather keeps the results in page order regardless of completion order
+                group_summaries = await asyncio.gather(*(
+                    summarize_with_checkpoint(llm, text, prompt, limiter, 500, checkpoints, section_name, author) for text in group_texts
+                ))
+
+                if group_summaries:
+                    concatenated_summaries = " ".join(group_summaries)
+                    final_prompt = get_summary_prompt(section_name, author, 700)
+                    logging.info(f"Summarizing after processing sub-sections for '{section_name}'.")
+                    summary = await summarize_with_checkpoint(llm, concatenated_summaries, final_prompt, limiter, 700, checkpoints, section_name, author)
+                else:
+                    logging.warning(f"No valid group summaries generated for section '{section_name}'. Skipping final summary.")
+                    return section
+
+            section['summary'] = summary
+
+            log_text = pages_text if num_pages <= 5 else concatenated_summaries
+            write_summary_log(section_name, log_text, summary)
+
+            logging.info(f"Summarized section: {section_name}")
+            return section
+        except Exception as e:
+            logging.error(f"Error processing section '{section_name}': {e}")
+            raise e
+
+async def summarize_sections(sections: List[Dict], documents: List, llm: ChatOpenAI, checkpoints: CheckpointStore = None) -> List[Dict]:
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm(total=len(sections), desc="Processing sections")
+
+    async def run(section: Dict):
+        async with semaphore:
+            try:
+                return await aprocess_section(section, documents, llm, limiter, checkpoints)
+            except Exception as e:
+                logging.error(f"Error processing section '{section['sectionName']}': {e}")
+                print(f"Error processing section '{section['sectionName']}': {e}")
+                return None
+            finally:
+                progress.update(1)
+
+    # Sections run concurrently, results come back in TOC order like the sequential run
+    results = await asyncio.gather(*(run(section) for section in sections))
+    progress.close()
+    return [section for section in results if section is not None]
 
 def save_json(data: List[Dict], file_path: str):
     # Get the absolute path to ensure it's correct relative to the root
@@ -220,7 +277,16 @@ def save_text(content: str, file_path: str):
         f.write(content)
     logging.info(f"Saved summary to {file_path}.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Summarize document sections for the vectorstore.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--resume", action="store_true", default=True, help="Reuse checkpointed summaries for unchanged sections (default)")
+    mode.add_argument("--force", action="store_true", help="Ignore checkpoints and summarize every section again")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+
     # File paths
 
     input_toc = os.getenv('PRE_PROCESSED_SECTIONS')       # Preprocessed TOC
@@ -228,9 +294,6 @@ def main():
     output_json = os.getenv('SUMMARY')   # Output summaries
     model_name = os.getenv('SUMMARY_MODEL')
     
-    # Load PDF
-    documents = load_document(pdf_file)
-
     # Initialize LLM
     llm = initialize_llm(model_name=model_name)
     
@@ -243,17 +306,19 @@ def main():
         sections = json.load(f)
     logging.info(f"Loaded {len(sections)} sections from {input_toc}.")
     
-    summarized_sections = []
-
-    # Process each section one by one
-    for section in tqdm(sections, desc="Processing sections"):
-        try:
-            summarized_section = process_section(section, documents, llm)
-            summarized_sections.append(summarized_section)
-        except Exception as e:
-            logging.error(f"Error processing section '{section['sectionName']}': {e}")
-            print(f"Error processing section '{section['sectionName']}': {e}")
-            continue  # Stop processing on error
+    # Process sections concurrently within the configured rate limits
+    logging.info(f"Summarizing with concurrency {concurrency}, {requests_per_minute} RPM, {tokens_per_minute} TPM.")
+    checkpoints = CheckpointStore(checkpoint_dir, force=args.force)
+    # Pages come from the shared page cache, the PDF is only parsed if it changed
+    with open_pages(pdf_file) as documents:
+        logging.info(f"Opened {pdf_file} with {len(documents)} pages.")
+        summarized_sections = asyncio.run(summarize_sections(sections, documents, llm, checkpoints))
+    logging.info(checkpoints.report())
+    print(checkpoints.report())
+
+    # Same metrics as the service's /metrics, in the Prometheus text format
+    save_text(render_metrics(), metrics_file)
+    print(f"Metrics saved to {metrics_file}")
     
     # Save the summarized sections to docSummary.json
     try:
@@ -0,0 +1,57 @@
+import time
+from core.cache import AnswerCache
+
+answer = {"response": "Every spring.", "context": []}
+
+def test_exact_tier_matches_normalized_questions():
+    cache = AnswerCache(path=None)
+    cache.set_version("v1")
+    cache.put("When is the budget reviewed?", [1.0, 0.0], answer)
+    assert cache.get_exact("  when is the BUDGET reviewed ") == answer
+    assert cache.get_exact("When is the vote?") is None
+    assert cache.get_stats()["exact_hits"] == 1
+
+def test_entries_expire_after_the_ttl():
+    cache = AnswerCache(ttl=60, path=None)
+    cache.set_version("v1")
+    cache.put("When is the budget reviewed?", [1.0, 0.0], answer)
+    cache.entries["when is the budget reviewed"]["created"] = time.time() - 61
+    assert cache.get_similar([1.0, 0.0]) is None
+    assert cache.get_exact("When is the budget reviewed?") is None
+    assert not cache.entries
+
+def test_semantic_tier_needs_the_threshold():
+    cache = AnswerCache(threshold=0.95, path=None)
+    cache.set_version("v1")
+    cache.put("When is the budget reviewed?", [1.0, 0.0], answer)
+    assert cache.get_similar([0.99, 0.05]) == answer  # Cosine similarity about 0.999
+    assert cache.get_similar([0.7, 0.7]) is None  # About 0.71
+    stats = cache.get_stats()
+    assert (stats["semantic_hits"], stats["misses"]) == (1, 1)
+
+def test_version_change_drops_every_answer(tmp_path):
+    path = str(tmp_path / "answers.db")
+    cache = AnswerCache(path=path)
+    cache.set_version("v1")
+    cache.put("When is the budget reviewed?", [1.0, 0.0], answer)
+    # Answers survive a restart with the same version
+    reopened = AnswerCache(path=path)
+    reopened.set_version("v1")
+    assert reopened.get_exact("When is the budget reviewed?") == answer
+    reopened.set_version("v2")
+    assert reopened.get_exact("When is the budget reviewed?") is None
+    assert reopened.get_stats()["invalidations"] == 1
+    # The old version's rows are gone from disk too
+    assert AnswerCache(path=path).db.execute("SELECT COUNT(*) FROM answers").fetchone()[0] == 0
+    cache.close()
+    reopened.close()
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2, path=None)
+    cache.set_version("v1")
+    cache.put("first", [1.0, 0.0], answer)
+    cache.put("second", [0.0, 1.0], answer)
+    cache.get_exact("first")
+    cache.put("third", [0.7, 0.7], answer)
+    assert list(cache.entries) == ["first", "third"]
+    assert cache.get_stats()["evictions"] == 1
@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+from core.coalesce import SingleFlight
+from core.limits import ConcurrencyLimiter
+from core.resilience import DeadlineExceeded, set_deadline
+
+def events(delay=0.0):
+    runs = []
+
+    async def produce():
+        runs.append(1)
+        yield {"event": "context", "data": []}
+        await asyncio.sleep(delay)
+        yield {"event": "token", "data": "answer"}
+    return produce, runs
+
+def test_joined_stream_that_finishes_first_is_replayed():
+    flights = SingleFlight()
+    limiter = ConcurrencyLimiter(max_concurrent=1)
+    produce, runs = events(0.01)
+
+    async def run():
+        first = await flights.stream("key", produce, on_start=limiter.acquire, on_finish=limiter.release)
+        second = await flights.stream("key", produce, on_start=limiter.acquire, on_finish=limiter.release)
+        first_events = [event async for event in first]
+        await asyncio.sleep(0.02)  # The stream is done before the second listener starts reading
+        return first_events, [event async for event in second]
+
+    first_events, second_events = asyncio.run(run())
+    assert first_events == second_events
+    assert len(runs) == 1
+    assert limiter.active == 0
+
+def test_stream_started_after_the_last_one_finished_takes_a_slot():
+    flights = SingleFlight()
+    limiter = ConcurrencyLimiter(max_concurrent=1)
+    produce, runs = events()
+
+    async def run():
+        for _ in range(2):
+            messages = await flights.stream("key", produce, on_start=limiter.acquire, on_finish=limiter.release)
+            assert limiter.active == 1
+            [event async for event in messages]
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert len(runs) == 2
+    assert limiter.active == 0
+
+def test_joiner_gives_up_at_its_own_deadline():
+    flights = SingleFlight()
+    produce, runs = events(0.3)
+
+    async def join():
+        set_deadline(0.05)
+        messages = await flights.stream("key", produce, settled=lambda event: event["event"] != "context")
+        return [event async for event in messages]
+
+    async def run():
+        leader = await flights.stream("key", produce)
+        joiner = asyncio.ensure_future(join())
+        with pytest.raises(DeadlineExceeded):
+            await joiner
+        # The leader, with no deadline of its own, still gets the whole answer
+        return [event async for event in leader]
+
+    leader_events = asyncio.run(run())
+    assert [event["event"] for event in leader_events] == ["context", "token"]
+    assert len(runs) == 1
+
+def test_joined_call_gives_up_at_its_own_deadline():
+    flights = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.2)
+        return "answer"
+
+    async def join():
+        set_deadline(0.05)
+        return await flights.do("key", compute)
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do("key", compute))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await join()
+        return await leader
+
+    assert asyncio.run(run()) == "answer"
@@ -0,0 +1,62 @@
+from langchain_core.documents import Document
+from core.context import adaptive_cutoff, mmr_order, merge_overlap, merge_same_page, assemble_context, page_range
+from core.llm import context_entry, context_reference
+from core.tokens import count_tokens
+
+def chunk(text: str, page: int = 1, page_end: int = None, start: int = 0) -> Document:
+    metadata = {"source": "doc.pdf", "page": page, "section_name": "Budget", "start_index": start}
+    if page_end is not None:
+        metadata["page_end"] = page_end
+    return Document(page_content=text, metadata=metadata)
+
+def test_adaptive_cutoff_stops_at_the_first_large_gap():
+    results = [(chunk(f"text {i}"), score) for i, score in enumerate([0.9, 0.88, 0.86, 0.85, 0.3, 0.29])]
+    assert [score for _, score in adaptive_cutoff(results, min_k=2, max_k=7, gap=0.3)] == [0.9, 0.88, 0.86, 0.85]
+
+def test_adaptive_cutoff_keeps_min_k_and_caps_at_max_k():
+    steep = [(chunk(f"text {i}"), score) for i, score in enumerate([0.9, 0.1, 0.09])]
+    assert len(adaptive_cutoff(steep, min_k=3, max_k=7, gap=0.3)) == 3
+    flat = [(chunk(f"text {i}"), 0.5) for i in range(10)]
+    assert len(adaptive_cutoff(flat, min_k=3, max_k=7)) == 7
+
+def test_mmr_order_moves_near_duplicates_back():
+    first = chunk("the budget is reviewed every year by the finance committee")
+    duplicate = chunk("the budget is reviewed every year by the finance committee again")
+    different = chunk("members elect a chair for a two term")
+    ordered = mmr_order([(first, 0.9), (duplicate, 0.89), (different, 0.85)], mmr_weight=0.5)
+    assert [document for document, _ in ordered] == [first, different, duplicate]
+    assert ordered[0][1] == 1.0  # Relevance normalized to the top candidate
+
+def test_merge_overlap_joins_at_the_seam():
+    first = "The committee meets in spring. The budget is reviewed every year."
+    second = "The budget is reviewed every year. Members elect a chair."
+    assert merge_overlap(first, second) == "The committee meets in spring. The budget is reviewed every year. Members elect a chair."
+    assert merge_overlap(first, first[10:30]) == first
+    assert merge_overlap(first, "Nothing in common with the other chunk at all.") is None
+
+def test_merged_entry_spans_the_pages_of_all_its_chunks():
+    first = chunk("The committee meets in spring. The budget is reviewed every year.", page=3)
+    second = chunk("The budget is reviewed every year. Members elect a chair on the next page.", page=3, page_end=4)
+    # MMR order may put the chunk that runs onto the next page first
+    merged = merge_same_page([(second, 0.8), (first, 0.9)])
+    assert len(merged) == 1
+    text, relevance, document, documents = merged[0]
+    assert relevance == 0.9
+    assert page_range(documents) == (3, 4)
+    assert context_entry(document, text, page_range(documents))["Page(s)"] == "3-4"
+    reference = context_reference(documents, relevance)
+    assert (reference["page"], reference["page_end"]) == (3, 4)
+
+def test_context_stays_within_the_token_budget():
+    results = [(chunk(f"Paragraph {i}: " + " ".join(f"word{i}x{j}" for j in range(80)), page=i), 0.9 - i * 0.01) for i in range(7)]
+    budget = 300
+    context_list, context, tokens_saved, references = assemble_context(results, context_entry, token_budget=budget, build_reference=context_reference)
+    assert 0 < len(context_list) < 7
+    assert count_tokens(context) <= budget
+    assert len(references) == len(context_list)
+    assert tokens_saved > 0
+
+def test_first_entry_is_kept_even_over_budget():
+    results = [(chunk(" ".join(f"word{j}" for j in range(200))), 0.9)]
+    context_list, _, _, _ = assemble_context(results, context_entry, token_budget=10)
+    assert len(context_list) == 1
@@ -0,0 +1,56 @@
+import asyncio
+import gc
+import pytest
+from langchain_core.embeddings import Embeddings
+import core.embeddings
+from core.embeddings import CachedEmbeddings
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, broken: bool = False):
+        self.calls = []
+        self.broken = broken
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        vectors = [[float(len(text)), 1.0] for text in texts]
+        # A provider that drops an input must not leave its batch waiting forever
+        return vectors[:-1] if self.broken else vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def test_concurrent_queries_share_one_batch():
+    underlying = CountingEmbeddings()
+    embeddings = CachedEmbeddings(underlying, "test", path=None)
+
+    async def run():
+        queries = [asyncio.ensure_future(embeddings.aembed_query(text)) for text in ("a", "bb", "a")]
+        await asyncio.sleep(0)
+        gc.collect()  # The flush task must survive a collection while it is pending
+        return await asyncio.wait_for(asyncio.gather(*queries), 1)
+
+    assert asyncio.run(run()) == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert underlying.calls == [["a", "bb"]]
+
+def test_failed_batch_fails_every_waiting_query():
+    embeddings = CachedEmbeddings(CountingEmbeddings(broken=True), "test", path=None)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(embeddings.aembed_query("a"), embeddings.aembed_query("bb")), 1)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+def test_batched_queries_match_single_queries(monkeypatch):
+    monkeypatch.setattr(core.embeddings, "max_batch_size", 2)
+    underlying = CountingEmbeddings()
+    embeddings = CachedEmbeddings(underlying, "test", path=None)
+
+    async def run():
+        batch = await embeddings.aembed_queries(["a", "bb", "ccc", "a"])
+        return batch, [await embeddings.aembed_query(text) for text in ("a", "bb", "ccc")]
+
+    batch, single = asyncio.run(run())
+    assert batch == single + [single[0]]
+    # Requests stay within the batch size and the single queries are all cache hits
+    assert underlying.calls == [["a", "bb"], ["ccc", "a"]]
@@ -0,0 +1,58 @@
+from core.lexical import BM25Index, reciprocal_rank_fusion
+
+texts = [
+    "The finance committee reviews the annual budget every spring.",
+    "Members elect a chair for a two year term at the general meeting.",
+    "The budget committee publishes its report in the autumn, after the budget vote.",
+    "Travel expenses are refunded within thirty days of the claim.",
+]
+metadatas = [{"section_name": "Budget"}, {"section_name": "Governance"}, {"section_name": "Budget"}, {"section_name": "Expenses"}]
+
+def index() -> BM25Index:
+    return BM25Index.build([f"chunk-{i}" for i in range(len(texts))], texts, metadatas)
+
+def test_scores_rank_chunks_by_term_weight():
+    results = index().search("budget committee", k=4)
+    # Chunk 2 mentions budget twice, chunk 0 once; the others match nothing and are left out
+    assert [position for position, _ in results] == [2, 0]
+    assert results[0][1] > results[1][1] > 0
+
+def test_rare_terms_outweigh_common_ones():
+    results = index().search("committee refunded", k=4)
+    assert results[0][0] == 3  # "refunded" is in one chunk, "committee" in two
+
+def test_search_respects_the_where_clause():
+    results = index().search("budget committee", k=4, where={"section_name": "Governance"})
+    assert results == []
+    assert [position for position, _ in index().search("chair", where={"section_name": "Governance"})] == [1]
+
+def test_coverage_ignores_stopwords():
+    lexical = index()
+    assert lexical.coverage("Who is the chair of the general meeting?", 1) == 1.0
+    assert lexical.coverage("chair budget", 1) == 0.5
+    assert lexical.coverage("what is it", 1) == 0.0
+
+def test_confident_only_with_full_coverage_and_a_clear_margin():
+    lexical = index()
+    query = "thirty days claim"
+    assert lexical.is_confident(query, lexical.search(query))
+    # Both budget chunks score close to each other: no clear winner
+    query = "budget committee"
+    assert not lexical.is_confident(query, lexical.search(query))
+    # A clear winner that misses a query term is not enough either
+    query = "refunded chair"
+    results = lexical.search(query)
+    assert lexical.coverage(query, results[0][0]) < 1.0
+    assert not lexical.is_confident(query, results)
+    assert not lexical.is_confident("anything", [])
+
+def test_rrf_sums_reciprocal_ranks():
+    fused = dict(reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], rrf_k=60))
+    assert fused["a"] == 1 / 61 + 1 / 62
+    assert fused["c"] == 1 / 63 + 1 / 61
+    assert fused["b"] == 1 / 62
+
+def test_rrf_ties_keep_first_seen_order():
+    # a and b get the same score; the one the first list ranks higher stays first
+    assert [id for id, _ in reciprocal_rank_fusion([["a", "b"], ["b", "a"]])] == ["a", "b"]
+    assert [id for id, _ in reciprocal_rank_fusion([["b", "a"], ["a", "b"]])] == ["b", "a"]
@@ -0,0 +1,55 @@
+import os, asyncio
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+from core.limits import ConcurrencyLimiter, OverloadedError
+from core.coalesce import SingleFlight
+
+# api.query loads the OpenAPI spec when it is imported
+os.environ.setdefault("OPENAPI_SPEC", str(Path(__file__).resolve().parent.parent / "openapi.yaml"))
+
+def test_full_queue_is_rejected_right_away():
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queued=0, timeout=5)
+
+    async def run():
+        await limiter.acquire()
+        with pytest.raises(OverloadedError, match="queue is full"):
+            await limiter.acquire()
+        limiter.release()
+        await limiter.acquire()  # The slot is free again
+        limiter.release()
+
+    asyncio.run(run())
+    assert (limiter.active, limiter.waiting) == (0, 0)
+
+def test_waiting_too_long_for_a_slot_is_rejected():
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queued=1, timeout=0.05)
+
+    async def run():
+        async with limiter:
+            with pytest.raises(OverloadedError, match="Timed out"):
+                await limiter.acquire()
+
+    asyncio.run(run())
+    assert (limiter.active, limiter.waiting) == (0, 0)
+
+def test_overloaded_query_gets_503_with_retry_after():
+    import httpx
+    from fastapi import FastAPI
+    from api.query import api_router
+
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queued=0, timeout=5)
+    registry = SimpleNamespace(get=lambda document_id: SimpleNamespace(id="default"))
+    app = FastAPI()
+    app.include_router(api_router, prefix="/api")
+    app.state.resources = SimpleNamespace(limiter=limiter, registry=registry, flights=SingleFlight())
+
+    async def run():
+        await limiter.acquire()  # Every slot is busy and nobody may queue
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [await client.post(path, json={"query": "When is the budget reviewed?"}) for path in ("/api/query", "/api/query/stream")]
+
+    for response in asyncio.run(run()):
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
+    assert limiter.active == 1  # Rejected requests never took a slot
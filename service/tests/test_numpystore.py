@@ -0,0 +1,30 @@
+import numpy as np
+from core.numpystore import NumpyCollection
+
+def vectors(count: int, seed: int) -> list:
+    return np.random.default_rng(seed).standard_normal((count, 8)).tolist()
+
+def test_buffered_upserts_write_once(tmp_path, monkeypatch):
+    collection = NumpyCollection(str(tmp_path))
+    saves = []
+    original_save = collection._save
+    monkeypatch.setattr(collection, "_save", lambda *args: saves.append(1) or original_save(*args))
+    with collection.buffered_writes():
+        for batch in range(5):
+            ids = [f"{batch}-{i}" for i in range(10)]
+            collection.upsert(ids=ids, embeddings=vectors(10, batch), documents=ids, metadatas=[{"page": batch}] * 10)
+        assert collection.count() == 0  # Not searchable until the block ends
+    assert len(saves) == 1
+    assert collection.count() == 50
+    assert NumpyCollection(str(tmp_path)).get(ids=["4-9"])["metadatas"] == [{"page": 4}]
+
+def test_update_does_not_change_a_live_snapshot(tmp_path):
+    collection = NumpyCollection(str(tmp_path))
+    collection.upsert(ids=["a", "b"], embeddings=vectors(2, 0), documents=["a", "b"])
+    before = collection.snapshot
+    old_row = np.array(before.matrix[0])
+    collection.upsert(ids=["a"], embeddings=vectors(1, 1), documents=["a2"])
+    assert np.array_equal(before.matrix[0], old_row)
+    assert not np.array_equal(collection.snapshot.matrix[0], old_row)
+    result = collection.query(query_embeddings=vectors(1, 1), n_results=1)
+    assert result["ids"] == [["a"]] and result["documents"] == [["a2"]]
@@ -0,0 +1,32 @@
+import asyncio
+from core.resilience import ResilientLLM
+
+class SlowStream:
+    def __init__(self):
+        self.closed = False
+
+    async def astream(self, input):
+        try:
+            await asyncio.sleep(10)
+            yield "never"
+        finally:
+            self.closed = True
+
+def test_cancelled_stream_ends_half_open_trial():
+    llm = ResilientLLM(SlowStream())
+    llm.breaker.opened_at = 0  # Open long enough ago that the next call is the half-open trial
+
+    async def cancel_before_first_token():
+        task = asyncio.ensure_future(llm.astream("q").__anext__())
+        await asyncio.sleep(0.05)
+        assert llm.breaker.trial_running
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancel_before_first_token())
+    assert not llm.breaker.trial_running
+    assert llm.breaker.allow()  # The next call can run the trial
+    assert llm.llm.closed
@@ -0,0 +1,50 @@
+import asyncio
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+import core.llm
+from core.llm import askLLMAsync, askLLMStream
+from core.cache import AnswerCache
+from core.sessions import Session
+from core.vectors import chunk_id
+
+chunk = Document(page_content="The budget is reviewed every year by the committee.", metadata={"page": 3, "section_name": "Budget", "start_index": 0})
+
+class FakeVectorStore:
+    # Only what a reused turn needs: chunks by id
+    def get(self, ids, include=None):
+        found = [id for id in ids if id == chunk_id(chunk)]
+        return {"ids": found, "documents": [chunk.page_content for _ in found], "metadatas": [chunk.metadata for _ in found]}
+
+async def fake_retrieve_context(question, vectorstore, cache=None, lexical_index=None, prompt=None, k=None, filter=None):
+    cached = cache.get_exact(question) if cache is not None else None
+    return cached, None if cached else [(chunk, 0.9)], [1.0, 0.0]
+
+def ask(question, cache, session, monkeypatch, stream=False):
+    monkeypatch.setattr(core.llm, "retrieve_context", fake_retrieve_context)
+    llm = FakeListChatModel(responses=["Because the committee says so."])
+    arguments = dict(llm=llm, vectorstore=FakeVectorStore(), cache=cache, session=session)
+    if not stream:
+        return asyncio.run(askLLMAsync(question, **arguments))
+
+    async def drain():
+        return [message async for message in askLLMStream(question, **arguments)]
+    return asyncio.run(drain())
+
+def test_followup_is_not_cached(monkeypatch):
+    cache = AnswerCache(path=None)
+    session = Session("s1", "default")
+    ask("How is the budget reviewed?", cache, session, monkeypatch)
+    assert cache.get_stats()["entries"] == 1  # The first turn is an ordinary question
+
+    ask("Why?", cache, session, monkeypatch)
+    assert session.last_retrieval == "reuse"
+    assert cache.get_stats()["entries"] == 1
+    assert cache.get_exact("why?") is None
+
+def test_streamed_followup_is_not_cached(monkeypatch):
+    cache = AnswerCache(path=None)
+    session = Session("s2", "default")
+    ask("How is the budget reviewed?", cache, session, monkeypatch, stream=True)
+    ask("Why?", cache, session, monkeypatch, stream=True)
+    assert session.turn_count == 2
+    assert cache.get_exact("why?") is None
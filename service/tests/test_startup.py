@@ -0,0 +1,15 @@
+from core.startup import StartupProfile
+
+def test_failure_reports_its_phase(capsys):
+    profile = StartupProfile()
+    try:
+        with profile.phase("registry"):
+            pass
+        with profile.phase("index"):
+            raise FileNotFoundError("No index")
+    except FileNotFoundError as e:
+        profile.mark_failed(e)
+    report = profile.report()
+    assert report["status"] == "failed"
+    assert report["phase"] == "index"
+    assert "during index" in capsys.readouterr().out
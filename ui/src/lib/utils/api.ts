@@ -11,7 +11,8 @@ export const queryService = async (query: string): Promise<string> => {
 			headers: {
 				'Content-Type': 'application/json',
 			},
-			body: JSON.stringify({ query }),
+			// Only the answer is shown, so skip the references
+			body: JSON.stringify({ query, context_mode: 'none' }),
 		});
 
 		if (!response.ok) {
@@ -26,3 +27,110 @@ export const queryService = async (query: string): Promise<string> => {
 		throw error;
 	}
 };
+
+export interface Reference {
+	ids: string[];
+	score: number;
+	page: number;
+	page_end: number;
+	section: string | null;
+}
+
+// Raised when a session expired or the server restarted without keeping it; start a new one and ask again
+export class SessionExpiredError extends Error {}
+
+// Starts a conversation; pass the id with each question so follow-ups are answered in context
+export const createSession = async (): Promise<string> => {
+	const backendUrl: string = __BACKEND__;
+
+	if (!backendUrl) {
+		throw new Error('Backend URL is not defined in the environment variables.');
+	}
+
+	const response = await fetch(`${backendUrl}/api/sessions`, {
+		method: 'POST',
+		headers: {
+			'Content-Type': 'application/json',
+		},
+		body: JSON.stringify({}),
+	});
+
+	if (!response.ok) {
+		throw new Error(`Error: ${response.status} ${response.statusText}`);
+	}
+
+	const data = await response.json();
+	return data.session_id;
+};
+
+export interface StreamHandlers {
+	onContext?: (context: unknown[]) => void;
+	// Reference ids only; their text is available from /api/chunks
+	onReferences?: (references: Reference[]) => void;
+	onToken: (token: string) => void;
+}
+
+// Streams the answer from /api/query/stream, calling onToken for each piece as it arrives
+export const streamQueryService = async (
+	query: string,
+	handlers: StreamHandlers,
+	sessionId?: string
+): Promise<void> => {
+	const backendUrl: string = __BACKEND__;
+
+	if (!backendUrl) {
+		throw new Error('Backend URL is not defined in the environment variables.');
+	}
+
+	const response = await fetch(`${backendUrl}/api/query/stream`, {
+		method: 'POST',
+		headers: {
+			'Content-Type': 'application/json',
+			Accept: 'text/event-stream',
+		},
+		body: JSON.stringify({
+			query,
+			context_mode: handlers.onContext ? 'full' : 'refs',
+			...(sessionId ? { session_id: sessionId } : {}),
+		}),
+	});
+
+	if (sessionId && response.status === 404) {
+		throw new SessionExpiredError(`Session ${sessionId} has expired`);
+	}
+	if (!response.ok || !response.body) {
+		throw new Error(`Error: ${response.status} ${response.statusText}`);
+	}
+
+	const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+	let buffer = '';
+
+	while (true) {
+		const { value, done } = await reader.read();
+		if (done) break;
+		buffer += value;
+
+		// Events are separated by a blank line
+		let boundary = buffer.indexOf('\n\n');
+		while (boundary !== -1) {
+			const rawEvent = buffer.slice(0, boundary);
+			buffer = buffer.slice(boundary + 2);
+			boundary = buffer.indexOf('\n\n');
+
+			let event = 'message';
+			let data = '';
+			for (const line of rawEvent.split('\n')) {
+				if (line.startsWith('event:')) event = line.slice(6).trim();
+				else if (line.startsWith('data:')) data += line.slice(5).trim();
+			}
+			if (!data) continue;
+
+			const payload = JSON.parse(data);
+			if (event === 'context') handlers.onContext?.(payload);
+			else if (event === 'references') handlers.onReferences?.(payload);
+			else if (event === 'token') handlers.onToken(payload);
+			else if (event === 'error') throw new Error(payload.detail);
+			else if (event === 'done') return;
+		}
+	}
+};
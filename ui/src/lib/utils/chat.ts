@@ -1,6 +1,6 @@
 import { writable, get, type Writable } from 'svelte/store';
 import { v4 as uuidv4 } from 'uuid';
-import { queryService } from './api';
+import { createSession, streamQueryService, SessionExpiredError } from './api';
 
 // Define types
 // Define types
@@ -32,6 +32,9 @@ export const askedQuestions: Writable<Question[]> = writable([]);
 export const selectedQuestion: Writable<Question | null> = writable(null);
 export const isModalOpen: Writable<boolean> = writable(false);
 export const isLoading: Writable<boolean> = writable(false); // NEW store for loading state
+
+// Server-side conversation, created with the first question so follow-ups like "why?" have context
+let sessionId: string | null = null;
 // Define functions
 // Function to add a message to the chat
 export const addMessage = (role: 'user' | 'assistant', text: string) => {
@@ -70,25 +73,39 @@ export const sendMessage = async (): Promise<void> => {
 	// Start loading
 	isLoading.set(true);
 
+	// Add an empty assistant message that fills in as tokens stream in
+	const responseId = uuidv4();
+	let responseText = '';
+	chatMessages.update((messages) => [
+		...messages,
+		{ id: responseId, role: 'assistant', text: '', questionId },
+	]);
+	const setResponseText = (text: string) => {
+		chatMessages.update((messages) =>
+			messages.map((message) => (message.id === responseId ? { ...message, text } : message))
+		);
+	};
+
+	const handlers = {
+		onToken: (token: string) => {
+			responseText += token;
+			setResponseText(responseText.replace(/\n/g, '<br>'));
+		},
+	};
+
 	try {
-		// Fetch the response from the backend using queryService
-		const systemResponse = await queryService(currentMessage);
-
-		// Add the assistant's response to the chat, tied to the question ID
-		chatMessages.update((messages) => [
-			...messages,
-			{ id: uuidv4(), role: 'assistant', text: systemResponse, questionId },
-		]);
+		// Stream the response from the backend, rendering each token as it arrives
+		sessionId ??= await createSession();
+		try {
+			await streamQueryService(currentMessage, handlers, sessionId);
+		} catch (error) {
+			if (!(error instanceof SessionExpiredError)) throw error;
+			// The conversation expired while idle: carry on in a new one
+			sessionId = await createSession();
+			await streamQueryService(currentMessage, handlers, sessionId);
+		}
 	} catch (error) {
-		chatMessages.update((messages) => [
-			...messages,
-			{
-				id: uuidv4(),
-				role: 'assistant',
-				text: 'An error occurred while processing your query. Please try again later.',
-				questionId,
-			},
-		]);
+		setResponseText('An error occurred while processing your query. Please try again later.');
 		console.error('Error during sendMessage:', error);
 	} finally {
 		// Stop loader